@@ -0,0 +1,123 @@
+# benchmarks/bench_client.py
+"""
+Compare the old thread-per-request generation path (one thread and one
+blocking requests.post per image) with AsyncNovelAIClient, against the local
+mock server in mock_novelai.py.
+
+    python benchmarks/bench_client.py [--requests 200] [--concurrency 1,8,32] [--latency 0.5] [--payload-kb 1024]
+
+The mock server runs in its own process so only the client side is measured.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+import subprocess
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nai_client import AsyncNovelAIClient  # noqa: E402
+
+BODY = json.dumps({"input": "1girl, scenery", "model": "nai-diffusion-3", "action": "generate",
+                   "parameters": {"seed": 1}}).encode('utf-8')
+TOKEN = "benchmark"
+
+
+def run_threaded(url, n_requests, concurrency):
+    # Mirrors the QThread path: a new thread and a new connection for every request
+    slots = threading.Semaphore(concurrency)
+    received = []
+    peak_threads = 0
+
+    def worker():
+        try:
+            response = requests.post(url, data=BODY, headers={"Authorization": f"Bearer {TOKEN}",
+                                                              "Content-Type": "application/json"})
+            received.append(len(response.content))
+        finally:
+            slots.release()
+
+    threads = []
+    for _ in range(n_requests):
+        slots.acquire()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        threads.append(thread)
+        peak_threads = max(peak_threads, threading.active_count())
+    for thread in threads:
+        thread.join()
+    return sum(received), peak_threads
+
+
+def run_async(url, n_requests, concurrency):
+    async def run():
+        async with AsyncNovelAIClient(url, max_concurrent=concurrency) as client:
+            results = await asyncio.gather(*(client.generate(BODY, TOKEN) for _ in range(n_requests)))
+        return sum(len(data) for data in results)
+    return asyncio.run(run()), threading.active_count()
+
+
+def server_stats(base_url, reset=False):
+    if reset:
+        requests.post(f"{base_url}/stats/reset")
+        return None
+    return requests.get(f"{base_url}/stats").json()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', default='1,8,32')
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--payload-kb', type=int, default=1024)
+    args = parser.parse_args()
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_novelai.py'),
+         '--port', str(port), '--latency', str(args.latency), '--payload-kb', str(args.payload_kb)],
+        stdout=subprocess.PIPE, text=True
+    )
+    try:
+        server.stdout.readline()  # Wait for the "listening" line
+        for _ in range(50):
+            try:
+                server_stats(base_url)
+                break
+            except requests.ConnectionError:
+                time.sleep(0.1)
+
+        print(f"{args.requests} requests, {args.latency}s server latency, {args.payload_kb} KB responses")
+        print(f"{'path':<9}{'conc':>5}{'wall s':>9}{'req/s':>9}{'cpu s':>8}{'threads':>9}{'conns':>7}")
+        for concurrency in (int(value) for value in args.concurrency.split(',')):
+            for name, run in (('threaded', run_threaded), ('async', run_async)):
+                n_requests = args.requests if concurrency > 1 else min(args.requests, 10)
+                server_stats(base_url, reset=True)
+                wall, cpu = time.perf_counter(), time.process_time()
+                received, threads = run(f"{base_url}/ai/generate-image", n_requests, concurrency)
+                wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+                stats = server_stats(base_url)
+                if stats['requests'].get(TOKEN) != n_requests or not received:
+                    print(f"{name}: server saw {stats['requests']} for {n_requests} requests")
+                print(f"{name:<9}{concurrency:>5}{wall:>9.2f}{n_requests / wall:>9.1f}{cpu:>8.2f}"
+                      f"{threads:>9}{stats['connections']:>7}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
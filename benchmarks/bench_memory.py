@@ -0,0 +1,110 @@
+# benchmarks/bench_memory.py
+"""
+Compare resident memory of the original dict/list loading against the compact
+Tag records and PromptStore.
+
+    python benchmarks/bench_memory.py [--tags naidv3_tags_pretty.json] [--prompts safebooru_clean.json]
+
+Without arguments a synthetic corpus is generated in a temporary directory.
+Each mode runs in its own subprocess so the measurements don't interfere.
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        import resource
+        # ru_maxrss is peak, not current, when /proc is unavailable
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def run_mode(mode, tags_path, prompts_path):
+    import gc
+    baseline = current_rss_mb()
+    if mode == 'dict':
+        with open(tags_path, 'r', encoding='utf-8') as f:
+            tags = json.load(f)['tags']
+        with open(prompts_path, 'r', encoding='utf-8') as f:
+            prompts = json.load(f)
+        # search_tags used to allocate one dict per result
+        results = [{**tag, 'power': max(tag.get('d_count', 0), tag.get('n_count', 0))} for tag in tags]
+    else:
+        from records import load_tags_file, PromptStore
+        tags = load_tags_file(tags_path)
+        prompts = PromptStore.from_json_file(prompts_path)
+        results = [tag for tag in tags]
+    gc.collect()
+    print(json.dumps({'mode': mode, 'tags': len(tags), 'prompts': len(prompts), 'results': len(results),
+                      'rss_mb': round(current_rss_mb() - baseline, 1)}))
+
+
+def make_synthetic(directory, n_tags, n_prompts):
+    random.seed(0)
+    categories = ['general', 'artist', 'copyright', 'character', 'meta']
+    groups = [f"group_{i}" for i in range(300)]
+    tags = [{
+        'tag_name': f"tag {i}",
+        'd_category': random.choice(categories),
+        'd_group': random.sample(groups, random.randint(0, 3)),
+        'd_count': random.randint(0, 10000),
+        'n_count': random.randint(0, 10000),
+    } for i in range(n_tags)]
+    tags_path = os.path.join(directory, 'tags.json')
+    with open(tags_path, 'w', encoding='utf-8') as f:
+        json.dump({'tags': tags}, f)
+    prompts_path = os.path.join(directory, 'prompts.json')
+    with open(prompts_path, 'w', encoding='utf-8') as f:
+        json.dump([', '.join(f"tag {random.randrange(n_tags)}" for _ in range(random.randint(5, 30)))
+                   for _ in range(n_prompts)], f)
+    return tags_path, prompts_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tags')
+    parser.add_argument('--prompts')
+    parser.add_argument('--synthetic-tags', type=int, default=40000)
+    parser.add_argument('--synthetic-prompts', type=int, default=500000)
+    parser.add_argument('--mode', choices=['dict', 'compact'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.tags, args.prompts)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.tags and args.prompts:
+            tags_path, prompts_path = args.tags, args.prompts
+        else:
+            tags_path, prompts_path = make_synthetic(directory, args.synthetic_tags, args.synthetic_prompts)
+
+        reports = {}
+        for mode in ('dict', 'compact'):
+            output = subprocess.run(
+                [sys.executable, __file__, '--mode', mode, '--tags', tags_path, '--prompts', prompts_path],
+                capture_output=True, text=True, check=True
+            ).stdout
+            reports[mode] = json.loads(output.strip().splitlines()[-1])
+
+    before, after = reports['dict']['rss_mb'], reports['compact']['rss_mb']
+    print(f"tags={reports['dict']['tags']} prompts={reports['dict']['prompts']}")
+    print(f"dict/list records: {before:8.1f} MB resident")
+    print(f"compact records:   {after:8.1f} MB resident")
+    if after:
+        print(f"reduction:         {before / after:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
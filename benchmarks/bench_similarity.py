@@ -0,0 +1,78 @@
+# benchmarks/bench_similarity.py
+"""
+Measure build time, query latency and quality of the prompt similarity index
+on a synthetic corpus where every prompt is drawn from one of a number of
+topics, so a good neighbour is one from the same topic.
+
+    python benchmarks/bench_similarity.py [--prompts 1000000] [--topics 5000] [--probe 8,16,32]
+
+Quality is the share of the 10 nearest neighbours that come from the query's
+topic, for the IVF index and for an exact scan of the same vectors.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import PromptStore  # noqa: E402
+from prompt_vectors import PromptVectorIndex  # noqa: E402
+
+
+def make_prompts(n_prompts, n_topics, seed=0):
+    rng = random.Random(seed)
+    topics = [[f"topic{t} tag{i}" for i in range(30)] for t in range(n_topics)]
+    common = [f"common tag{i}" for i in range(200)]
+    labels = [rng.randrange(n_topics) for _ in range(n_prompts)]
+    prompts = PromptStore(", ".join(rng.sample(topics[label], 10) + rng.sample(common, 8)) for label in labels)
+    return prompts, labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=1000000)
+    parser.add_argument('--topics', type=int, default=5000)
+    parser.add_argument('--probe', default='8,16,32')
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    prompts, labels = make_prompts(args.prompts, args.topics)
+    queries = random.Random(1).sample(range(len(prompts)), args.queries)
+    with tempfile.TemporaryDirectory() as directory:
+        folder = os.path.join(directory, "prompt_vectors")
+        start = time.perf_counter()
+        PromptVectorIndex.build(prompts, folder)
+        print(f"built index over {len(prompts)} prompts in {time.perf_counter() - start:.1f}s")
+        index = PromptVectorIndex.load(folder)
+
+        def same_topic(query, ids):
+            ids = [prompt_id for prompt_id in ids if prompt_id != query][:10]
+            return sum(labels[prompt_id] == labels[query] for prompt_id in ids) / max(len(ids), 1)
+
+        # Exact scan over the same stored vectors, for reference
+        exact = []
+        for query in queries[:50]:
+            vector = index.vectorizer.transform([prompts[query]])[0]
+            scores = np.concatenate([
+                index.vectors[i:i + 65536].astype(np.float32) @ vector for i in range(0, len(prompts), 65536)
+            ])
+            exact.append(same_topic(query, index.ids[np.argsort(-scores)[:11]]))
+        print(f"exact scan: same topic@10 {np.mean(exact):.2f}")
+
+        for probe in (int(value) for value in args.probe.split(',')):
+            index.search(prompts[queries[0]], 11, probe)  # Warm up the memory map
+            start = time.perf_counter()
+            results = [index.search(prompts[query], 11, probe) for query in queries]
+            elapsed = (time.perf_counter() - start) / len(queries) * 1000
+            quality = np.mean([same_topic(query, [prompt_id for prompt_id, _ in result])
+                               for query, result in zip(queries, results)])
+            print(f"n_probe={probe:<3} {elapsed:6.2f} ms/query  same topic@10 {quality:.2f}")
+
+
+if __name__ == "__main__":
+    main()
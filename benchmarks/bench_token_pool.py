@@ -0,0 +1,92 @@
+# benchmarks/bench_token_pool.py
+"""
+Run a batch of generation requests through a TokenPool against the mock
+server, which answers 429 whenever a token has more than --per-token-limit
+requests in flight (like NovelAI does for an account that is already
+generating).
+
+    python benchmarks/bench_token_pool.py [--requests 60] [--tokens 1,4] [--latency 0.5] [--payload-kb 256]
+
+Every run also includes a revoked token (401), one without Anlas (402) and
+one that is always rate limited (429), which the pool has to quarantine
+while the good tokens carry the load. For each number of good tokens it
+prints the throughput, what each token did, and the 429s the server sent for
+exceeding the per-token limit. With the budgets respected that should be 0.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nai_client import AsyncNovelAIClient  # noqa: E402
+from token_pool import TokenPool  # noqa: E402
+from mock_novelai import MockNovelAI, MockServerThread  # noqa: E402
+
+BODY = json.dumps({"input": "1girl, scenery", "model": "nai-diffusion-3", "action": "generate",
+                   "parameters": {"seed": 1}}).encode('utf-8')
+BAD_TOKENS = {"revoked": 401, "broke": 402, "busy": 429}
+
+
+def fetch_stats(url, reset=False):
+    base = url.rsplit("/ai/", 1)[0]
+    if reset:
+        urllib.request.urlopen(urllib.request.Request(base + "/stats/reset", method="POST")).read()
+        return None
+    with urllib.request.urlopen(base + "/stats") as response:
+        return json.load(response)
+
+
+def run_batch(url, n_tokens, n_requests, per_token_limit):
+    pool = TokenPool()
+    for token in BAD_TOKENS:
+        pool.add(token, token)
+    for i in range(n_tokens):
+        pool.add(f"account-{i}", f"account-{i}", max_concurrent=per_token_limit)
+
+    async def run():
+        async with AsyncNovelAIClient(url, max_concurrent=32) as client:
+            results = await asyncio.gather(*(pool.generate(client, BODY) for _ in range(n_requests)),
+                                           return_exceptions=True)
+        return [result for result in results if isinstance(result, Exception)]
+
+    start = time.perf_counter()
+    errors = asyncio.run(run())
+    return time.perf_counter() - start, errors, pool
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=60)
+    parser.add_argument('--tokens', default='1,4', help='Comma separated numbers of good tokens to try')
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--payload-kb', type=int, default=256)
+    parser.add_argument('--per-token-limit', type=int, default=1)
+    args = parser.parse_args()
+
+    server = MockServerThread(MockNovelAI(args.latency, args.payload_kb, BAD_TOKENS, args.per_token_limit))
+    url = server.start()
+    try:
+        for n_tokens in (int(value) for value in args.tokens.split(',')):
+            fetch_stats(url, reset=True)
+            elapsed, errors, pool = run_batch(url, n_tokens, args.requests, args.per_token_limit)
+            stats = fetch_stats(url)
+            print(f"{n_tokens} good tokens: {args.requests} requests in {elapsed:.1f} s "
+                  f"({args.requests / elapsed:.1f} req/s), {len(errors)} failed")
+            for line in pool.describe().splitlines():
+                print(f"  {line}")
+            good_limited = sum(count for token, count in stats['limited'].items() if token not in BAD_TOKENS)
+            peak = max((count for token, count in stats['peak_token_in_flight'].items() if token not in BAD_TOKENS),
+                       default=0)
+            print(f"  server: {stats['requests']}")
+            print(f"  429s for exceeding the per-token limit: {good_limited}, peak per token in flight: {peak}")
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
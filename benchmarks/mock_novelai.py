@@ -0,0 +1,162 @@
+# benchmarks/mock_novelai.py
+"""
+Local stand-in for NovelAI's /ai/generate-image, for benchmarks and for
+trying the generation code without spending Anlas.
+
+    python benchmarks/mock_novelai.py [--port 8765] [--latency 0.5] [--payload-kb 1024] [--per-token-limit 1]
+
+Every request waits latency seconds and returns a zip holding image_0.png,
+padded to roughly payload_kb. Tokens listed in statuses get that status code
+back instead (e.g. {"broke": 402}). With a per-token limit, a token that
+already has that many requests in flight gets 429, like an account NovelAI
+is already generating for. GET /stats returns request counts per token, the
+429s sent for the limit, the peak number of requests in flight (overall and
+per token) and the number of distinct client connections seen; POST
+/stats/reset clears them.
+"""
+import io
+import os
+import json
+import zlib
+import struct
+import asyncio
+import argparse
+import threading
+import zipfile
+from collections import Counter
+
+from aiohttp import web
+
+
+def _png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def make_image_zip(payload_kb=1024):
+    """A zip with a valid 64x64 grey image_0.png, padded with a private chunk to about payload_kb."""
+    width = height = 64
+    raw = b"".join(b"\x00" + bytes([128]) * width for _ in range(height))
+    png = b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)),
+        _png_chunk(b"IDAT", zlib.compress(raw)),
+        # Random bytes don't compress, so the response really is this large
+        _png_chunk(b"mpAd", os.urandom(max(payload_kb, 0) * 1024)),
+        _png_chunk(b"IEND", b""),
+    ))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zip_ref:
+        zip_ref.writestr("image_0.png", png)
+    return buffer.getvalue()
+
+
+class MockNovelAI:
+    def __init__(self, latency=0.5, payload_kb=1024, statuses=None, per_token_limit=None):
+        self.latency = latency
+        self.body = make_image_zip(payload_kb)
+        self.statuses = dict(statuses or {})
+        self.per_token_limit = per_token_limit
+        self.reset()
+
+    def reset(self):
+        self.requests = Counter()
+        self.limited = Counter()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.token_in_flight = Counter()
+        self.peak_token_in_flight = Counter()
+        self.connections = set()
+
+    async def generate(self, request):
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+        if not token:
+            return web.Response(status=401, text="Missing token")
+        await request.read()
+        self.requests[token] += 1
+        self.connections.add(request.transport.get_extra_info('peername'))
+        status = self.statuses.get(token)
+        if status:
+            return web.Response(status=status, text=f"Mock status {status}")
+        if self.per_token_limit and self.token_in_flight[token] >= self.per_token_limit:
+            self.limited[token] += 1
+            return web.Response(status=429, text="Concurrent generation is locked")
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        self.token_in_flight[token] += 1
+        self.peak_token_in_flight[token] = max(self.peak_token_in_flight[token], self.token_in_flight[token])
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+            self.token_in_flight[token] -= 1
+        return web.Response(body=self.body, content_type="application/x-zip-compressed")
+
+    async def stats(self, request):
+        return web.json_response({
+            'requests': dict(self.requests),
+            'limited': dict(self.limited),
+            'peak_in_flight': self.peak_in_flight,
+            'peak_token_in_flight': dict(self.peak_token_in_flight),
+            'connections': len(self.connections),
+        })
+
+    async def reset_stats(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def app(self):
+        app = web.Application(client_max_size=16 * 2 ** 20)
+        app.router.add_post("/ai/generate-image", self.generate)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_post("/stats/reset", self.reset_stats)
+        return app
+
+
+class MockServerThread:
+    """Runs a MockNovelAI on localhost in a background thread; url is set once it is listening."""
+
+    def __init__(self, mock, port=0):
+        self.mock = mock
+        self.port = port
+        self.url = None
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="MockNovelAI", daemon=True)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.runner = web.AppRunner(self.mock.app(), access_log=None)
+        self.loop.run_until_complete(self.runner.setup())
+        site = web.TCPSite(self.runner, "127.0.0.1", self.port)
+        self.loop.run_until_complete(site.start())
+        port = self.runner.addresses[0][1]
+        self.url = f"http://127.0.0.1:{port}/ai/generate-image"
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+
+    def start(self):
+        self.thread.start()
+        self.started.wait(10)
+        return self.url
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--payload-kb', type=int, default=1024)
+    parser.add_argument('--statuses', default='{}', help='JSON object of token -> status code')
+    parser.add_argument('--per-token-limit', type=int, help='Concurrent requests per token before 429')
+    args = parser.parse_args()
+    mock = MockNovelAI(args.latency, args.payload_kb, json.loads(args.statuses), args.per_token_limit)
+    print(f"Mock NovelAI listening on http://127.0.0.1:{args.port}/ai/generate-image", flush=True)
+    web.run_app(mock.app(), host="127.0.0.1", port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
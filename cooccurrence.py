@@ -0,0 +1,427 @@
+# cooccurrence.py
+import os
+import sys
+import json
+import math
+import bisect
+import heapq
+import itertools
+import logging
+import zipfile
+import argparse
+import tempfile
+from array import array
+from collections import Counter
+
+from records import split_prompt, PromptStore
+
+ROW_SHIFT = 32
+ROW_MASK = (1 << ROW_SHIFT) - 1
+_BLOCK_ITEMS = 1 << 16  # array items per read or write of a run file (key and count are two items)
+
+
+class CooccurrenceStats:
+    """
+    Sparse tag x tag co-occurrence counts over the prompt corpus, with PMI
+    scored neighbour lists for suggesting the next tag.
+
+    Pair counts are stored in both directions as a sorted array of packed
+    (row << 32 | column) keys with a parallel count array, so a tag's row is a
+    contiguous slice found by bisect. Only tags seen in at least min_count
+    prompts get pair counts; rarer tags are counted but not paired, and a
+    full build drops pairs seen in fewer than min_pair_count prompts, which
+    could never be suggested anyway. The top_k
+    neighbours of every tag are ranked when saving and persisted with the
+    counts. New prompts added after loading are kept in an overlay indexed by
+    row (so a lookup only touches its own row's additions) and merged on save, and the rows they touch are re-ranked on the next lookup
+    (or on save), so adding prompts never requires a full rebuild.
+    """
+
+    def __init__(self, min_count=5, min_pair_count=3, top_k=100):
+        self.min_count = min_count
+        self.min_pair_count = min_pair_count
+        self.top_k = top_k
+        self.documents = 0
+        self.corpus_seq = 0  # Last corpus segment batch included in the counts
+        self.vocab = {}
+        self.names = []
+        self.counts = array('I')
+        self.pair_keys = array('Q')
+        self.pair_counts = array('I')
+        self.pending = {}  # row -> Counter of column -> count added since loading
+        self.top = {}
+        self.dirty_rows = set()
+
+    def _tag_id(self, tag):
+        tag_id = self.vocab.get(tag)
+        if tag_id is None:
+            tag_id = len(self.names)
+            self.vocab[tag] = tag_id
+            self.names.append(tag)
+            self.counts.append(0)
+        return tag_id
+
+    def _count_unigrams(self, tags):
+        self.documents += 1
+        ids = []
+        for tag in tags:
+            tag_id = self._tag_id(tag)
+            self.counts[tag_id] += 1
+            if self.counts[tag_id] >= self.min_count:
+                ids.append(tag_id)
+        return ids
+
+    def add_prompt(self, prompt):
+        """Count one more prompt. Pair counts go to the pending overlay."""
+        ids = self._count_unigrams(split_prompt(prompt))
+        for a in ids:
+            row = self.pending.get(a)
+            if row is None:
+                row = self.pending[a] = Counter()
+            row.update(b for b in ids if b != a)
+            self.dirty_rows.add(a)
+
+    def add_prompts(self, prompts):
+        for prompt in prompts:
+            self.add_prompt(prompt)
+
+    @classmethod
+    def build(cls, prompts, max_pending_pairs=2000000, temp_folder=None, **kwargs):
+        """
+        Build stats from scratch in two streaming passes over prompts: the first
+        counts tags, the second counts pairs among tags above min_count.
+
+        Pairs are counted one way (a < b) in a Counter of at most
+        max_pending_pairs entries, which is spilled to temp_folder as a sorted
+        run whenever it fills up. The runs are then merged, dropping pairs seen
+        in fewer than min_pair_count prompts, and mirrored into the two-way
+        arrays the lookups use, so memory stays bounded by the chunk size plus
+        the final arrays.
+        """
+        stats = cls(**kwargs)
+        for prompt in prompts:
+            stats._count_unigrams(split_prompt(prompt))
+        logging.debug(f"Counted {len(stats.names)} tags over {stats.documents} prompts")
+
+        vocab = stats.vocab
+        counts = stats.counts
+        min_count = stats.min_count
+        with tempfile.TemporaryDirectory(prefix="cooccurrence-", dir=temp_folder) as folder:
+            runs = []
+            pairs = Counter()
+            for prompt in prompts:
+                # split_prompt drops repeated tags, so the sorted ids are distinct
+                ids = sorted(tag_id for tag_id in (vocab[tag] for tag in split_prompt(prompt))
+                             if counts[tag_id] >= min_count)
+                pairs.update((a << ROW_SHIFT) | b for a, b in itertools.combinations(ids, 2))
+                if len(pairs) >= max_pending_pairs:
+                    runs.append(_spill(pairs, folder, f"run-{len(runs)}"))
+                    pairs.clear()
+            if pairs or not runs:
+                runs.append(_spill(pairs, folder, f"run-{len(runs)}"))
+            del pairs
+            logging.debug(f"Counted tag pairs in {len(runs)} sorted runs")
+
+            # Merge the runs into the one-way pairs, collecting the mirrored keys in runs of their own
+            upper_path = os.path.join(folder, "upper.bin")
+            mirrored_runs = []
+            mirrored = {}
+            kept = 0
+            with open(upper_path, 'wb') as upper:
+                block = array('Q')
+                for key, count in _merge_runs(runs, stats.min_pair_count):
+                    block.append(key)
+                    block.append(count)
+                    mirrored[((key & ROW_MASK) << ROW_SHIFT) | (key >> ROW_SHIFT)] = count
+                    kept += 1
+                    if len(block) >= _BLOCK_ITEMS:
+                        block.tofile(upper)
+                        block = array('Q')
+                    if len(mirrored) >= max_pending_pairs:
+                        mirrored_runs.append(_spill(mirrored, folder, f"mirrored-{len(mirrored_runs)}"))
+                        mirrored.clear()
+                block.tofile(upper)
+            if mirrored:
+                mirrored_runs.append(_spill(mirrored, folder, f"mirrored-{len(mirrored_runs)}"))
+            del mirrored
+            for path in runs:
+                os.remove(path)
+
+            # One-way and mirrored keys never collide, so this is a plain merge
+            pair_keys = array('Q')
+            pair_counts = array('I')
+            for key, count in heapq.merge(_read_run(upper_path), *(_read_run(path) for path in mirrored_runs)):
+                pair_keys.append(key)
+                pair_counts.append(count)
+        stats.pair_keys = pair_keys
+        stats.pair_counts = pair_counts
+        logging.debug(f"Counted {kept} tag pairs seen in at least {stats.min_pair_count} prompts")
+        return stats
+
+    def _row(self, tag_id):
+        lo = bisect.bisect_left(self.pair_keys, tag_id << ROW_SHIFT)
+        hi = bisect.bisect_left(self.pair_keys, (tag_id + 1) << ROW_SHIFT, lo)
+        row = {self.pair_keys[i] & ROW_MASK: self.pair_counts[i] for i in range(lo, hi)}
+        for column, count in self.pending.get(tag_id, {}).items():
+            row[column] = row.get(column, 0) + count
+        return row
+
+    def pair_count(self, a, b):
+        a_id, b_id = self.vocab.get(a), self.vocab.get(b)
+        if a_id is None or b_id is None:
+            return 0
+        key = (a_id << ROW_SHIFT) | b_id
+        i = bisect.bisect_left(self.pair_keys, key)
+        count = self.pair_counts[i] if i < len(self.pair_keys) and self.pair_keys[i] == key else 0
+        return count + self.pending.get(a_id, {}).get(b_id, 0)
+
+    def _pmi(self, a_id, b_id, pair_count):
+        return math.log(pair_count * self.documents / (self.counts[a_id] * self.counts[b_id]))
+
+    def pmi(self, a, b):
+        count = self.pair_count(a, b)
+        if not count:
+            return None
+        return self._pmi(self.vocab[a], self.vocab[b], count)
+
+    def _ranked_row(self, tag_id):
+        if tag_id in self.top and tag_id not in self.dirty_rows:
+            return self.top[tag_id]
+        scored = (
+            (self._pmi(tag_id, column, count), column)
+            for column, count in self._row(tag_id).items()
+            if count >= self.min_pair_count
+        )
+        ranked = [(column, score) for score, column in heapq.nlargest(self.top_k, scored)]
+        self.top[tag_id] = ranked
+        self.dirty_rows.discard(tag_id)
+        return ranked
+
+    def suggest(self, tags, k=20):
+        """
+        Return up to k (tag, score) pairs that go with the given tags, scored by
+        the sum of their PMI with each tag, best first.
+        """
+        context = {self.vocab[tag] for tag in tags if tag in self.vocab}
+        scores = Counter()
+        for tag_id in context:
+            for column, score in self._ranked_row(tag_id):
+                if column not in context:
+                    scores[column] += score
+        return [(self.names[tag_id], score) for tag_id, score in scores.most_common(k)]
+
+    def _merge_pending(self):
+        if not self.pending:
+            return
+        keys = array('Q')
+        counts = array('I')
+        pending = {
+            (row << ROW_SHIFT) | column: count
+            for row, columns in self.pending.items()
+            for column, count in columns.items()
+        }
+        pending_keys = sorted(pending)
+        i = j = 0
+        old_keys, old_counts = self.pair_keys, self.pair_counts
+        while i < len(old_keys) or j < len(pending_keys):
+            if j == len(pending_keys) or (i < len(old_keys) and old_keys[i] < pending_keys[j]):
+                keys.append(old_keys[i])
+                counts.append(old_counts[i])
+                i += 1
+            elif i == len(old_keys) or pending_keys[j] < old_keys[i]:
+                keys.append(pending_keys[j])
+                counts.append(pending[pending_keys[j]])
+                j += 1
+            else:
+                keys.append(old_keys[i])
+                counts.append(old_counts[i] + pending[pending_keys[j]])
+                i += 1
+                j += 1
+        self.pair_keys, self.pair_counts = keys, counts
+        self.pending.clear()
+
+    def _rank_all_rows(self):
+        # Single pass over the sorted keys, one row at a time
+        self.top = {}
+        self.dirty_rows.clear()
+        keys, counts = self.pair_keys, self.pair_counts
+        start = 0
+        while start < len(keys):
+            row = keys[start] >> ROW_SHIFT
+            end = bisect.bisect_left(keys, (row + 1) << ROW_SHIFT, start)
+            scored = (
+                (self._pmi(row, keys[i] & ROW_MASK, counts[i]), keys[i] & ROW_MASK)
+                for i in range(start, end)
+                if counts[i] >= self.min_pair_count
+            )
+            self.top[row] = [(column, score) for score, column in heapq.nlargest(self.top_k, scored)]
+            start = end
+
+    def save(self, file_path):
+        self._merge_pending()
+        if self.top:
+            # Only rows touched by added prompts need ranking again
+            for row in list(self.dirty_rows):
+                self._ranked_row(row)
+        else:
+            self._rank_all_rows()
+        top_rows = array('I', sorted(self.top))
+        top_lengths = array('I', (len(self.top[row]) for row in top_rows))
+        top_ids = array('I', (column for row in top_rows for column, _ in self.top[row]))
+        top_scores = array('f', (score for row in top_rows for _, score in self.top[row]))
+        meta = {
+            'documents': self.documents,
+            'corpus_seq': self.corpus_seq,
+            'min_count': self.min_count,
+            'min_pair_count': self.min_pair_count,
+            'top_k': self.top_k,
+            'names': self.names,
+            'counts': self.counts.tolist(),
+        }
+        tmp_path = file_path + ".tmp"
+        with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED) as zip_ref:
+            zip_ref.writestr('meta.json', json.dumps(meta))
+            zip_ref.writestr('pair_keys.bin', self.pair_keys.tobytes())
+            zip_ref.writestr('pair_counts.bin', self.pair_counts.tobytes())
+            zip_ref.writestr('top_rows.bin', top_rows.tobytes())
+            zip_ref.writestr('top_lengths.bin', top_lengths.tobytes())
+            zip_ref.writestr('top_ids.bin', top_ids.tobytes())
+            zip_ref.writestr('top_scores.bin', top_scores.tobytes())
+        os.replace(tmp_path, file_path)
+        logging.debug(f"Saved co-occurrence stats to {file_path}")
+
+    @classmethod
+    def load(cls, file_path):
+        with zipfile.ZipFile(file_path, 'r') as zip_ref:
+            meta = json.loads(zip_ref.read('meta.json'))
+            stats = cls(meta['min_count'], meta['min_pair_count'], meta['top_k'])
+            stats.documents = meta['documents']
+            stats.corpus_seq = meta.get('corpus_seq', 0)
+            stats.names = meta['names']
+            stats.vocab = {name: i for i, name in enumerate(stats.names)}
+            stats.counts = array('I', meta['counts'])
+            stats.pair_keys.frombytes(zip_ref.read('pair_keys.bin'))
+            stats.pair_counts.frombytes(zip_ref.read('pair_counts.bin'))
+            top_rows, top_lengths, top_ids, top_scores = array('I'), array('I'), array('I'), array('f')
+            top_rows.frombytes(zip_ref.read('top_rows.bin'))
+            top_lengths.frombytes(zip_ref.read('top_lengths.bin'))
+            top_ids.frombytes(zip_ref.read('top_ids.bin'))
+            top_scores.frombytes(zip_ref.read('top_scores.bin'))
+        start = 0
+        for row, length in zip(top_rows, top_lengths):
+            stats.top[row] = list(zip(top_ids[start:start + length], top_scores[start:start + length]))
+            start += length
+        logging.debug(f"Loaded co-occurrence stats for {len(stats.names)} tags from {file_path}")
+        return stats
+
+
+def _spill(pairs, folder, name):
+    """Write the counts in pairs (packed key -> count) to a sorted run file in folder and return its path."""
+    path = os.path.join(folder, f"{name}.bin")
+    with open(path, 'wb') as f:
+        block = array('Q')
+        for key in sorted(pairs):
+            block.append(key)
+            block.append(pairs[key])
+            if len(block) >= _BLOCK_ITEMS:
+                block.tofile(f)
+                block = array('Q')
+        block.tofile(f)
+    return path
+
+
+def _read_run(path):
+    """Yield the (key, count) items of a run file, reading it a block at a time."""
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(_BLOCK_ITEMS * 8)
+            if not data:
+                break
+            block = array('Q')
+            block.frombytes(data)
+            for i in range(0, len(block), 2):
+                yield block[i], block[i + 1]
+
+
+def _merge_runs(paths, min_pair_count):
+    """Merge sorted runs, summing the counts of equal keys and dropping those below min_pair_count."""
+    current = None
+    total = 0
+    for key, count in heapq.merge(*(_read_run(path) for path in paths)):
+        if key == current:
+            total += count
+            continue
+        if current is not None and total >= min_pair_count:
+            yield current, total
+        current, total = key, count
+    if current is not None and total >= min_pair_count:
+        yield current, total
+
+
+def catch_up(stats, segments, until=None):
+    """
+    Add the prompts ingested into corpus segments since the stats were last
+    updated, up to and including batch until if given.
+    """
+    added = 0
+    for seq, record in segments.read_since(stats.corpus_seq):
+        if until is not None and seq > until:
+            break
+        if 'prompt' in record:
+            stats.add_prompt(record['prompt'])
+            added += 1
+        stats.corpus_seq = seq
+    if added:
+        logging.debug(f"Added {added} ingested prompts to co-occurrence stats")
+    return added
+
+
+def load_or_none(file_path):
+    if not os.path.exists(file_path):
+        return None
+    try:
+        return CooccurrenceStats.load(file_path)
+    except Exception as e:
+        logging.error(f"Failed to load co-occurrence stats from {file_path}: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or query tag co-occurrence statistics.")
+    parser.add_argument('--stats', default='cooccurrence.zip')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Build stats from a JSON list of prompts")
+    build_parser.add_argument('prompts', nargs='?', default='safebooru_clean.json')
+    build_parser.add_argument('--min-count', type=int, default=5)
+    build_parser.add_argument('--min-pair-count', type=int, default=3)
+    build_parser.add_argument('--corpus', help="Also add the prompts ingested into this corpus folder")
+    build_parser.add_argument('--until', type=int, help="Last corpus batch to add (default all)")
+    add_parser = subparsers.add_parser('add', help="Add prompts (one per line) to existing stats")
+    add_parser.add_argument('prompts_file')
+    suggest_parser = subparsers.add_parser('suggest', help="Suggest tags for a prompt")
+    suggest_parser.add_argument('prompt')
+    suggest_parser.add_argument('-k', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        prompts = PromptStore.from_json_file(args.prompts)
+        stats = CooccurrenceStats.build(prompts, min_count=args.min_count, min_pair_count=args.min_pair_count)
+        del prompts
+        if args.corpus:
+            # corpus imports this module, so it can only be imported here
+            from corpus import CorpusSegments
+            catch_up(stats, CorpusSegments(args.corpus), until=args.until)
+        stats.save(args.stats)
+    elif args.command == 'add':
+        stats = CooccurrenceStats.load(args.stats)
+        with open(args.prompts_file, 'r', encoding='utf-8') as f:
+            stats.add_prompts(line.strip() for line in f if line.strip())
+        stats.save(args.stats)
+    else:
+        stats = load_or_none(args.stats)
+        if stats is None:
+            print(f"No statistics found at {args.stats}. Run the build command first.")
+            sys.exit(1)
+        for tag, score in stats.suggest(split_prompt(args.prompt), args.k):
+            print(f"{score:8.2f}  {tag}")
@@ -0,0 +1,338 @@
+# corpus.py
+import os
+import sys
+import json
+import math
+import time
+import logging
+import argparse
+from contextlib import contextmanager
+
+import cooccurrence
+from records import Tag, load_tags_file
+
+MANIFEST = "manifest.json"
+
+
+def _is_count(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def normalize_tag(tag):
+    """
+    Return the fields of a tag object that the app uses, or None if they
+    don't have the types of naidv3_tags_pretty.json. A single d_group string
+    is taken as a list of one group.
+    """
+    if not isinstance(tag.get('tag_name'), str) or not tag['tag_name'].strip():
+        return None
+    if 'd_category' in tag and not isinstance(tag['d_category'], str):
+        return None
+    if isinstance(tag.get('d_group'), str):
+        tag = dict(tag, d_group=[tag['d_group']])
+    if 'd_group' in tag and not (isinstance(tag['d_group'], list)
+                                 and all(isinstance(group, str) for group in tag['d_group'])):
+        return None
+    if not all(_is_count(tag[key]) for key in ('d_count', 'n_count') if key in tag):
+        return None
+    return {key: tag[key] for key in ('tag_name', 'd_category', 'd_group', 'd_count', 'n_count') if key in tag}
+
+
+def normalize_record(data):
+    """
+    Turn one ingested JSON value into a segment record: a string or
+    {"prompt": ...} is a prompt, and an object with a tag_name (or
+    {"tag": {...}}) is a tag in the naidv3_tags_pretty.json format.
+    Returns None for anything else, including tags with fields of the wrong type.
+    """
+    if isinstance(data, str):
+        return {'prompt': data} if data.strip() else None
+    if not isinstance(data, dict):
+        return None
+    if isinstance(data.get('prompt'), str):
+        return {'prompt': data['prompt']} if data['prompt'].strip() else None
+    tag = data.get('tag', data)
+    if isinstance(tag, dict):
+        tag = normalize_tag(tag)
+        if tag is not None:
+            return {'tag': tag}
+    return None
+
+
+def read_jsonl(file_path):
+    """Yield the segment records of a JSONL file, skipping lines that are not prompts or tags."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = normalize_record(json.loads(line))
+            except ValueError:
+                record = None
+            if record is None:
+                logging.warning(f"Skipping line {line_number} of {file_path}: not a prompt or tag")
+                continue
+            yield record
+
+
+class CorpusSegments:
+    """
+    Prompts and tags added after the base corpus files, stored as append-only
+    JSONL segments in a folder.
+
+    manifest.json lists the segments in order together with the ingestion
+    batches each one holds, as [seq, number of records]. Every ingest writes a
+    new segment and bumps last_seq, so a reader that remembers the last seq it
+    has seen can pick up exactly the new records, even after segments have been
+    merged. Small segments are merged in the background once merge_factor of
+    them are of similar size, which keeps the number of files logarithmic in
+    the number of ingests. Writers take a lock file around manifest updates.
+    """
+
+    def __init__(self, folder="corpus", merge_factor=8, lock_timeout=30):
+        self.folder = folder
+        self.merge_factor = merge_factor
+        self.lock_timeout = lock_timeout
+        self.manifest_path = os.path.join(folder, MANIFEST)
+        self.lock_path = os.path.join(folder, ".lock")
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'last_seq': 0, 'segments': []}
+        except Exception as e:
+            logging.error(f"Failed to read corpus manifest {self.manifest_path}: {e}")
+            return {'last_seq': 0, 'segments': []}
+
+    def manifest_mtime(self):
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _write_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.manifest_path)
+
+    def _write_segment(self, name, records):
+        path = os.path.join(self.folder, name)
+        tmp_path = path + ".tmp"
+        count = 0
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return count
+
+    @contextmanager
+    def lock(self):
+        os.makedirs(self.folder, exist_ok=True)
+        deadline = time.monotonic() + self.lock_timeout
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                try:
+                    # A lock left behind by a crashed writer
+                    if time.time() - os.stat(self.lock_path).st_mtime > self.lock_timeout:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"Corpus folder {self.folder} is locked by another writer")
+                time.sleep(0.05)
+        try:
+            os.close(fd)
+            yield
+        finally:
+            os.remove(self.lock_path)
+
+    def append(self, records):
+        """Write records as a new segment. Returns (seq, number of records), or (None, 0) if there were none."""
+        os.makedirs(self.folder, exist_ok=True)
+        # The segment is written outside the lock under a unique name; only publishing it is serialized
+        name = f"segment-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}.jsonl"
+        count = self._write_segment(name, records)
+        if not count:
+            os.remove(os.path.join(self.folder, name))
+            return None, 0
+        with self.lock():
+            manifest = self.read_manifest()
+            seq = manifest['last_seq'] + 1
+            manifest['last_seq'] = seq
+            manifest['segments'].append({'name': name, 'batches': [[seq, count]]})
+            self._write_manifest(manifest)
+        logging.debug(f"Ingested {count} records into {name} as batch {seq}")
+        return seq, count
+
+    def read_since(self, seq, manifest=None):
+        """
+        Yield (batch seq, record) for every record ingested after batch seq, in
+        ingestion order.
+        """
+        manifest = manifest or self.read_manifest()
+        for segment in manifest['segments']:
+            batches = segment['batches']
+            if batches[-1][0] <= seq:
+                continue
+            skip = sum(count for batch_seq, count in batches if batch_seq <= seq)
+            batch_ends = []
+            line_count = 0
+            for batch_seq, count in batches:
+                line_count += count
+                batch_ends.append((line_count, batch_seq))
+            with open(os.path.join(self.folder, segment['name']), 'r', encoding='utf-8') as f:
+                batch = 0
+                for line_number, line in enumerate(f):
+                    while line_number >= batch_ends[batch][0]:
+                        batch += 1
+                    if line_number >= skip:
+                        yield batch_ends[batch][1], json.loads(line)
+
+    def records_since(self, seq, attempts=3):
+        """
+        Return (last seq, [(batch seq, record)]) for everything ingested after
+        batch seq. Retries if a merge removes a segment while it is being read.
+        """
+        for attempt in range(attempts):
+            manifest = self.read_manifest()
+            try:
+                return manifest['last_seq'], list(self.read_since(seq, manifest))
+            except FileNotFoundError:
+                if attempt == attempts - 1:
+                    raise
+                logging.debug("Corpus segment merged away while reading, retrying")
+
+    def _merge_candidates(self, segments):
+        # Segments whose record counts are within a factor of merge_factor of each other share a tier
+        def tier(segment):
+            total = sum(count for _, count in segment['batches'])
+            return int(math.log(max(total, 1), self.merge_factor))
+
+        start = 0
+        while start < len(segments):
+            end = start
+            while end < len(segments) and tier(segments[end]) == tier(segments[start]):
+                end += 1
+            if end - start >= self.merge_factor:
+                return start, end
+            start = end
+        return None
+
+    def merge(self):
+        """Merge runs of similarly sized segments. Returns the number of segments merged away."""
+        merged = 0
+        while True:
+            manifest = self.read_manifest()
+            run = self._merge_candidates(manifest['segments'])
+            if run is None:
+                return merged
+            start, end = run
+            sources = manifest['segments'][start:end]
+            name = f"merged-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{time.monotonic_ns()}.jsonl"
+            source_manifest = {'last_seq': manifest['last_seq'], 'segments': sources}
+            self._write_segment(name, (record for _, record in self.read_since(0, source_manifest)))
+            with self.lock():
+                # Ingests only ever append, so the run is still in place unless another merge took it
+                manifest = self.read_manifest()
+                names = [segment['name'] for segment in manifest['segments']]
+                if names[start:end] != [segment['name'] for segment in sources]:
+                    os.remove(os.path.join(self.folder, name))
+                    continue
+                batches = [batch for segment in sources for batch in segment['batches']]
+                manifest['segments'][start:start + len(sources)] = [{'name': name, 'batches': batches}]
+                self._write_manifest(manifest)
+            for segment in sources:
+                try:
+                    os.remove(os.path.join(self.folder, segment['name']))
+                except OSError as e:
+                    # Still open by a reader on Windows; it is no longer referenced either way
+                    logging.warning(f"Could not remove merged segment {segment['name']}: {e}")
+            merged += len(sources)
+            logging.debug(f"Merged {len(sources)} segments into {name}")
+
+
+def ingest(segments, file_path, tags_file='naidv3_tags_pretty.json', stats_file='cooccurrence.zip'):
+    """
+    Stream a JSONL file into a new segment, skipping tags that are already
+    known, then bring the saved co-occurrence stats up to date with it.
+    """
+    known_tags = {tag.tag_name for tag in load_tags_file(tags_file)}
+    for _, record in segments.read_since(0):
+        if 'tag' in record:
+            known_tags.add(record['tag']['tag_name'])
+
+    def new_records():
+        for record in read_jsonl(file_path):
+            if 'tag' in record:
+                if record['tag']['tag_name'] in known_tags:
+                    continue
+                known_tags.add(record['tag']['tag_name'])
+            yield record
+
+    seq, count = segments.append(new_records())
+    if seq is None:
+        logging.debug(f"Nothing new to ingest from {file_path}")
+        return 0
+
+    stats = cooccurrence.load_or_none(stats_file)
+    if stats is not None:
+        cooccurrence.catch_up(stats, segments)
+        stats.save(stats_file)
+    return count
+
+
+def apply_tag_record(tags, record):
+    """
+    Append the Tag of a tag record to tags and return its id, or None if the
+    record is malformed (segments written before tags were checked may hold
+    such records).
+    """
+    tag = normalize_tag(record['tag']) if isinstance(record.get('tag'), dict) else None
+    if tag is None:
+        logging.warning(f"Skipping malformed tag record in the corpus: {record!r:.200}")
+        return None
+    tags.append(Tag.from_dict(tag))
+    return len(tags) - 1
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Add prompts and tags to the corpus without rebuilding it.")
+    parser.add_argument('--folder', default='corpus')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = subparsers.add_parser('ingest', help="Ingest a JSONL file of prompts and/or tags")
+    ingest_parser.add_argument('jsonl_file')
+    ingest_parser.add_argument('--tags', default='naidv3_tags_pretty.json')
+    ingest_parser.add_argument('--stats', default='cooccurrence.zip')
+    subparsers.add_parser('merge', help="Merge small segments now")
+    subparsers.add_parser('status', help="Show the segments in the corpus folder")
+    args = parser.parse_args()
+
+    segments = CorpusSegments(args.folder)
+    if args.command == 'ingest':
+        if not os.path.exists(args.jsonl_file):
+            print(f"{args.jsonl_file} not found.")
+            sys.exit(1)
+        count = ingest(segments, args.jsonl_file, args.tags, args.stats)
+        print(f"Ingested {count} records.")
+    elif args.command == 'merge':
+        print(f"Merged {segments.merge()} segments.")
+    else:
+        manifest = segments.read_manifest()
+        for segment in manifest['segments']:
+            total = sum(count for _, count in segment['batches'])
+            print(f"{segment['name']}: {total} records in {len(segment['batches'])} batches")
+        print(f"Last batch: {manifest['last_seq']}")
@@ -0,0 +1,270 @@
+# gallery_maintenance.py
+import io
+import os
+import sys
+import time
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+IMAGE_FOLDER = "images"
+PREVIEW_FOLDER = os.path.join(IMAGE_FOLDER, ".previews")
+ARCHIVE_FOLDER = os.path.join(IMAGE_FOLDER, "archive")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+
+def lower_priority():
+    """
+    Process pool initializer: drop the worker to the lowest CPU priority, and
+    to idle I/O priority where psutil is installed, so maintenance only uses
+    what generation and the GUI leave over.
+    """
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    try:
+        if psutil is not None:
+            process = psutil.Process()
+            if sys.platform == 'win32':
+                process.nice(psutil.IDLE_PRIORITY_CLASS)
+                process.ionice(psutil.IOPRIO_VERYLOW)
+            else:
+                process.nice(19)
+                if hasattr(psutil, 'IOPRIO_CLASS_IDLE'):
+                    process.ionice(psutil.IOPRIO_CLASS_IDLE)
+        elif hasattr(os, 'nice'):
+            os.nice(19)
+    except Exception as e:
+        logging.warning(f"Could not lower maintenance worker priority: {e}")
+
+
+def read_throttled(path, max_bytes_per_second, chunk_size=256 * 1024):
+    """Read a whole file, sleeping between chunks so the average rate stays under max_bytes_per_second."""
+    data = bytearray()
+    start = time.monotonic()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            data += chunk
+            if max_bytes_per_second:
+                ahead = len(data) / max_bytes_per_second - (time.monotonic() - start)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return bytes(data)
+
+
+def dhash(image, hash_size=8):
+    """64-bit difference hash: whether each pixel of a tiny greyscale copy is brighter than its right neighbour."""
+    from PIL import Image
+
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        for col in range(hash_size):
+            left = pixels[row * (hash_size + 1) + col]
+            right = pixels[row * (hash_size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def preview_path_for(image_path, preview_folder=PREVIEW_FOLDER):
+    return os.path.join(preview_folder, os.path.splitext(os.path.basename(image_path))[0] + ".webp")
+
+
+def process_image(image_path, preview_folder=PREVIEW_FOLDER, preview_size=384, quality=80,
+                  max_bytes_per_second=8 * 2 ** 20):
+    """
+    Write a WebP preview of image_path and compute its perceptual hash.
+    Returns the preview record to store; a record with an 'error' if the
+    image could not be read. Runs in a worker process.
+    """
+    from PIL import Image
+
+    record = {'action': 'preview', 'path': image_path}
+    try:
+        stat = os.stat(image_path)
+        record['size'] = stat.st_size
+        record['mtime'] = stat.st_mtime
+        data = read_throttled(image_path, max_bytes_per_second)
+        with Image.open(io.BytesIO(data)) as image:
+            image.load()
+            record['dhash'] = f"{dhash(image):016x}"
+            image.thumbnail((preview_size, preview_size), Image.LANCZOS)
+            preview_path = preview_path_for(image_path, preview_folder)
+            os.makedirs(preview_folder, exist_ok=True)
+            tmp_path = preview_path + ".tmp"
+            image.convert("RGB").save(tmp_path, "WEBP", quality=quality, method=4)
+            os.replace(tmp_path, preview_path)
+        record['preview'] = preview_path
+        record['preview_size'] = os.path.getsize(preview_path)
+    except Exception as e:
+        record['error'] = str(e)
+    return record
+
+
+def process_batch(image_paths, preview_folder=PREVIEW_FOLDER, pause=0.05, **options):
+    """Process a batch of images one after another, pausing between them. Runs in a worker process."""
+    records = []
+    for image_path in image_paths:
+        records.append(process_image(image_path, preview_folder, **options))
+        time.sleep(pause)
+    return records
+
+
+def make_pool():
+    """A single low priority worker process for maintenance batches."""
+    return ProcessPoolExecutor(max_workers=1, initializer=lower_priority)
+
+
+def pending_images(store, folder=IMAGE_FOLDER):
+    """
+    Image files directly in folder that have no up-to-date preview record,
+    oldest first. Subfolders (previews, archive, spool) are left alone.
+    """
+    pending = []
+    try:
+        entries = list(os.scandir(folder))
+    except FileNotFoundError:
+        return pending
+    for entry in entries:
+        if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        stat = entry.stat()
+        record = store.previews.get(entry.path)
+        if record and record.get('size') == stat.st_size and record.get('mtime') == stat.st_mtime:
+            if 'error' in record or os.path.exists(record['preview']):
+                continue
+        pending.append((stat.st_mtime, entry.path))
+    return [path for _, path in sorted(pending)]
+
+
+def _bands(value, n_bands):
+    width = 64 // n_bands
+    mask = (1 << width) - 1
+    return [(band, (value >> (band * width)) & mask) for band in range(n_bands)]
+
+
+def find_duplicates(hashes, max_distance=3, key=None):
+    """
+    Group image paths whose hashes are within max_distance bits of each other.
+    hashes maps image path -> 64-bit hash. Returns a list of groups (lists of
+    paths) with more than one image.
+
+    Images are taken in order of key (the path by default), and each one not
+    yet grouped becomes the first image of a group claiming every ungrouped
+    image within max_distance of it. Every image in a group is therefore
+    close to the first one, rather than chained to it through others.
+
+    The hash is split into max_distance + 1 bands: two hashes that differ in
+    at most max_distance bits agree exactly on at least one band, so only
+    images sharing a band value are compared.
+    """
+    paths = sorted(hashes, key=key)
+    buckets = {}
+    for path in paths:
+        for band in _bands(hashes[path], max_distance + 1):
+            buckets.setdefault(band, []).append(path)
+
+    grouped = set()
+    groups = []
+    for path in paths:
+        if path in grouped:
+            continue
+        grouped.add(path)
+        group = [path]
+        for band in _bands(hashes[path], max_distance + 1):
+            for other in buckets[band]:
+                if other not in grouped and bin(hashes[path] ^ hashes[other]).count('1') <= max_distance:
+                    grouped.add(other)
+                    group.append(other)
+        if len(group) > 1:
+            groups.append(group)
+    return groups
+
+
+def plan_dedup(store, max_distance=3):
+    """
+    Return [(keep, [duplicates])] for every group of near-identical images.
+    The image kept is one the gallery shows if there is one, otherwise the
+    oldest, and every duplicate is within max_distance of it.
+    """
+    hashes = {
+        path: int(record['dhash'], 16) for path, record in store.previews.items()
+        if 'dhash' in record and path not in store.archived and os.path.exists(path)
+    }
+    shown = set(store.images.values())
+    plan = []
+    for group in find_duplicates(hashes, max_distance,
+                                 key=lambda path: (path not in shown, store.previews[path].get('mtime', 0), path)):
+        plan.append((group[0], group[1:]))
+    return plan
+
+
+def archive_duplicates(store, plan, archive_folder=ARCHIVE_FOLDER):
+    """Move the duplicates of a dedup plan to archive_folder. Returns (images moved, bytes moved)."""
+    os.makedirs(archive_folder, exist_ok=True)
+    moved = 0
+    moved_bytes = 0
+    for keep, duplicates in plan:
+        for image_path in duplicates:
+            name = os.path.basename(image_path)
+            archive_path = os.path.join(archive_folder, name)
+            stem, extension = os.path.splitext(name)
+            counter = 1
+            while os.path.exists(archive_path):
+                archive_path = os.path.join(archive_folder, f"{stem}_{counter}{extension}")
+                counter += 1
+            try:
+                size = os.path.getsize(image_path)
+                os.replace(image_path, archive_path)
+            except OSError as e:
+                logging.error(f"Failed to archive {image_path}: {e}")
+                continue
+            preview = store.preview_path(image_path)
+            if preview:
+                try:
+                    os.remove(preview)
+                except OSError:
+                    pass
+            store.archive(image_path, archive_path, keep)
+            moved += 1
+            moved_bytes += size
+    logging.debug(f"Archived {moved} duplicate images ({moved_bytes} bytes) to {archive_folder}")
+    return moved, moved_bytes
+
+
+if __name__ == "__main__":
+    from generation_store import GenerationStore
+
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build gallery previews and archive duplicate images.")
+    parser.add_argument('--folder', default=IMAGE_FOLDER)
+    parser.add_argument('--distance', type=int, default=3, help="Max differing hash bits for duplicates")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('scan', help="Build previews and hashes for new images")
+    dedup_parser = subparsers.add_parser('dedup', help="List duplicate images")
+    dedup_parser.add_argument('--archive', action='store_true', help="Move the duplicates to the archive folder")
+    args = parser.parse_args()
+
+    store = GenerationStore("generated_images.json", "generation_records.jsonl")
+    preview_folder = os.path.join(args.folder, ".previews")
+    if args.command == 'scan':
+        paths = pending_images(store, args.folder)
+        with make_pool() as pool:
+            for start in range(0, len(paths), 16):
+                for record in pool.submit(process_batch, paths[start:start + 16], preview_folder).result():
+                    store.add_preview(record)
+        print(f"Processed {len(paths)} images.")
+    else:
+        plan = plan_dedup(store, args.distance)
+        for keep, duplicates in plan:
+            print(f"{keep}: {', '.join(duplicates)}")
+        print(f"{sum(len(duplicates) for _, duplicates in plan)} duplicates in {len(plan)} groups.")
+        if args.archive and plan:
+            moved, moved_bytes = archive_duplicates(store, plan, os.path.join(args.folder, "archive"))
+            store.flush()
+            print(f"Archived {moved} images ({moved_bytes / 2 ** 20:.1f} MB).")
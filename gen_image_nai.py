@@ -1,93 +1,82 @@
-# gen_image_nai.py
-import requests
-import json
-import sys
-import random
-import os
-import zipfile
-from io import BytesIO
-
-with open("apitoken.json") as f:
-    api_token = json.load(f)["token"]
-
-
-def generate_image(prompt, api_key):
-    url = "https://image.novelai.net/ai/generate-image"
-
-    headers = {
-        "Authorization": f"Bearer {api_key}"
-    }
-
-    payload = {
-        "input": prompt,
-        "model": "nai-diffusion-3",
-        "action": "generate",
-        "parameters": {
-            "params_version": 3,
-            "width": 832,
-            "height": 1216,
-            "scale": 7,
-            "sampler": "k_dpmpp_2s_ancestral",
-            "steps": 28,
-            "n_samples": 1,
-            "ucPreset": 3,
-            "qualityToggle": False,
-            "sm": False,
-            "sm_dyn": False,
-            "dynamic_thresholding": False,
-            "controlnet_strength": 1,
-            "legacy": False,
-            "add_original_image": True,
-            "cfg_rescale": 0,
-            "noise_schedule": "karras",
-            "legacy_v3_extend": False,
-            "skip_cfg_above_sigma": None,
-            "seed": random.randint(0, 4294967295),  # Random seed
-            "negative_prompt": "worst quality, low quality, bad image, displeasing, [abstract], bad anatomy, very displeasing, extra, unfocused, jpeg artifacts, unfinished, chromatic aberration,",
-            "reference_image_multiple": [],
-            "reference_information_extracted_multiple": [],
-            "reference_strength_multiple": []
-        }
-    }
-
-    print("Sending request to NovelAI...")
-    response = requests.post(url, json=payload, headers=headers)
-
-    if response.status_code != 200:
-        print(f"Failed to generate image. Status code: {response.status_code}")
-        print("Response Headers:", response.headers)
-        print("Response Body:", response.text)
-        return None
-
-    print("Image generated successfully.")
-    return response.content
-
-
-def save_image(image_data, output_folder="output"):
-    os.makedirs(output_folder, exist_ok=True)
-
-    # Save the zip file in memory
-    zip_path = os.path.join(output_folder, "output_image.zip")
-    with open(zip_path, "wb") as f:
-        f.write(image_data)
-    print(f"Saved image as {zip_path}")
-
-    # Extract the image from the zip file using BytesIO
-    with zipfile.ZipFile(BytesIO(image_data), 'r') as zip_ref:
-        zip_ref.extractall(output_folder)
-
-    extracted_image_path = os.path.join(output_folder, "image_0.png")
-    if os.path.exists(extracted_image_path):
-        print(f"Extracted image saved as {extracted_image_path}")
-    else:
-        print("Warning: Could not find extracted image.")
-
-
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        prompt = sys.argv[1]
-        image_data = generate_image(prompt, api_token)
-        if image_data:
-            save_image(image_data)
-    else:
-        print("Please provide a prompt as a command-line argument.")
+# gen_image_nai.py
+import os
+import asyncio
+import argparse
+import zipfile
+from io import BytesIO
+
+from presets import PresetLibrary, PresetError
+from nai_client import AsyncNovelAIClient, NovelAIError
+from token_pool import TokenPool, NoTokenAvailable
+
+
+async def _generate(body, tokens):
+    async with AsyncNovelAIClient(max_concurrent=1) as client:
+        return await tokens.generate(client, body)
+
+
+def generate_image(prompt, api_key, template=None, seed=None):
+    # api_key is one token, or a TokenPool to use whichever of its accounts is free
+    tokens = api_key
+    if not isinstance(tokens, TokenPool):
+        tokens = TokenPool()
+        tokens.add(api_key)
+    # Settings live in presets.json; the "default" preset is used unless another is given
+    if template is None:
+        template = PresetLibrary.load().get("default")
+    body = template.build(prompt, seed)
+
+    print("Sending request to NovelAI...")
+    try:
+        image_data = asyncio.run(_generate(body, tokens))
+    except (NovelAIError, NoTokenAvailable) as e:
+        print(e)
+        return None
+
+    print("Image generated successfully.")
+    return image_data
+
+
+def save_image(image_data, output_folder="output"):
+    os.makedirs(output_folder, exist_ok=True)
+
+    # Save the zip file in memory
+    zip_path = os.path.join(output_folder, "output_image.zip")
+    with open(zip_path, "wb") as f:
+        f.write(image_data)
+    print(f"Saved image as {zip_path}")
+
+    # Extract the image from the zip file using BytesIO
+    with zipfile.ZipFile(BytesIO(image_data), 'r') as zip_ref:
+        zip_ref.extractall(output_folder)
+
+    extracted_image_path = os.path.join(output_folder, "image_0.png")
+    if os.path.exists(extracted_image_path):
+        print(f"Extracted image saved as {extracted_image_path}")
+    else:
+        print("Warning: Could not find extracted image.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate an image on NovelAI from a prompt.")
+    parser.add_argument("prompt", nargs="?", help="The prompt to generate")
+    parser.add_argument("--preset", default="default", help="Preset name from presets.json")
+    parser.add_argument("--seed", type=int, help="Seed to use instead of a random one")
+    parser.add_argument("--list-presets", action="store_true", help="List the available presets and exit")
+    args = parser.parse_args()
+
+    presets = PresetLibrary.load()
+    if args.list_presets:
+        for name in presets.names():
+            print(name)
+    elif args.prompt:
+        try:
+            template = presets.get(args.preset)
+        except PresetError as e:
+            print(e)
+            raise SystemExit(1)
+        image_data = generate_image(args.prompt, TokenPool.load("apitoken.json"), template, args.seed)
+        if image_data:
+            save_image(image_data)
+    else:
+        print("Please provide a prompt as a command-line argument.")
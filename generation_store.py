@@ -0,0 +1,264 @@
+# generation_store.py
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+
+
+def job_key(prompt, parameters, seed):
+    """
+    Identify a generation by what NovelAI is asked to render, so the same prompt,
+    effective parameters and seed are never paid for twice.
+    """
+    parameters = {key: value for key, value in parameters.items() if key != "seed"}
+    text = json.dumps([prompt, parameters, seed], sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def make_job(presets, prompt, preset="default", overrides=None, seed=None, **extra):
+    """
+    Describe one generation request. The seed and the preset's resolved
+    parameters are fixed here (the seed randomly if not given) so the job can
+    be recorded, retried and deduplicated exactly, even after presets.json
+    has changed.
+    """
+    template = presets.get(preset, overrides)
+    if seed is None:
+        seed = template.next_seed()
+    job = {
+        'id': uuid.uuid4().hex,
+        'prompt': prompt,
+        'preset': preset,
+        'overrides': dict(overrides or {}),
+        'seed': seed,
+        'parameters': dict(template.parameters),
+        'model': template.model,
+        'key': job_key(prompt, template.parameters, seed),
+    }
+    job.update(extra)
+    return job
+
+
+class GenerationStore:
+    """
+    Everything that has been generated.
+
+    generated_images.json keeps its original prompt -> image path mapping (the
+    latest image of each prompt), which the prompt list uses. Each generation
+    is also appended as one line to generation_records.jsonl with its preset,
+    overrides, seed and job key, which is what sweeps use to skip work that
+    has already been done and the gallery lists every image from.
+    The JSONL records are the primary record: the mapping is brought up to
+    date from them when loading, and generated_images.json is only rewritten
+    from a background thread save_delay seconds after a change (and on
+    flush), so a burst of jobs costs one write.
+    Gallery maintenance (previews, perceptual hashes and archived duplicates)
+    is logged the same way to gallery_maintenance.jsonl.
+    """
+
+    def __init__(self, images_file="generated_images.json", records_file="generation_records.jsonl",
+                 maintenance_file="gallery_maintenance.jsonl", save_delay=10):
+        self.images_file = images_file
+        self.records_file = records_file
+        self.maintenance_file = maintenance_file
+        self.save_delay = save_delay
+        self.save_timer = None
+        self.save_lock = threading.Lock()  # guards save_timer
+        self.write_lock = threading.Lock()  # one write of images_file at a time
+        self.images = self.load_images()
+        self.records = self.load_records()
+        self.by_key = {record['key']: record for record in self.records if 'key' in record}
+        self.previews = {}  # image path -> latest preview record
+        self.archived = {}  # original image path -> archive record
+        for record in self.load_records(maintenance_file):
+            self.apply_maintenance(record)
+        self.catch_up_images()
+
+    def load_images(self):
+        if os.path.exists(self.images_file):
+            try:
+                with open(self.images_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                    logging.debug(f"Loaded {self.images_file}")
+                    return data if isinstance(data, dict) else {}
+            except Exception as e:
+                logging.error(f"Failed to load {self.images_file}: {e}")
+                return {}
+        else:
+            return {}
+
+    def catch_up_images(self):
+        """Add generations the last save of images_file missed, e.g. after a crash."""
+        changed = False
+        for record in self.records:
+            image_path = self.resolve(record['path'])
+            if self.images.get(record['prompt']) != image_path:
+                self.images[record['prompt']] = image_path
+                changed = True
+        if changed:
+            logging.debug(f"Updated the image mapping from {self.records_file}")
+            self.save_images_later()
+
+    def save_images(self, images=None):
+        images = self.images if images is None else images
+        tmp_path = self.images_file + ".tmp"
+        with self.write_lock:
+            try:
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(images, f, indent=4)
+                os.replace(tmp_path, self.images_file)
+                logging.debug(f"Saved {self.images_file}")
+            except Exception as e:
+                logging.error(f"Failed to save {self.images_file}: {e}")
+
+    def save_images_later(self):
+        """Save images_file from a background thread in save_delay seconds, together with any changes made until then."""
+        with self.save_lock:
+            if self.save_timer is None:
+                self.save_timer = threading.Timer(self.save_delay, self.flush)
+                self.save_timer.daemon = True
+                self.save_timer.start()
+
+    def flush(self):
+        """Save images_file now if a save is pending. Call before exiting."""
+        with self.save_lock:
+            timer, self.save_timer = self.save_timer, None
+            if timer is None:
+                return
+            timer.cancel()
+            # Copying a plain dict is atomic under the GIL, so this is safe while the GUI thread adds to it
+            images = dict(self.images)
+        self.save_images(images)
+
+    def load_records(self, records_file=None):
+        records_file = records_file or self.records_file
+        records = []
+        if not os.path.exists(records_file):
+            return records
+        try:
+            with open(records_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash; everything before it is intact
+                        logging.warning(f"Skipping unreadable line in {records_file}")
+            logging.debug(f"Loaded {len(records)} records from {records_file}")
+        except Exception as e:
+            logging.error(f"Failed to load {records_file}: {e}")
+        return records
+
+    def append_record(self, records_file, record):
+        try:
+            with open(records_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record) + "\n")
+        except Exception as e:
+            logging.error(f"Failed to append to {records_file}: {e}")
+
+    def gallery_entries(self):
+        """
+        Return [(prompt, image_path, created)] for every generated image that
+        still exists, including every image of a prompt generated more than
+        once (generated_images.json only maps each prompt to its latest image).
+        """
+        entries = []
+        seen = set()
+        for record in self.records:
+            image_path = record['path']
+            if image_path in seen or image_path in self.archived or not os.path.exists(image_path):
+                continue
+            seen.add(image_path)
+            entries.append((record['prompt'], image_path, record['created']))
+        # Images generated before the records were kept
+        for prompt, image_path in self.images.items():
+            if image_path in seen:
+                continue
+            try:
+                mtime = os.stat(image_path).st_mtime
+            except OSError:
+                continue  # Skip if image file doesn't exist
+            seen.add(image_path)
+            entries.append((prompt, image_path, mtime))
+        return entries
+
+    def resolve(self, image_path):
+        """Follow archived duplicates to the image that was kept in their place."""
+        seen = set()
+        while image_path in self.archived and image_path not in seen:
+            seen.add(image_path)
+            image_path = self.archived[image_path]['duplicate_of']
+        return image_path
+
+    def find(self, key):
+        record = self.by_key.get(key)
+        if record and record['path'] in self.archived:
+            record = dict(record, path=self.resolve(record['path']))
+        if record and os.path.exists(record['path']):
+            return record
+        return None
+
+    def add(self, job, image_path):
+        """Record a finished job and return its record."""
+        record = {
+            'key': job['key'],
+            'prompt': job['prompt'],
+            'path': image_path,
+            'preset': job['preset'],
+            'overrides': job.get('overrides') or {},
+            'seed': job['seed'],
+            'created': time.time(),
+        }
+        self.append_record(self.records_file, record)
+        self.records.append(record)
+        self.by_key[record['key']] = record
+        self.images[job['prompt']] = image_path
+        self.save_images_later()
+        return record
+
+    def apply_maintenance(self, record):
+        if record.get('action') == 'preview':
+            # A new preview means the file is back in the gallery folder
+            self.previews[record['path']] = record
+            self.archived.pop(record['path'], None)
+        elif record.get('action') == 'archive':
+            self.archived[record['path']] = record
+            self.previews.pop(record['path'], None)
+
+    def preview_path(self, image_path):
+        """The WebP preview of image_path, or None if it has none."""
+        record = self.previews.get(image_path)
+        return record.get('preview') if record else None
+
+    def add_preview(self, record):
+        """Record a preview built by gallery maintenance."""
+        record = dict(record, time=time.time())
+        self.append_record(self.maintenance_file, record)
+        self.apply_maintenance(record)
+
+    def archive(self, image_path, archive_path, duplicate_of):
+        """
+        Record that image_path was moved to archive_path as a duplicate of
+        duplicate_of, and point any prompt showing it at the image kept.
+        """
+        record = {
+            'action': 'archive',
+            'path': image_path,
+            'archive_path': archive_path,
+            'duplicate_of': duplicate_of,
+            'time': time.time(),
+        }
+        self.append_record(self.maintenance_file, record)
+        self.apply_maintenance(record)
+        changed = False
+        for prompt, path in self.images.items():
+            if path == image_path:
+                self.images[prompt] = duplicate_of
+                changed = True
+        if changed:
+            self.save_images_later()
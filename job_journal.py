@@ -0,0 +1,195 @@
+# job_journal.py
+import os
+import json
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+
+QUEUED = "queued"
+SENT = "sent"
+DOWNLOADED = "downloaded"
+WRITTEN = "written"  # image file written, not yet added to the generation store
+SAVED = "saved"
+FAILED = "failed"
+
+FINISHED_STATES = {SAVED, FAILED}
+
+_STOP = object()
+
+
+class JobJournal:
+    """
+    Append-only log of generation job state changes (queued -> sent ->
+    downloaded -> written -> saved, or failed), used to resume interrupted
+    jobs on the next start.
+
+    record() only puts the entry on a queue; a background writer thread
+    appends entries to the journal file and fsyncs them in batches, at most
+    flush_interval seconds apart. When the file holds many more lines than
+    there are unfinished jobs, the writer rewrites it with just those jobs.
+
+    Downloaded images are spooled to disk before they are marked downloaded,
+    so a job interrupted after NovelAI returned the image is finished from the
+    spool without sending (and paying for) the request again. The written
+    entry carries the path of the saved image, so a job interrupted after
+    that reuses the file instead of saving a second copy.
+    """
+
+    def __init__(self, file_path="job_journal.jsonl", spool_folder=os.path.join("images", ".spool"),
+                 flush_interval=0.5, flush_batch=64, compact_min_lines=1000):
+        self.file_path = file_path
+        self.spool_folder = spool_folder
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.compact_min_lines = compact_min_lines
+        self.live, self.lines = self.read(file_path)
+        self.entries = queue.Queue()
+        self.writer = threading.Thread(target=self.write_loop, name="JobJournalWriter", daemon=True)
+        self.writer.start()
+
+    @staticmethod
+    def read(file_path):
+        """Return (unfinished jobs by id in queue order, number of lines in the file)."""
+        live = OrderedDict()
+        lines = 0
+        if not os.path.exists(file_path):
+            return live, lines
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash
+                        logging.warning(f"Skipping unreadable line in {file_path}")
+                        continue
+                    JobJournal.apply(live, entry)
+            logging.debug(f"Read job journal: {len(live)} unfinished jobs in {lines} lines")
+        except Exception as e:
+            logging.error(f"Failed to read job journal {file_path}: {e}")
+        return live, lines
+
+    @staticmethod
+    def apply(live, entry):
+        job_id = entry['id']
+        if entry['state'] in FINISHED_STATES:
+            live.pop(job_id, None)
+        elif entry['state'] == QUEUED:
+            live[job_id] = {'job': entry['job'], 'state': QUEUED}
+        elif job_id in live:
+            live[job_id]['state'] = entry['state']
+            if 'path' in entry:
+                live[job_id]['path'] = entry['path']
+
+    def unfinished_jobs(self):
+        """
+        Return [(job, last state)] for jobs that were not saved or failed, in
+        queue order. Meant to be called at startup, before new entries are recorded.
+        """
+        return [(item['job'], item['state']) for item in self.live.values()]
+
+    def written_path(self, job_id):
+        """The image an unfinished job had already written when it was interrupted, or None."""
+        item = self.live.get(job_id)
+        return item.get('path') if item else None
+
+    def record(self, job, state, **fields):
+        entry = {'id': job['id'], 'state': state, 'time': time.time(), **fields}
+        if state == QUEUED:
+            entry['job'] = job
+        self.entries.put(entry)
+
+    def write_loop(self):
+        pending = 0
+        finished_ids = []
+        last_sync = time.monotonic()
+        f = open(self.file_path, 'a', encoding='utf-8')
+        try:
+            while True:
+                try:
+                    entry = self.entries.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    entry = None
+                if entry is _STOP:
+                    break
+                if entry is not None:
+                    f.write(json.dumps(entry) + "\n")
+                    self.apply(self.live, entry)
+                    self.lines += 1
+                    pending += 1
+                    if entry['state'] in FINISHED_STATES:
+                        finished_ids.append(entry['id'])
+                if pending and (pending >= self.flush_batch or time.monotonic() - last_sync >= self.flush_interval
+                                or self.entries.empty()):
+                    f.flush()
+                    os.fsync(f.fileno())
+                    pending = 0
+                    last_sync = time.monotonic()
+                    # Spooled downloads are only dropped once their final state is on disk
+                    for job_id in finished_ids:
+                        self.remove_spool(job_id)
+                    finished_ids = []
+                    if self.lines >= self.compact_min_lines and self.lines > 4 * len(self.live):
+                        f.close()
+                        self.compact()
+                        f = open(self.file_path, 'a', encoding='utf-8')
+        except Exception as e:
+            logging.error(f"Job journal writer stopped: {e}")
+        finally:
+            if not f.closed:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+                for job_id in finished_ids:
+                    self.remove_spool(job_id)
+
+    def compact(self):
+        tmp_path = self.file_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for job_id, item in self.live.items():
+                f.write(json.dumps({'id': job_id, 'state': QUEUED, 'time': time.time(), 'job': item['job']}) + "\n")
+                if item['state'] != QUEUED:
+                    entry = {'id': job_id, 'state': item['state'], 'time': time.time()}
+                    if 'path' in item:
+                        entry['path'] = item['path']
+                    f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.file_path)
+        logging.debug(f"Compacted job journal from {self.lines} lines to {len(self.live)} jobs")
+        self.lines = sum(1 if item['state'] == QUEUED else 2 for item in self.live.values())
+
+    def close(self):
+        self.entries.put(_STOP)
+        self.writer.join(timeout=5)
+
+    def spool_path(self, job_id):
+        return os.path.join(self.spool_folder, f"{job_id}.zip")
+
+    def write_spool(self, job_id, data):
+        os.makedirs(self.spool_folder, exist_ok=True)
+        tmp_path = self.spool_path(job_id) + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.spool_path(job_id))
+
+    def has_spool(self, job_id):
+        return os.path.exists(self.spool_path(job_id))
+
+    def read_spool(self, job_id):
+        try:
+            with open(self.spool_path(job_id), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def remove_spool(self, job_id):
+        try:
+            os.remove(self.spool_path(job_id))
+        except FileNotFoundError:
+            pass
@@ -1,303 +1,734 @@
 import sys
 import os
+import time
+import argparse
+import collections
 import json
 import random
 import logging
 import zipfile
+import threading
+import subprocess
 from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
 
-import requests
+import asyncio
 from PIL import Image
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QMainWindow, QLabel, QPushButton, QVBoxLayout, QHBoxLayout,
     QLineEdit, QComboBox, QListWidget, QListWidgetItem, QMessageBox, QFileDialog,
-    QScrollArea, QTextEdit, QProgressDialog, QDialog, QDialogButtonBox, QGridLayout, QSizePolicy,
-    QCheckBox
+    QTextEdit, QProgressDialog, QDialog, QDialogButtonBox, QSizePolicy,
+    QCheckBox, QCompleter, QFormLayout, QListView, QMenu
 )
-from PyQt5.QtGui import QPixmap, QColor, QPalette, QFont, QIcon
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSize
+from PyQt5.QtGui import QPixmap, QImage, QColor, QPalette, QFont
+from PyQt5.QtCore import (
+    Qt, QThread, QObject, pyqtSignal, QSize, QStringListModel, QAbstractListModel, QModelIndex,
+    QSortFilterProxyModel, QThreadPool, QRunnable, QTimer
+)
+
+import corpus
+import nai_client
+import gallery_maintenance
+import cooccurrence
+import prompt_vectors
+import sweep
+import profiling
+import job_journal
+from presets import PresetLibrary, PayloadTemplate, PresetError, SAMPLERS
+from generation_store import GenerationStore, make_job
+from records import load_tags_file, split_prompt, PromptStore
+from tag_index import TagIndex, FacetIndex
+from prompt_index import PromptIndex
+from token_pool import TokenPool
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
-
-def load_json_data(file_path):
-    try:
-        with open(file_path, 'r', encoding='utf-8') as file:
-            data = json.load(file)
-            logging.debug(f"Loaded data from {file_path}")
-            return data
-    except Exception as e:
-        logging.error(f"Failed to load JSON data from {file_path}: {e}")
-        return {}
-
-
-def extract_d_groups(tags):
-    d_groups = set()
-    for tag in tags:
-        if 'd_group' in tag:
-            d_groups.update(tag['d_group'])
-    return sorted(d_groups)
-
-
-def extract_artists(tags):
-    artists = []
-    for tag in tags:
-        if tag['d_category'] == 'artist':
-            power = max(tag.get('d_count', 0), tag.get('n_count', 0))
-            artists.append((tag['tag_name'], power))
-    return sorted(set(artists), key=lambda x: (-x[1], x[0]))
+# Serializes picking the next image_N.png name when several jobs finish at once
+image_name_lock = threading.Lock()
 
 
-def search_tags(keyword, tags, category, d_group, artist, min_power, max_power):
+def search_tags(keyword, tags, category, d_group, artist_id, min_power, max_power, facets=None):
     keyword = keyword.lower().strip()
-    if category == "ALL":
-        filtered_tags = tags
+    # Start from the smallest precomputed facet instead of scanning every tag
+    if artist_id is not None:
+        filtered_tags = [tags[artist_id]]
+    elif d_group != "ALL" and facets is not None:
+        filtered_tags = [tags[tag_id] for tag_id in facets.d_groups.get(d_group, ())]
     else:
-        filtered_tags = [tag for tag in tags if tag['d_category'] == category]
+        filtered_tags = tags
+    if category != "ALL":
+        filtered_tags = [tag for tag in filtered_tags if tag.d_category == category]
     if d_group != "ALL":
-        filtered_tags = [tag for tag in filtered_tags if 'd_group' in tag and d_group in tag['d_group']]
-    if artist != "ALL":
-        artist_name = artist.split('[')[0].strip()
-        filtered_tags = [tag for tag in filtered_tags if tag['tag_name'] == artist_name]
+        filtered_tags = [tag for tag in filtered_tags if d_group in tag.d_group]
 
     # If keyword is not empty, filter by keyword
     if keyword:
         filtered_tags = [
             tag for tag in filtered_tags
-            if keyword in tag['tag_name'].lower()
+            if keyword in tag.tag_name.lower()
         ]
 
     # Finally, apply power filters
-    return [
-        {**tag, 'power': tag['d_count'] if tag.get('d_count', 0) > tag.get('n_count', 0) else tag.get('n_count', 0)}
-        for tag in filtered_tags
-        if min_power <= max(tag.get('d_count', 0), tag.get('n_count', 0)) <= max_power
-    ]
+    return [tag for tag in filtered_tags if min_power <= tag.power <= max_power]
+
+
+def filter_prompt(prompt):
+    keywords_to_remove = ['censor', 'censored', 'bar censor', 'mosaic censoring']
+    prompt_words = prompt.split(', ')
+    filtered_prompt_words = [word for word in prompt_words if word.lower() not in keywords_to_remove]
+    return ', '.join(filtered_prompt_words)
+
+
+def save_image(image_data, output_folder="images"):
+    """Extract image_0.png from a NovelAI zip into the next free images/image_N.png and return its path."""
+    try:
+        os.makedirs(output_folder, exist_ok=True)
+
+        # Read the image out of the zip in memory; several jobs may be saving at once,
+        # so nothing is extracted to a shared file name
+        with zipfile.ZipFile(BytesIO(image_data), 'r') as zip_ref:
+            if "image_0.png" not in zip_ref.namelist():
+                logging.warning("Could not find extracted image.")
+                return None
+            png_data = zip_ref.read("image_0.png")
+
+        with image_name_lock:
+            # Give the image a unique name
+            # Archived duplicates keep their names, so they are never reused
+            archive_folder = os.path.join(output_folder, "archive")
+            names = os.listdir(output_folder) + (os.listdir(archive_folder) if os.path.isdir(archive_folder) else [])
+            image_files = [f for f in names if f.startswith("image_") and f.endswith(".png")]
+            image_numbers = [int(f.split("_")[1].split(".")[0]) for f in image_files if
+                             f.split("_")[1].split(".")[0].isdigit()]
+            next_number = max(image_numbers, default=-1) + 1
+            new_image_path = os.path.join(output_folder, f"image_{next_number}.png")
+            with open(new_image_path, "xb") as f:
+                f.write(png_data)
+        logging.debug(f"Extracted image saved as {new_image_path}")
+        return new_image_path
+    except Exception as e:
+        logging.error(f"Failed to save or extract image: {e}")
+        return None
+
+
+def save_job_image(job, image_data, journal=None):
+    """
+    Save a job's image and journal where it went. Runs in an executor thread,
+    which finishes even if the job is cancelled meanwhile, so the path is
+    journaled whenever the file was written.
+    """
+    image_path = save_image(image_data)
+    if image_path and journal:
+        journal.record(job, job_journal.WRITTEN, path=image_path)
+    return image_path
+
+
+async def run_generation_job(client, tokens, job, template, journal=None):
+    """
+    Generate one job and return the path of the saved image. Runs on the
+    AsyncBridge loop; file work is done in the loop's default executor.
+    """
+    loop = asyncio.get_running_loop()
+    prompt = filter_prompt(job['prompt'])
+    logging.debug(f"Original prompt: {job['prompt']}")
+    logging.debug(f"Filtered prompt: {prompt}")
+
+    # An interrupted job may have saved its image already
+    written_path = journal.written_path(job['id']) if journal else None
+    if written_path and os.path.exists(written_path):
+        logging.debug(f"Job {job['id']} was already saved to {written_path}")
+        return written_path
+
+    # Generate the image, unless it was already downloaded before an interruption
+    image_data = await loop.run_in_executor(None, journal.read_spool, job['id']) if journal else None
+    if image_data:
+        logging.debug(f"Using spooled download for job {job['id']}")
+    else:
+        if journal:
+            journal.record(job, job_journal.SENT)
+        logging.debug(f"Sending request to NovelAI with prompt: '{prompt}' (preset '{template.name}', seed {job['seed']})")
+        started = time.perf_counter()
+        image_data = await tokens.generate(client, template.build(prompt, job['seed']))
+        profiling.record_timing("network-generate", time.perf_counter() - started, bytes=len(image_data))
+        logging.debug("Image generated successfully.")
+        if journal:
+            await loop.run_in_executor(None, journal.write_spool, job['id'], image_data)
+            journal.record(job, job_journal.DOWNLOADED)
+
+    image_path = await loop.run_in_executor(None, save_job_image, job, image_data, journal)
+    if not image_path:
+        raise RuntimeError("Failed to save or extract the image.")
+    return image_path
+
 
+class AsyncBridge(QObject):
+    """
+    Runs an asyncio event loop in a background thread for the GUI. submit()
+    schedules a coroutine on it, and its outcome comes back as a signal on the
+    GUI thread together with the tag it was submitted with.
+    """
+    finished = pyqtSignal(object, object)  # tag, result
+    failed = pyqtSignal(object, str)  # tag, error message
+    cancelled = pyqtSignal(object)  # tag
 
-class ImageGenerationThread(QThread):
-    progress = pyqtSignal(str)
-    finished = pyqtSignal(str)
-    error = pyqtSignal(str)
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="AsyncBridge", daemon=True)
+        self.thread.start()
+
+    def submit(self, coroutine, tag=None):
+        """Schedule coroutine and return its concurrent.futures.Future, which can be cancelled."""
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        future.add_done_callback(lambda future: self._done(tag, future))
+        return future
+
+    def _done(self, tag, future):
+        # Called in the loop thread; Qt queues the signals to the GUI thread
+        if future.cancelled():
+            self.cancelled.emit(tag)
+            return
+        error = future.exception()
+        if error is None:
+            self.finished.emit(tag, future.result())
+        else:
+            message = str(error) or type(error).__name__
+            logging.error(f"Background task failed: {message}")
+            self.failed.emit(tag, message)
+
+    def shutdown(self, cleanup=None, timeout=5):
+        """Cancel the tasks still running, await cleanup() if given, and stop the loop."""
+        async def stop():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # Let file work the cancelled tasks left in the executor finish (and journal itself)
+            await self.loop.shutdown_default_executor()
+            if cleanup is not None:
+                await cleanup()
+
+        try:
+            asyncio.run_coroutine_threadsafe(stop(), self.loop).result(timeout)
+        except Exception as e:
+            logging.error(f"Failed to shut down background tasks cleanly: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
 
-    def __init__(self, prompt, api_token, parent=None):
+
+class GenerationQueue(QObject):
+    """
+    Runs generation jobs (see generation_store.make_job) in submission order
+    as coroutines on an AsyncBridge sharing one AsyncNovelAIClient. Requests
+    are spread over the accounts in a TokenPool, and as many jobs run at once
+    as its usable tokens have budget for (or max_concurrent, if given).
+    """
+    job_finished = pyqtSignal(object, str)  # job, image_path
+    job_failed = pyqtSignal(object, str)  # job, error message
+    queue_changed = pyqtSignal(int, int)  # queued, running
+
+    def __init__(self, presets, tokens, max_concurrent=None, journal=None, parent=None):
         super().__init__(parent)
-        self.prompt = prompt
-        self.api_token = api_token  # Receive API token as an argument
+        self.presets = presets
+        self.tokens = tokens
+        self.max_concurrent = max_concurrent
+        self.journal = journal
+        self.pending = collections.deque()
+        self.running = {}  # job id -> job
+        self.futures = {}  # job id -> future of its coroutine
+        self.cancelled_ids = set()
+        # The pool keeps each account within its budget; this only caps connections overall
+        self.client = nai_client.AsyncNovelAIClient(max_concurrent=32)
+        self.bridge = AsyncBridge(self)
+        self.bridge.finished.connect(self.on_job_finished)
+        self.bridge.failed.connect(self.on_job_error)
+        self.bridge.cancelled.connect(self.on_job_cancelled)
+
+    def submit(self, jobs, resumed=False):
+        if self.journal and not resumed:
+            for job in jobs:
+                self.journal.record(job, job_journal.QUEUED)
+        self.pending.extend(jobs)
+        logging.debug(f"Queued {len(jobs)} generation jobs ({len(self.pending)} waiting)")
+        self.start_next()
+
+    def start_next(self):
+        # At least one job runs even with no usable token, so it fails with the reason instead of waiting
+        while self.pending and len(self.running) < max(self.capacity(), 1):
+            job = self.pending.popleft()
+            try:
+                template = self.template_for(job)
+            except PresetError as e:
+                logging.error(f"Cannot run generation job {job['id']}: {e}")
+                if self.journal:
+                    self.journal.record(job, job_journal.FAILED, error=str(e))
+                self.job_failed.emit(job, str(e))
+                continue
+            coroutine = run_generation_job(self.client, self.tokens, job, template, self.journal)
+            self.running[job['id']] = job
+            self.futures[job['id']] = self.bridge.submit(coroutine, job)
+        self.queue_changed.emit(len(self.pending), len(self.running))
+
+    def template_for(self, job):
+        """
+        The template a job was made with. Jobs resumed from the journal carry
+        their resolved parameters, so they are sent as they were queued even if
+        the preset has been changed, renamed or removed since.
+        """
+        parameters = job.get('parameters')
+        if parameters is None:
+            # Queued before jobs carried their parameters
+            return self.presets.get(job['preset'], job['overrides'])
+        try:
+            template = self.presets.get(job['preset'], job['overrides'])
+            if template.parameters == parameters and template.model == job.get('model', template.model):
+                return template
+        except PresetError:
+            pass
+        return PayloadTemplate(job['preset'], parameters, job.get('model', self.presets.model))
+
+    def on_job_finished(self, job, image_path):
+        self.futures.pop(job['id'], None)
+        if self.running.pop(job['id'], None) is None:
+            return
+        self.job_finished.emit(job, image_path)
+        self.start_next()
+
+    def on_job_error(self, job, message):
+        self.futures.pop(job['id'], None)
+        if self.running.pop(job['id'], None) is None:
+            return
+        if self.journal:
+            self.journal.record(job, job_journal.FAILED, error=message)
+        self.job_failed.emit(job, message)
+        self.start_next()
+
+    def on_job_cancelled(self, job):
+        self.futures.pop(job['id'], None)
+        if self.running.pop(job['id'], None) is None:
+            return
+        if job['id'] in self.cancelled_ids:
+            self.cancelled_ids.discard(job['id'])
+            self.fail_cancelled(job)
+        # Otherwise the app is closing, and the job stays unfinished in the journal to be resumed
+        self.start_next()
+
+    def fail_cancelled(self, job):
+        if self.journal:
+            self.journal.record(job, job_journal.FAILED, error="Cancelled")
+        self.job_failed.emit(job, "Cancelled")
+
+    def cancel(self, job_ids=None):
+        """Cancel the given jobs, or every queued and running job if job_ids is None."""
+        cancelled = [job for job in self.pending if job_ids is None or job['id'] in job_ids]
+        for job in cancelled:
+            self.pending.remove(job)
+            self.fail_cancelled(job)
+        for job_id, future in list(self.futures.items()):
+            if job_ids is None or job_id in job_ids:
+                self.cancelled_ids.add(job_id)
+                future.cancel()
+        self.queue_changed.emit(len(self.pending), len(self.running))
+
+    def shutdown(self):
+        self.pending.clear()
+        self.bridge.shutdown(self.client.close)
+
+    def mark_saved(self, job):
+        if self.journal:
+            self.journal.record(job, job_journal.SAVED)
+
+    def is_idle(self):
+        return not self.pending and not self.running
+
+    def capacity(self):
+        return self.max_concurrent or self.tokens.capacity()
+
+
+class CooccurrenceBuildThread(QThread):
+    """
+    Builds the co-occurrence stats with cooccurrence.py in a separate process,
+    so the counting doesn't compete with the GUI for memory and the GIL, then
+    loads the result.
+    """
+    stats_ready = pyqtSignal(object)
+
+    def __init__(self, prompts_file, stats_path, corpus_folder, corpus_seq=0, parent=None):
+        super().__init__(parent)
+        self.prompts_file = prompts_file
+        self.stats_path = stats_path
+        self.corpus_folder = corpus_folder
+        self.corpus_seq = corpus_seq
 
     def run(self):
         try:
-            self.progress.emit("Starting image generation...")
-            # Prepare the prompt
-            keywords_to_remove = ['censor', 'censored', 'bar censor', 'mosaic censoring']
-            prompt_words = self.prompt.split(', ')
-            filtered_prompt_words = [word for word in prompt_words if word.lower() not in keywords_to_remove]
-            filtered_prompt = ', '.join(filtered_prompt_words)
-
-            logging.debug(f"Original prompt: {self.prompt}")
-            logging.debug(f"Filtered prompt: {filtered_prompt}")
-
-            # Generate the image
-            image_data = self.generate_image(filtered_prompt, self.api_token)
-            if not image_data:
-                self.error.emit("Image generation failed.")
+            logging.debug("Building co-occurrence stats in a separate process...")
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cooccurrence.py")
+            command = [sys.executable, script, '--stats', self.stats_path, 'build', self.prompts_file,
+                       '--corpus', self.corpus_folder, '--until', str(self.corpus_seq)]
+            start = time.perf_counter()
+            result = subprocess.run(command, capture_output=True, text=True)
+            profiling.record_timing("build-cooccurrence", time.perf_counter() - start)
+            if result.returncode != 0:
+                logging.error(f"Failed to build co-occurrence stats: {result.stderr.strip()[-2000:]}")
                 return
+            stats = cooccurrence.load_or_none(self.stats_path)
+            if stats is not None:
+                self.stats_ready.emit(stats)
+        except Exception as e:
+            logging.error(f"Failed to build co-occurrence stats: {e}")
 
-            # Save and extract the image
-            image_path = self.save_image(image_data)
-            if not image_path:
-                self.error.emit("Failed to save or extract the image.")
-                return
 
-            self.finished.emit(image_path)
+class PromptIndexBuildThread(QThread):
+    index_ready = pyqtSignal(object)
+
+    def __init__(self, prompts, parent=None):
+        super().__init__(parent)
+        self.prompts = prompts
 
+    def run(self):
+        try:
+            logging.debug("Building prompt index in the background...")
+            index = PromptIndex()
+            index.catch_up(self.prompts)
+            self.index_ready.emit(index)
         except Exception as e:
-            logging.error(f"Unexpected error during image generation: {e}")
-            self.error.emit(f"Unexpected error: {e}")
+            logging.error(f"Failed to build prompt index: {e}")
 
-    def generate_image(self, prompt, api_key):
-        url = "https://image.novelai.net/ai/generate-image"
 
-        headers = {
-            "Authorization": f"Bearer {api_key}"
-        }
+class DeletionIndexBuildThread(QThread):
+    deletes_ready = pyqtSignal(object, object)
 
-        payload = {
-            "input": prompt,
-            "model": "nai-diffusion-3",
-            "action": "generate",
-            "parameters": {
-                "params_version": 3,
-                "width": 832,
-                "height": 1216,
-                "scale": 7,
-                "sampler": "k_dpmpp_2s_ancestral",
-                "steps": 28,
-                "n_samples": 1,
-                "ucPreset": 3,
-                "qualityToggle": False,
-                "sm": False,
-                "sm_dyn": False,
-                "dynamic_thresholding": False,
-                "controlnet_strength": 1,
-                "legacy": False,
-                "add_original_image": True,
-                "cfg_rescale": 0,
-                "noise_schedule": "karras",
-                "legacy_v3_extend": False,
-                "skip_cfg_above_sigma": None,
-                "seed": random.randint(0, 4294967295),  # Random seed
-                "negative_prompt": "worst quality, low quality, bad image, displeasing, [abstract], bad anatomy, very displeasing, extra, unfocused, jpeg artifacts, unfinished, chromatic aberration,"
-            }
-        }
+    def __init__(self, tag_index, parent=None):
+        super().__init__(parent)
+        self.tag_index = tag_index
+        self.keys = list(tag_index.keys)
 
-        logging.debug(f"Sending request to NovelAI with prompt: '{prompt}'")
+    def run(self):
         try:
-            response = requests.post(url, json=payload, headers=headers)
+            logging.debug("Building tag suggestion index in the background...")
+            self.deletes_ready.emit(self.tag_index.build_deletes(self.keys), self.keys)
         except Exception as e:
-            logging.error(f"Request to NovelAI failed: {e}")
-            self.error.emit(f"Request to NovelAI failed: {e}")
-            return None
+            logging.error(f"Failed to build tag suggestion index: {e}")
 
-        if response.status_code != 200:
-            logging.error(f"Failed to generate image. Status code: {response.status_code}")
-            logging.error(f"Response Headers: {response.headers}")
-            logging.error(f"Response Body: {response.text}")
-            self.error.emit(f"Failed to generate image. Status code: {response.status_code}")
-            return None
 
-        logging.debug("Image generated successfully.")
-        return response.content
+class VectorIndexBuildThread(QThread):
+    index_ready = pyqtSignal(object)
 
-    def save_image(self, image_data, output_folder="images"):
+    def __init__(self, prompts, folder, parent=None):
+        super().__init__(parent)
+        self.prompts = prompts
+        self.folder = folder
+
+    def run(self):
         try:
-            os.makedirs(output_folder, exist_ok=True)
-            zip_path = os.path.join(output_folder, "output_image.zip")
-            with open(zip_path, "wb") as f:
-                f.write(image_data)
-            logging.debug(f"Saved image zip as {zip_path}")
-
-            # Extract the image from the zip file using BytesIO
-            with zipfile.ZipFile(BytesIO(image_data), 'r') as zip_ref:
-                zip_ref.extractall(output_folder)
-            logging.debug(f"Extracted image to {output_folder}")
-
-            extracted_image_path = os.path.join(output_folder, "image_0.png")
-            if os.path.exists(extracted_image_path):
-                logging.debug(f"Extracted image saved as {extracted_image_path}")
-                # Rename the image to a unique name
-                image_files = [f for f in os.listdir(output_folder) if f.startswith("image_") and f.endswith(".png")]
-                image_numbers = [int(f.split("_")[1].split(".")[0]) for f in image_files if
-                                 f.split("_")[1].split(".")[0].isdigit()]
-                next_number = max(image_numbers, default=-1) + 1
-                new_image_path = os.path.join(output_folder, f"image_{next_number}.png")
-                os.rename(extracted_image_path, new_image_path)
-                logging.debug(f"Renamed image to {new_image_path}")
-                return new_image_path
-            else:
-                logging.warning("Could not find extracted image.")
-                return None
+            logging.debug("Building prompt similarity index in the background...")
+            self.index_ready.emit(prompt_vectors.PromptVectorIndex.build(self.prompts, self.folder))
         except Exception as e:
-            logging.error(f"Failed to save or extract image: {e}")
-            self.error.emit(f"Failed to save or extract image: {e}")
+            logging.error(f"Failed to build prompt similarity index: {e}")
+
+
+class CorpusUpdateThread(QThread):
+    """Reads corpus segments ingested since a batch, then merges small segments."""
+    records_ready = pyqtSignal(int, object)  # last batch seq, [(batch seq, record)]
+
+    def __init__(self, segments, since, parent=None):
+        super().__init__(parent)
+        self.segments = segments
+        self.since = since
+
+    def run(self):
+        try:
+            last_seq, records = self.segments.records_since(self.since)
+            if last_seq > self.since:
+                self.records_ready.emit(last_seq, records)
+            self.segments.merge()
+        except Exception as e:
+            logging.error(f"Failed to update from corpus segments: {e}")
+
+
+class ImageLoader(QObject):
+    """Decodes images in the global thread pool, scaled to fit size x size if a size is given."""
+    loaded = pyqtSignal(str, QImage)  # image_path, image
+
+    def __init__(self, size=None, parent=None):
+        super().__init__(parent)
+        self.size = size
+        self.pool = QThreadPool.globalInstance()
+
+    def request(self, image_path, source_path=None):
+        """Load image_path, decoding it from source_path (e.g. a smaller preview) if one is given."""
+        self.pool.start(ImageLoadTask(self, image_path, source_path))
+
+
+class ImageLoadTask(QRunnable):
+    def __init__(self, loader, image_path, source_path=None):
+        super().__init__()
+        self.loader = loader
+        self.image_path = image_path
+        self.source_path = source_path
+
+    def run(self):
+        # QImage (unlike QPixmap) can be decoded and scaled off the GUI thread
+        image = QImage(self.source_path or self.image_path)
+        if image.isNull() and self.source_path:
+            image = QImage(self.image_path)
+        if not image.isNull() and self.loader.size:
+            image = image.scaled(self.loader.size, self.loader.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.loader.loaded.emit(self.image_path, image)
+
+
+class GalleryModel(QAbstractListModel):
+    """
+    List model over generated images, one row per image file (a prompt
+    generated several times, e.g. by a sweep, has a row for each image).
+    Thumbnails are decoded in the thread pool
+    the first time a row is painted and kept in a bounded cache, so only the
+    visible part of a large gallery is ever loaded. preview_path maps an image
+    path to a smaller preview to decode instead, or None.
+    """
+    PromptRole = Qt.UserRole
+    PathRole = Qt.UserRole + 1
+    CreatedRole = Qt.UserRole + 2
+
+    def __init__(self, entries=(), thumbnail_size=150, cache_size=2000, preview_path=None, parent=None):
+        super().__init__(parent)
+        self.entries = list(entries)  # (prompt, image_path, created)
+        self.preview_path = preview_path or (lambda image_path: None)
+        self.reindex()
+        self.thumbnails = collections.OrderedDict()  # image_path -> QPixmap, least recently used first
+        self.cache_size = cache_size
+        self.requested = set()
+        self.placeholder = QPixmap(thumbnail_size, thumbnail_size)
+        self.placeholder.fill(QColor(46, 46, 46))
+        self.loader = ImageLoader(thumbnail_size, self)
+        self.loader.loaded.connect(self.on_thumbnail_loaded)
+
+    def reindex(self):
+        self.rows_by_path = {entry[1]: row for row, entry in enumerate(self.entries)}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
             return None
+        prompt, image_path, created = self.entries[index.row()]
+        if role == Qt.DecorationRole:
+            return self.thumbnail(image_path)
+        if role in (Qt.ToolTipRole, self.PromptRole):
+            return prompt
+        if role == self.PathRole:
+            return image_path
+        if role == self.CreatedRole:
+            return created
+        return None
+
+    def thumbnail(self, image_path):
+        pixmap = self.thumbnails.get(image_path)
+        if pixmap is not None:
+            self.thumbnails.move_to_end(image_path)
+            return pixmap
+        if image_path not in self.requested:
+            self.requested.add(image_path)
+            self.loader.request(image_path, self.preview_path(image_path))
+        return self.placeholder
+
+    def on_thumbnail_loaded(self, image_path, image):
+        self.requested.discard(image_path)
+        if image.isNull():
+            return
+        self.thumbnails[image_path] = QPixmap.fromImage(image)
+        while len(self.thumbnails) > self.cache_size:
+            self.thumbnails.popitem(last=False)
+        row = self.rows_by_path.get(image_path)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def set_entries(self, entries):
+        self.beginResetModel()
+        self.entries = list(entries)
+        self.reindex()
+        self.endResetModel()
+
+    def add_entry(self, prompt, image_path, created):
+        row = self.rows_by_path.get(image_path)
+        if row is not None:
+            self.entries[row] = (prompt, image_path, created)
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+            return
+        row = len(self.entries)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.entries.append((prompt, image_path, created))
+        self.rows_by_path[image_path] = row
+        self.endInsertRows()
+
+    def image_paths(self):
+        return [entry[1] for entry in self.entries]
 
 
 class GalleryWidget(QWidget):
     prompt_selected = pyqtSignal(str)  # Signal to emit the prompt when an image is clicked
+    image_selected = pyqtSignal(str)  # Signal to emit the image path when an image is clicked
+    more_like_this = pyqtSignal(str)  # Signal to emit the prompt of an image to find similar prompts
+
+    SORT_OPTIONS = {
+        "Newest first": (GalleryModel.CreatedRole, Qt.DescendingOrder),
+        "Oldest first": (GalleryModel.CreatedRole, Qt.AscendingOrder),
+        "Prompt A-Z": (GalleryModel.PromptRole, Qt.AscendingOrder),
+    }
 
-    def __init__(self, generated_images, parent=None):
+    def __init__(self, store, parent=None):
         super().__init__(parent)
-        self.generated_images = generated_images  # dict mapping prompt to image_path
+        self.store = store
         self.init_ui()
 
     def init_ui(self):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        # Ensure vertical scrolling and disable horizontal scrolling
-        scroll.setVerticalScrollBarPolicy(Qt.ScrollBarAsNeeded)
-        scroll.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
-        layout.addWidget(scroll)
-
-        self.container = QWidget()
-        self.grid_layout = QGridLayout()
-        self.grid_layout.setSpacing(10)  # Add spacing between thumbnails
-        self.container.setLayout(self.grid_layout)
-        scroll.setWidget(self.container)
-
-        # Define number of columns (set to 2)
-        self.columns = 2
-        self.row = 0
-        self.col = 0
-
-        self.populate_gallery()
-
-    def populate_gallery(self):
-        for prompt, image_path in self.generated_images.items():
-            if not os.path.exists(image_path):
-                continue  # Skip if image file doesn't exist
-            self.add_thumbnail(prompt, image_path)
-
-    def add_thumbnail(self, prompt, image_path):
-        thumb_button = QPushButton()
-        thumb_button.setFixedSize(150, 150)
-        thumb_button.setStyleSheet("border: none;")
-
-        pixmap = QPixmap(image_path)
-        if pixmap.isNull():
-            return  # Skip if pixmap couldn't be loaded
-        scaled_pixmap = pixmap.scaled(150, 150, Qt.KeepAspectRatio, Qt.SmoothTransformation)
-        thumb_button.setIcon(QIcon(scaled_pixmap))
-        thumb_button.setIconSize(QSize(150, 150))
-
-        thumb_button.clicked.connect(lambda checked, p=prompt: self.prompt_selected.emit(p))
-
-        self.grid_layout.addWidget(thumb_button, self.row, self.col)
-        self.col += 1
-        if self.col >= self.columns:
-            self.col = 0
-            self.row += 1
-
-    def refresh_gallery(self, generated_images):
-        # Clear existing thumbnails
-        while self.grid_layout.count():
-            item = self.grid_layout.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.setParent(None)
-        # Reset row and column
-        self.row = 0
-        self.col = 0
-        # Update generated_images
-        self.generated_images = generated_images
-        # Repopulate
-        self.populate_gallery()
-
-    def add_new_image(self, prompt, image_path):
-        self.generated_images[prompt] = image_path
-        self.add_thumbnail(prompt, image_path)
+        # Filter and sort controls
+        controls_layout = QHBoxLayout()
+        self.filter_entry = QLineEdit()
+        self.filter_entry.setPlaceholderText("Filter by prompt...")
+        controls_layout.addWidget(self.filter_entry)
+        self.sort_combo = QComboBox()
+        self.sort_combo.addItems(list(self.SORT_OPTIONS))
+        controls_layout.addWidget(self.sort_combo)
+        layout.addLayout(controls_layout)
+
+        self.model = GalleryModel(self.store.gallery_entries(), preview_path=self.store.preview_path, parent=self)
+        self.proxy_model = QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(self.model)
+        self.proxy_model.setFilterRole(GalleryModel.PromptRole)
+        self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy_model.setDynamicSortFilter(True)
+
+        # Icon mode list view: only visible thumbnails are painted, and the
+        # number of columns follows the width of the view
+        self.view = QListView()
+        self.view.setViewMode(QListView.IconMode)
+        self.view.setResizeMode(QListView.Adjust)
+        self.view.setMovement(QListView.Static)
+        self.view.setUniformItemSizes(True)
+        self.view.setLayoutMode(QListView.Batched)
+        self.view.setBatchSize(200)
+        self.view.setIconSize(QSize(150, 150))
+        self.view.setGridSize(QSize(160, 160))  # Add spacing between thumbnails
+        self.view.setSpacing(5)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setModel(self.proxy_model)
+        layout.addWidget(self.view)
+
+        self.filter_entry.textChanged.connect(self.apply_filter)
+        self.sort_combo.currentTextChanged.connect(self.apply_sort)
+        self.view.clicked.connect(self.on_item_clicked)
+        self.view.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.view.customContextMenuRequested.connect(self.show_context_menu)
+        self.apply_sort(self.sort_combo.currentText())
+
+    @profiling.profiled("gallery-filter")
+    def apply_filter(self, text):
+        self.proxy_model.setFilterFixedString(text)
+
+    @profiling.profiled("gallery-sort")
+    def apply_sort(self, option):
+        role, order = self.SORT_OPTIONS[option]
+        self.proxy_model.setSortRole(role)
+        self.proxy_model.sort(0, order)
+
+    def on_item_clicked(self, index):
+        self.prompt_selected.emit(index.data(GalleryModel.PromptRole))
+        self.image_selected.emit(index.data(GalleryModel.PathRole))
+
+    def show_context_menu(self, pos):
+        index = self.view.indexAt(pos)
+        if not index.isValid():
+            return
+        menu = QMenu(self)
+        more_action = menu.addAction("More like this")
+        if menu.exec_(self.view.viewport().mapToGlobal(pos)) == more_action:
+            self.more_like_this.emit(index.data(GalleryModel.PromptRole))
+
+    def neighbour_paths(self, image_path, radius=2):
+        """Image paths shown next to image_path (nearest first), for prefetching."""
+        row = self.model.rows_by_path.get(image_path)
+        if row is None:
+            return []
+        proxy_row = self.proxy_model.mapFromSource(self.model.index(row)).row()
+        if proxy_row < 0:
+            return []
+        paths = []
+        for offset in range(1, radius + 1):
+            for neighbour in (proxy_row + offset, proxy_row - offset):
+                if 0 <= neighbour < self.proxy_model.rowCount():
+                    paths.append(self.proxy_model.index(neighbour, 0).data(GalleryModel.PathRole))
+        return paths
+
+    def visible_image_paths(self):
+        """Image paths in the order currently shown, after filtering and sorting."""
+        return [
+            self.proxy_model.index(row, 0).data(GalleryModel.PathRole)
+            for row in range(self.proxy_model.rowCount())
+        ]
+
+    def refresh_gallery(self):
+        self.model.set_entries(self.store.gallery_entries())
+
+    def add_new_image(self, prompt, image_path, created=None):
+        self.model.add_entry(prompt, image_path, created if created is not None else time.time())
 
 
 class CombinedApp(QMainWindow):
-    def __init__(self, tags, artists, prompts):
+    contact_sheet_ready = pyqtSignal(object, object)  # sweep plan, future from the worker process
+    maintenance_batch_ready = pyqtSignal(object)  # future from the gallery maintenance process
+
+    def __init__(self, tags, facets, prompts, tag_index, cooccurrence_stats, corpus_segments, corpus_seq=0):
         super().__init__()
         self.tags = tags
-        self.artists = artists
+        self.facets = facets
+        self.tag_index = tag_index
         self.prompts = prompts
-        self.generated_images_file = "generated_images.json"
-        self.generated_images = self.load_generated_images()
-        self.api_token = self.load_api_token()  # Load API token
+        self.cooccurrence_stats = cooccurrence_stats
+        self.cooccurrence_file = "cooccurrence.zip"
+        self.prompts_file = "safebooru_clean.json"
+        self.corpus_segments = corpus_segments
+        self.corpus_seq = corpus_seq  # Last ingested batch applied to the data above
+        self.corpus_mtime = corpus_segments.manifest_mtime()
+        self.corpus_thread = None
+        self.vector_folder = "prompt_vectors"
+        self.vector_index = prompt_vectors.load_or_none(self.vector_folder, prompts)
+        self.presets = PresetLibrary.load("presets.json")
+        self.journal = job_journal.JobJournal("job_journal.jsonl")
+        self.token_pool = TokenPool.load("apitoken.json")
+        self.generation_queue = GenerationQueue(self.presets, self.token_pool, journal=self.journal)
+        self.generation_queue.job_finished.connect(self.on_image_generated)
+        self.generation_queue.job_failed.connect(self.on_image_error)
+        self.generation_queue.queue_changed.connect(self.on_queue_changed)
+        self.single_job = None
+        self.current_prompt = None
+        self.sweeps = {}  # sweep id -> SweepPlan
+        self.failed_job_ids = set()
+        self.contact_sheet_pool = None
+        self.contact_sheet_ready.connect(self.on_contact_sheet_ready)
+        self.maintenance_pool = None
+        self.maintenance_pending = []
+        self.maintenance_running = False
+        self.offer_dedup = False
+        self.maintenance_batch_ready.connect(self.on_maintenance_batch)
+        self.store = GenerationStore("generated_images.json", "generation_records.jsonl")
+        self.generated_images = self.store.images
         self.setWindowTitle("Combined Tag Search and Prompt Finder")
         self.setGeometry(100, 100, 1800, 900)
         self.setup_ui()
+        self.resume_interrupted_jobs()
 
     def setup_ui(self):
         # Check and prompt for API token if necessary
-        if not self.api_token:
+        if not self.token_pool.usable():
             self.prompt_api_token()
 
         # Main widget and layout
@@ -307,7 +738,7 @@ class CombinedApp(QMainWindow):
         self.setCentralWidget(main_widget)
 
         # Tag Search Section
-        tag_search_widget = TagSearchWidget(self.tags, self.artists, self.update_promptcheck)
+        tag_search_widget = TagSearchWidget(self.tags, self.facets, self.tag_index, self.update_promptcheck)
         main_layout.addWidget(tag_search_widget, 2)
 
         # Separator
@@ -317,7 +748,9 @@ class CombinedApp(QMainWindow):
         main_layout.addWidget(separator)
 
         # Prompt Finder Section
-        prompt_finder_widget = PromptFinderWidget(self.prompts, self.handle_prompt_click)
+        prompt_finder_widget = PromptFinderWidget(self.prompts, self.handle_prompt_click, self.cooccurrence_stats)
+        prompt_finder_widget.suggestion_selected.connect(self.update_promptcheck)
+        prompt_finder_widget.more_like_this.connect(self.show_similar_prompts)
         main_layout.addWidget(prompt_finder_widget, 3)
 
         # Image Display and Gallery Section
@@ -326,18 +759,40 @@ class CombinedApp(QMainWindow):
         image_display_container.setLayout(image_display_layout)
         main_layout.addWidget(image_display_container, 4)
 
-        # Add toggle button for gallery
+        # Add toggle button for gallery and the generation preset selector
+        controls_layout = QHBoxLayout()
         toggle_gallery_button = QPushButton("Toggle Gallery")
-        image_display_layout.addWidget(toggle_gallery_button)
+        controls_layout.addWidget(toggle_gallery_button)
         toggle_gallery_button.clicked.connect(self.toggle_gallery)
+        controls_layout.addWidget(QLabel("Preset:"))
+        self.preset_combo = QComboBox()
+        self.preset_combo.addItems(self.presets.names())
+        controls_layout.addWidget(self.preset_combo)
+        sweep_button = QPushButton("Sweep...")
+        sweep_button.clicked.connect(self.show_sweep_dialog)
+        controls_layout.addWidget(sweep_button)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(lambda: self.generation_queue.cancel())
+        controls_layout.addWidget(self.cancel_button)
+        clean_up_button = QPushButton("Clean Up...")
+        clean_up_button.clicked.connect(lambda: self.start_maintenance(offer_dedup=True))
+        controls_layout.addWidget(clean_up_button)
+        image_display_layout.addLayout(controls_layout)
+
+        self.queue_status_label = QLabel("")
+        self.queue_status_label.setStyleSheet("color: #aaaaaa;")
+        image_display_layout.addWidget(self.queue_status_label)
 
         # Image Display Widget
         self.image_display_widget = ImageDisplayWidget()
         image_display_layout.addWidget(self.image_display_widget)
 
         # Gallery Widget (initially hidden)
-        self.gallery_widget = GalleryWidget(self.generated_images)
+        self.gallery_widget = GalleryWidget(self.store)
         self.gallery_widget.prompt_selected.connect(self.on_gallery_prompt_selected)
+        self.gallery_widget.image_selected.connect(self.on_gallery_image_selected)
+        self.gallery_widget.more_like_this.connect(self.show_similar_prompts)
         self.gallery_widget.hide()
         image_display_layout.addWidget(self.gallery_widget)
 
@@ -346,45 +801,133 @@ class CombinedApp(QMainWindow):
         self.prompt_finder_widget = prompt_finder_widget
         self.image_display_container = image_display_container
 
+        # Background threads work on snapshots, since ingested prompts may be appended meanwhile
+        if self.cooccurrence_stats is None:
+            self.cooccurrence_thread = CooccurrenceBuildThread(
+                self.prompts_file, self.cooccurrence_file, self.corpus_segments.folder, self.corpus_seq)
+            self.cooccurrence_thread.stats_ready.connect(self.on_cooccurrence_ready)
+            self.cooccurrence_thread.start()
+        self.prompt_index_thread = PromptIndexBuildThread(self.prompts.snapshot())
+        self.prompt_index_thread.index_ready.connect(self.on_prompt_index_ready)
+        self.prompt_index_thread.start()
+        self.deletes_thread = DeletionIndexBuildThread(self.tag_index)
+        self.deletes_thread.deletes_ready.connect(self.tag_index.set_deletes)
+        self.deletes_thread.start()
+        if self.vector_index is None:
+            self.vector_index_thread = VectorIndexBuildThread(self.prompts.snapshot(), self.vector_folder)
+            self.vector_index_thread.index_ready.connect(self.on_vector_index_ready)
+            self.vector_index_thread.start()
+        else:
+            self.vector_index.catch_up(self.prompts)
+
+        # Pick up prompts and tags ingested while the app is running
+        self.corpus_timer = QTimer(self)
+        self.corpus_timer.timeout.connect(self.check_corpus)
+        self.corpus_timer.start(2000)
+
+        # Build previews for images added since the last run, once startup work has settled
+        QTimer.singleShot(10000, self.start_maintenance)
+
+    def on_cooccurrence_ready(self, stats):
+        if stats.corpus_seq < self.corpus_seq:
+            cooccurrence.catch_up(stats, self.corpus_segments, until=self.corpus_seq)
+        self.cooccurrence_stats = stats
+        self.prompt_finder_widget.set_cooccurrence_stats(stats)
+
+    def on_prompt_index_ready(self, index):
+        index.catch_up(self.prompts)
+        self.prompt_finder_widget.set_prompt_index(index)
+
+    def on_vector_index_ready(self, index):
+        index.catch_up(self.prompts)
+        self.vector_index = index
+
+    @profiling.profiled("more-like-this")
+    def show_similar_prompts(self, prompt):
+        if self.vector_index is None:
+            QMessageBox.information(self, "More like this",
+                                    "The similarity index is still being built. Try again in a minute.")
+            return
+        results = [
+            (self.prompts[prompt_id], score)
+            for prompt_id, score in self.vector_index.search(prompt, k=51)
+        ]
+        results = [(similar, score) for similar, score in results if similar != prompt][:50]
+        logging.debug(f"Found {len(results)} prompts like: {prompt}")
+        self.prompt_finder_widget.display_similar(prompt, results)
+
+    def check_corpus(self):
+        mtime = self.corpus_segments.manifest_mtime()
+        if mtime == self.corpus_mtime or (self.corpus_thread is not None and self.corpus_thread.isRunning()):
+            return
+        self.corpus_mtime = mtime
+        self.corpus_thread = CorpusUpdateThread(self.corpus_segments, self.corpus_seq)
+        self.corpus_thread.records_ready.connect(self.on_corpus_records)
+        self.corpus_thread.start()
+
+    @profiling.profiled("corpus-update")
+    def on_corpus_records(self, last_seq, records):
+        if last_seq <= self.corpus_seq:
+            return
+        stats = self.cooccurrence_stats
+        added_prompts = added_tags = 0
+        for seq, record in records:
+            if seq <= self.corpus_seq:
+                continue
+            if 'prompt' in record:
+                self.prompts.append(record['prompt'])
+                if stats is not None:
+                    stats.add_prompt(record['prompt'])
+                added_prompts += 1
+            else:
+                tag_id = corpus.apply_tag_record(self.tags, record)
+                if tag_id is None:
+                    continue
+                self.facets.add(tag_id)
+                self.tag_index.add(self.tags[tag_id])
+                added_tags += 1
+        self.corpus_seq = last_seq
+        if stats is not None:
+            stats.corpus_seq = last_seq
+        if self.prompt_finder_widget.prompt_index is not None:
+            self.prompt_finder_widget.prompt_index.catch_up(self.prompts)
+        if self.vector_index is not None:
+            self.vector_index.catch_up(self.prompts)
+        if added_tags:
+            self.tag_search_widget.facets_changed()
+        if added_prompts:
+            self.prompt_finder_widget.update_suggestions()
+        logging.debug(f"Picked up {added_prompts} prompts and {added_tags} tags from corpus batch {last_seq}")
+
     def prompt_api_token(self):
         dialog = APIPromptDialog()
         if dialog.exec_() == QDialog.Accepted:
             entered_token, save_token = dialog.get_inputs()
             if entered_token:
-                self.api_token = entered_token
+                self.token_pool.add(entered_token)
                 if save_token:
                     self.save_api_token(entered_token)
-        else:
-            # User cancelled the dialog; proceed without saving the token
-            self.api_token = None
-
-    def load_api_token(self):
-        try:
-            with open("apitoken.json", "r", encoding='utf-8') as f:
-                data = json.load(f)
-                token = data.get("token", "").strip()
-                if token:
-                    logging.debug("API token loaded successfully.")
-                    return token
-                else:
-                    logging.debug("API token is empty.")
-                    return None
-        except FileNotFoundError:
-            logging.debug("apitoken.json not found.")
-            return None
-        except Exception as e:
-            logging.error(f"Failed to load API token: {e}")
-            return None
+        # If the user cancelled the dialog, carry on without a token
 
     def save_api_token(self, token):
         try:
+            # Keep any other tokens listed in the file
+            try:
+                with open("apitoken.json", "r", encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            if not isinstance(data, dict):
+                data = {}
+            data["token"] = token
             with open("apitoken.json", "w", encoding='utf-8') as f:
-                json.dump({"token": token}, f, indent=4)
+                json.dump(data, f, indent=4)
             logging.debug("API token saved to apitoken.json")
         except Exception as e:
             logging.error(f"Failed to save API token: {e}")
             QMessageBox.critical(self, "Error", f"Failed to save API token: {e}")
 
+    @profiling.profiled("toggle-gallery")
     def toggle_gallery(self):
         if self.gallery_widget.isVisible():
             self.gallery_widget.hide()
@@ -397,27 +940,16 @@ class CombinedApp(QMainWindow):
         logging.debug(f"Gallery prompt selected: {prompt}")
         self.prompt_finder_widget.set_prompt(prompt)
 
-    def load_generated_images(self):
-        if os.path.exists(self.generated_images_file):
-            try:
-                with open(self.generated_images_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    logging.debug("Loaded generated_images.json")
-                    return data
-            except Exception as e:
-                logging.error(f"Failed to load {self.generated_images_file}: {e}")
-                return {}
-        else:
-            return {}
+    def on_gallery_image_selected(self, image_path):
+        # The prompt list will most likely open this image or one next to it
+        self.image_display_widget.prefetch([image_path] + self.gallery_widget.neighbour_paths(image_path))
 
-    def save_generated_images(self):
-        try:
-            with open(self.generated_images_file, 'w', encoding='utf-8') as f:
-                json.dump(self.generated_images, f, indent=4)
-            logging.debug("Saved generated_images.json")
-        except Exception as e:
-            logging.error(f"Failed to save {self.generated_images_file}: {e}")
+    @profiling.profiled("show-image")
+    def show_image(self, image_path):
+        self.image_display_widget.display_image(image_path)
+        self.image_display_widget.prefetch(self.gallery_widget.neighbour_paths(image_path))
 
+    @profiling.profiled("add-tag")
     def update_promptcheck(self, tag):
         current_prompt = self.prompt_finder_widget.get_prompt_text()
         if current_prompt:
@@ -435,10 +967,11 @@ class CombinedApp(QMainWindow):
     def handle_prompt_click(self, prompt, click_type):
         # We no longer need 'click_type' since we're handling everything with single-click
         # Modify the function signature accordingly if needed
+        self.current_prompt = prompt
         image_path = self.generated_images.get(prompt)
         if image_path and os.path.exists(image_path):
             logging.debug(f"Image exists for prompt: {prompt}, displaying {image_path}")
-            self.image_display_widget.display_image(image_path)
+            self.show_image(image_path)
         else:
             logging.debug(f"No image found for prompt: {prompt}")
             reply = QMessageBox.question(
@@ -449,50 +982,335 @@ class CombinedApp(QMainWindow):
                 QMessageBox.No
             )
             if reply == QMessageBox.Yes:
-                if not self.api_token:
-                    # Prompt for API token before generating image
-                    self.prompt_api_token()
-                    if not self.api_token:
-                        QMessageBox.warning(self, "API Token Required", "API token is required to generate images.")
-                        return
+                if not self.ensure_api_token():
+                    return
                 self.generate_image(prompt)
 
+    def resume_interrupted_jobs(self):
+        jobs = []
+        for job, state in self.journal.unfinished_jobs():
+            if self.store.find(job['key']):
+                # Saved before the journal caught up with it
+                self.generation_queue.mark_saved(job)
+            else:
+                jobs.append((job, state))
+        if not jobs:
+            return
+
+        downloaded = sum(1 for job, state in jobs if self.journal.has_spool(job['id']))
+        sent = sum(1 for job, state in jobs if state == job_journal.SENT)
+        logging.debug(f"Found {len(jobs)} interrupted jobs ({downloaded} downloaded, {sent} sent)")
+        message = f"{len(jobs)} image generation jobs were interrupted last time."
+        if downloaded:
+            message += f" {downloaded} were already downloaded and will be saved without a new request."
+        if sent:
+            message += f" {sent} had been sent to NovelAI and may be charged again."
+        reply = QMessageBox.question(
+            self, "Resume Jobs", message + " Resume them?", QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes
+        )
+        if reply == QMessageBox.Yes and (downloaded == len(jobs) or self.ensure_api_token()):
+            self.generation_queue.submit([job for job, state in jobs], resumed=True)
+        else:
+            for job, state in jobs:
+                self.journal.record(job, job_journal.FAILED, error="discarded")
+
+    def ensure_api_token(self):
+        if not self.token_pool.usable():
+            # Prompt for API token before generating images
+            self.prompt_api_token()
+            if not self.token_pool.usable():
+                QMessageBox.warning(self, "API Token Required", "API token is required to generate images.")
+                return False
+        return True
+
     def generate_image(self, prompt):
-        # Start the image generation thread
+        # Queue the image generation job and wait for it
         self.progress_dialog = QProgressDialog("Generating Image...", "Cancel", 0, 0, self)
         self.progress_dialog.setWindowTitle("Please Wait")
         self.progress_dialog.setWindowModality(Qt.WindowModal)
-        self.progress_dialog.setCancelButton(None)
         self.progress_dialog.show()
 
-        self.image_thread = ImageGenerationThread(prompt, self.api_token)  # Pass the API token
-        self.image_thread.progress.connect(self.progress_dialog.setLabelText)
-        self.image_thread.finished.connect(self.on_image_generated)
-        self.image_thread.error.connect(self.on_image_error)
-        self.image_thread.start()
+        self.single_job = make_job(self.presets, prompt, self.preset_combo.currentText())
+        self.progress_dialog.canceled.connect(
+            lambda job_id=self.single_job['id']: self.generation_queue.cancel({job_id}))
+        self.generation_queue.submit([self.single_job])
 
-    def on_image_generated(self, image_path):
-        self.progress_dialog.close()
+    def on_image_generated(self, job, image_path):
+        prompt = job['prompt']
         # Update the mapping
-        prompt = self.image_thread.prompt
-        self.generated_images[prompt] = image_path
-        self.save_generated_images()
+        record = self.store.add(job, image_path)
+        self.generation_queue.mark_saved(job)
+        # Add the new image to the gallery
+        self.gallery_widget.add_new_image(prompt, image_path, record['created'])
+
+        if job.get('sweep_id'):
+            plan = self.sweeps.get(job['sweep_id'])
+            if plan:
+                plan.set_result(job, image_path)
+                self.check_sweep_complete(plan)
+            return
+
+        if job is not self.single_job:
+            # Background jobs, e.g. resumed after a restart, don't interrupt the user
+            logging.debug(f"Background job finished: {image_path}")
+            return
+        self.single_job = None
+        self.progress_dialog.close()
         # Display the image
         self.image_display_widget.display_image(image_path)
-        # Add the new image to the gallery
-        self.gallery_widget.add_new_image(prompt, image_path)
         QMessageBox.information(self, "Success", f"Image generated and saved to {image_path}")
 
-    def on_image_error(self, error_message):
+    def on_image_error(self, job, error_message):
+        if job.get('sweep_id'):
+            logging.error(f"Sweep job failed ({job['prompt']}, seed {job['seed']}): {error_message}")
+            self.failed_job_ids.add(job['id'])
+            plan = self.sweeps.get(job['sweep_id'])
+            if plan:
+                self.check_sweep_complete(plan)
+            return
+        if job is not self.single_job:
+            logging.error(f"Background job failed ({job['prompt']}): {error_message}")
+            return
+        self.single_job = None
         self.progress_dialog.close()
-        QMessageBox.critical(self, "Error", error_message)
+        if error_message != "Cancelled":
+            QMessageBox.critical(self, "Error", error_message)
+
+    def on_queue_changed(self, queued, running):
+        self.cancel_button.setEnabled(bool(queued or running))
+        self.queue_status_label.setToolTip(self.token_pool.describe())
+        if queued or running:
+            status = f"Generating: {running} running, {queued} queued"
+            if len(self.token_pool.tokens) > 1:
+                status += f" on {len(self.token_pool.usable())} of {len(self.token_pool.tokens)} accounts"
+            self.queue_status_label.setText(status)
+        else:
+            self.queue_status_label.setText("")
+            self.start_maintenance()
+
+    def show_sweep_dialog(self):
+        prompt = self.current_prompt or self.prompt_finder_widget.get_prompt_text()
+        if not prompt:
+            QMessageBox.warning(self, "Sweep", "Click a prompt (or type one) to sweep first.")
+            return
+        dialog = SweepDialog(prompt, self.preset_combo.currentText(), self.presets, self.store, self)
+        if dialog.exec_() != QDialog.Accepted or dialog.plan is None:
+            return
+        plan = dialog.plan
+        if plan.jobs and not self.ensure_api_token():
+            return
+        self.sweeps[plan.id] = plan
+        logging.debug(f"Starting sweep {plan.id}: {len(plan.jobs)} jobs, {plan.reused} reused, ~{plan.anlas} Anlas")
+        self.generation_queue.submit(plan.jobs)
+        self.check_sweep_complete(plan)
+
+    def check_sweep_complete(self, plan):
+        if not plan.is_complete(self.failed_job_ids):
+            return
+        del self.sweeps[plan.id]
+        output_path = os.path.join("sweeps", f"{plan.id}.png")
+        row_labels = [plan.row_label(row) for row in range(len(plan.rows))]
+        # Assemble the contact sheet in a worker process so the GUI stays responsive
+        if self.contact_sheet_pool is None:
+            self.contact_sheet_pool = ProcessPoolExecutor(max_workers=1)
+        future = self.contact_sheet_pool.submit(
+            sweep.build_contact_sheet, plan.contact_sheet_cells(), row_labels, len(plan.seeds), output_path
+        )
+        future.add_done_callback(lambda future, plan=plan: self.contact_sheet_ready.emit(plan, future))
+
+    def on_contact_sheet_ready(self, plan, future):
+        try:
+            sheet_path = future.result()
+        except Exception as e:
+            logging.error(f"Failed to build contact sheet for sweep {plan.id}: {e}")
+            sheet_path = None
+        record_path = plan.save_record("sweeps", sheet_path)
+        if sheet_path:
+            self.image_display_widget.display_image(sheet_path)
+        QMessageBox.information(self, "Sweep Finished", f"Sweep saved to {record_path}")
+
+    def start_maintenance(self, offer_dedup=False):
+        """
+        Build previews and perceptual hashes for new images in the low priority
+        maintenance process, then offer to archive duplicates if asked to.
+        """
+        self.offer_dedup = self.offer_dedup or offer_dedup
+        if self.maintenance_running:
+            return
+        self.maintenance_pending = gallery_maintenance.pending_images(self.store)
+        if not self.maintenance_pending:
+            self.finish_maintenance()
+            return
+        logging.debug(f"Gallery maintenance: {len(self.maintenance_pending)} images to process")
+        self.maintenance_running = True
+        if self.maintenance_pool is None:
+            self.maintenance_pool = gallery_maintenance.make_pool()
+        self.submit_maintenance_batch()
+
+    def submit_maintenance_batch(self, batch_size=16):
+        # Small batches, and none at all while anything is generating
+        if not self.generation_queue.is_idle():
+            QTimer.singleShot(5000, self.submit_maintenance_batch)
+            return
+        batch = self.maintenance_pending[:batch_size]
+        del self.maintenance_pending[:batch_size]
+        future = self.maintenance_pool.submit(gallery_maintenance.process_batch, batch)
+        future.add_done_callback(self.maintenance_batch_ready.emit)
+
+    def on_maintenance_batch(self, future):
+        try:
+            records = future.result()
+        except Exception as e:
+            logging.error(f"Gallery maintenance failed: {e}")
+            self.maintenance_pool = None  # A broken pool can't be reused
+            self.maintenance_running = False
+            self.offer_dedup = False
+            return
+        for record in records:
+            if 'error' in record:
+                logging.error(f"Failed to build preview for {record['path']}: {record['error']}")
+            self.store.add_preview(record)
+        if self.maintenance_pending:
+            self.submit_maintenance_batch()
+        else:
+            self.maintenance_running = False
+            self.finish_maintenance()
+
+    def finish_maintenance(self):
+        if not self.offer_dedup:
+            return
+        self.offer_dedup = False
+        plan = gallery_maintenance.plan_dedup(self.store)
+        if not plan:
+            QMessageBox.information(self, "Clean Up", "No duplicate images found.")
+            return
+        count = sum(len(duplicates) for _, duplicates in plan)
+        size = sum(self.store.previews[path].get('size', 0) for _, duplicates in plan for path in duplicates)
+        answer = QMessageBox.question(
+            self, "Clean Up",
+            f"Found {count} duplicate or near-identical images in {len(plan)} groups ({size / 2 ** 20:.1f} MB).\n"
+            f"Move them to {gallery_maintenance.ARCHIVE_FOLDER}? One image of each group is kept.",
+            QMessageBox.Yes | QMessageBox.No
+        )
+        if answer != QMessageBox.Yes:
+            return
+        moved, moved_bytes = gallery_maintenance.archive_duplicates(self.store, plan)
+        self.gallery_widget.refresh_gallery()
+        QMessageBox.information(self, "Clean Up", f"Archived {moved} images ({moved_bytes / 2 ** 20:.1f} MB).")
+
+    def closeEvent(self, event):
+        if self.contact_sheet_pool is not None:
+            self.contact_sheet_pool.shutdown(wait=False)
+        if self.maintenance_pool is not None:
+            self.maintenance_pool.shutdown(wait=False, cancel_futures=True)
+        self.generation_queue.shutdown()
+        for line in self.token_pool.describe().splitlines():
+            logging.debug(f"API token usage: {line}")
+        self.journal.close()
+        self.store.flush()
+        super().closeEvent(event)
+
+
+class SweepDialog(QDialog):
+    """
+    Dialog to set up a parameter sweep for a prompt and preview its cost before
+    anything is sent.
+    """
+
+    def __init__(self, prompt, preset, presets, store, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Parameter Sweep")
+        self.prompt = prompt
+        self.presets = presets
+        self.store = store
+        self.plan = None
+        self.init_ui(preset)
+
+    def init_ui(self, preset):
+        layout = QVBoxLayout()
+        self.setLayout(layout)
+
+        prompt_label = QLabel(self.prompt)
+        prompt_label.setWordWrap(True)
+        layout.addWidget(prompt_label)
+
+        form = QFormLayout()
+        self.preset_combo = QComboBox()
+        self.preset_combo.addItems(self.presets.names())
+        self.preset_combo.setCurrentText(preset)
+        form.addRow("Preset:", self.preset_combo)
+        self.seeds_entry = QLineEdit("random:4")
+        form.addRow("Seeds:", self.seeds_entry)
+        defaults = self.presets.presets[preset]
+        self.axis_entries = {}
+        for name in sweep.SWEEP_AXES:
+            entry = QLineEdit(str(defaults.get(name, "")))
+            if name == "sampler":
+                entry.setToolTip(", ".join(sorted(SAMPLERS)))
+            form.addRow(f"{name}:", entry)
+            self.axis_entries[name] = entry
+        self.opus_checkbox = QCheckBox("Opus (free generations where eligible)")
+        form.addRow(self.opus_checkbox)
+        layout.addLayout(form)
+
+        hint = QLabel("Separate values with commas. Seeds can be a list or random:N.")
+        hint.setStyleSheet("color: #aaaaaa;")
+        layout.addWidget(hint)
+
+        self.summary_label = QLabel("")
+        layout.addWidget(self.summary_label)
+
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.validate)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        self.preset_combo.currentTextChanged.connect(self.update_summary)
+        self.seeds_entry.editingFinished.connect(self.update_summary)
+        self.opus_checkbox.toggled.connect(self.update_summary)
+        for entry in self.axis_entries.values():
+            entry.textChanged.connect(self.update_summary)
+        self.update_summary()
+
+    def build_plan(self):
+        axes = {
+            name: sweep.parse_values(entry.text(), sweep.SWEEP_AXES[name])
+            for name, entry in self.axis_entries.items()
+        }
+        seeds = sweep.parse_seeds(self.seeds_entry.text())
+        if not seeds:
+            raise ValueError("At least one seed is required.")
+        return sweep.SweepPlan(
+            self.prompt, self.preset_combo.currentText(), seeds, axes,
+            self.presets, self.store, self.opus_checkbox.isChecked()
+        )
+
+    def update_summary(self):
+        try:
+            self.plan = self.build_plan()
+        except ValueError as e:
+            self.plan = None
+            self.summary_label.setText(f"Invalid sweep: {e}")
+            return
+        self.summary_label.setText(
+            f"{len(self.plan.cells)} cells: {len(self.plan.jobs)} to generate, "
+            f"{self.plan.reused} already generated. Estimated cost: {self.plan.anlas} Anlas"
+        )
+
+    def validate(self):
+        self.update_summary()
+        if self.plan is None:
+            QMessageBox.warning(self, "Input Error", self.summary_label.text())
+            return
+        self.accept()
 
 
 class TagSearchWidget(QWidget):
-    def __init__(self, tags, artists, update_promptcheck_callback):
+    def __init__(self, tags, facets, tag_index, update_promptcheck_callback):
         super().__init__()
         self.tags = tags
-        self.artists = artists
+        self.facets = facets
+        self.tag_index = tag_index
         self.update_promptcheck_callback = update_promptcheck_callback
         self.init_ui()
 
@@ -508,6 +1326,13 @@ class TagSearchWidget(QWidget):
         search_layout.addWidget(QLabel("Keyword:"))
         search_layout.addWidget(self.keyword_entry)
 
+        # Autocomplete ranked by power, refreshed from the tag index on each keystroke
+        self.completion_model = QStringListModel()
+        self.completer = QCompleter(self.completion_model, self)
+        self.completer.setCaseSensitivity(Qt.CaseInsensitive)
+        self.completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        self.keyword_entry.setCompleter(self.completer)
+
         self.category_combo = QComboBox()
         self.category_combo.addItems(["ALL", "general", "artist", "copyright", "character", "meta", "none"])
         search_layout.addWidget(QLabel("Category:"))
@@ -545,36 +1370,62 @@ class TagSearchWidget(QWidget):
         self.d_group_button.clicked.connect(self.show_d_group_popup)
         self.artist_button.clicked.connect(self.show_artist_popup)
         self.keyword_entry.returnPressed.connect(self.perform_search)
+        self.keyword_entry.textEdited.connect(self.update_completions)
+        self.completer.activated.connect(self.perform_search)
         self.results_list.itemClicked.connect(self.on_item_clicked)  # Connect the signal to the handler
 
         # Initialize variables
         self.selected_d_group = "ALL"
-        self.selected_artist = "ALL"
+        self.selected_artist = None  # Tag id of the selected artist
+        self.d_group_model = None  # Popup models are built on first use and reused
+        self.artist_model = None
+
+    def update_completions(self, text):
+        self.completion_model.setStringList(self.tag_index.complete(text))
+
+    def facets_changed(self):
+        # Rebuilt with the new tags the next time a popup opens
+        self.d_group_model = None
+        self.artist_model = None
 
     def show_d_group_popup(self):
-        d_group_options = ["ALL"] + extract_d_groups(self.tags)
-        dialog = SelectionDialog("Select D-Group", d_group_options)
+        if self.d_group_model is None:
+            self.d_group_model = FacetModel(
+                [(group, count, group) for group, count in self.facets.d_group_options()], self
+            )
+        dialog = FacetSelectionDialog("Select D-Group", self.d_group_model, self)
         if dialog.exec_() == QDialog.Accepted:
-            self.selected_d_group = dialog.get_selected_item()
+            group = dialog.get_selected_value()
+            self.selected_d_group = group if group is not None else "ALL"
+            self.d_group_button.setText("Select D-Group" if group is None else f"D-Group: {group}")
             self.perform_search()
 
     def show_artist_popup(self):
-        artist_options = ["ALL"] + [f"{artist[0]} [{artist[1]}]" for artist in self.artists]
-        dialog = SelectionDialog("Select Artist", artist_options)
+        if self.artist_model is None:
+            self.artist_model = FacetModel(
+                [(self.tags[tag_id].tag_name, self.tags[tag_id].power, tag_id) for tag_id in self.facets.artists],
+                self
+            )
+        dialog = FacetSelectionDialog("Select Artist", self.artist_model, self)
         if dialog.exec_() == QDialog.Accepted:
-            self.selected_artist = dialog.get_selected_item()
+            self.selected_artist = dialog.get_selected_value()
+            if self.selected_artist is None:
+                self.artist_button.setText("Select Artist")
+            else:
+                self.artist_button.setText(f"Artist: {self.tags[self.selected_artist].tag_name}")
             self.perform_search()
 
+    @profiling.profiled("tag-search")
     def perform_search(self):
         keyword = self.keyword_entry.text().strip()
         # Allow search if keyword is present or if d_group or artist is selected
-        if not keyword and self.selected_d_group == "ALL" and self.selected_artist == "ALL":
+        if not keyword and self.selected_d_group == "ALL" and self.selected_artist is None:
             QMessageBox.warning(self, "Input Error", "Please enter a keyword or select a d-group or artist to search.")
             return
 
         category = self.category_combo.currentText()
         d_group = self.selected_d_group
-        artist = self.selected_artist
+        artist_id = self.selected_artist
         try:
             min_power = int(self.min_power_entry.text())
         except ValueError:
@@ -591,23 +1442,29 @@ class TagSearchWidget(QWidget):
             return
 
         logging.debug(
-            f"Performing search with keyword='{keyword}', category='{category}', d_group='{d_group}', artist='{artist}', min_power={min_power}, max_power={max_power}"
+            f"Performing search with keyword='{keyword}', category='{category}', d_group='{d_group}', artist_id={artist_id}, min_power={min_power}, max_power={max_power}"
         )
 
-        results = search_tags(keyword, self.tags, category, d_group, artist, min_power, max_power)
-        self.display_results(results)
+        results = search_tags(keyword, self.tags, category, d_group, artist_id, min_power, max_power, self.facets)
+        suggestions = self.tag_index.suggest(keyword) if keyword and not results else []
+        self.display_results(results, suggestions)
 
-    def display_results(self, results):
+    @profiling.profiled("display-results")
+    def display_results(self, results, suggestions=()):
         self.results_list.clear()
         if not results:
             self.results_list.addItem("No matching tags found.")
+            for suggestion in suggestions:
+                item = QListWidgetItem(f"Did you mean: {suggestion}?")
+                item.setData(Qt.UserRole, suggestion)
+                self.results_list.addItem(item)
             return
 
         max_results = 1000  # Limit to prevent excessive memory usage
         limited_results = results[:max_results]
         for index, tag in enumerate(limited_results):
             # Create a custom widget for each item
-            item_widget = PromptListItem(tag['tag_name'], tag['power'], tag['d_category'], index)
+            item_widget = PromptListItem(tag.tag_name, tag.power, tag.d_category, index)
             list_item = QListWidgetItem(self.results_list)
             list_item.setSizeHint(item_widget.sizeHint())
             self.results_list.addItem(list_item)
@@ -615,6 +1472,12 @@ class TagSearchWidget(QWidget):
         logging.debug(f"Displayed {len(limited_results)} results out of {len(results)} total matching tags.")
 
     def on_item_clicked(self, item):
+        suggestion = item.data(Qt.UserRole)
+        if suggestion:
+            logging.debug(f"Suggestion clicked: {suggestion}")
+            self.keyword_entry.setText(suggestion)
+            self.perform_search()
+            return
         widget = self.results_list.itemWidget(item)
         if isinstance(widget, PromptListItem):
             tag_name = widget.tag_name
@@ -667,10 +1530,15 @@ class PromptListItem(QWidget):
 
 
 class PromptFinderWidget(QWidget):
-    def __init__(self, prompts, generate_image_callback):
+    suggestion_selected = pyqtSignal(str)  # Signal to emit a suggested tag when it is clicked
+    more_like_this = pyqtSignal(str)  # Signal to emit a prompt to find similar prompts for
+
+    def __init__(self, prompts, generate_image_callback, cooccurrence_stats=None):
         super().__init__()
         self.prompts = prompts
         self.generate_image_callback = generate_image_callback
+        self.cooccurrence_stats = cooccurrence_stats
+        self.prompt_index = None  # Searches scan the prompts until the index is built
         self.init_ui()
 
     def init_ui(self):
@@ -690,10 +1558,27 @@ class PromptFinderWidget(QWidget):
         # Connect signals
         self.input_entry.returnPressed.connect(self.search_prompts)
 
-        # Search Button
+        # Search Button, and a button to find prompts similar to the one typed in
+        buttons_layout = QHBoxLayout()
         self.search_button = QPushButton("Search")
-        layout.addWidget(self.search_button)
+        buttons_layout.addWidget(self.search_button)
         self.search_button.clicked.connect(self.search_prompts)
+        self.more_like_button = QPushButton("More like this")
+        buttons_layout.addWidget(self.more_like_button)
+        self.more_like_button.clicked.connect(self.on_more_like_clicked)
+        layout.addLayout(buttons_layout)
+
+        # Tags that often appear alongside the current prompt
+        self.suggestions_label = QLabel("Suggested tags:")
+        self.suggestions_label.setStyleSheet("color: white;")
+        layout.addWidget(self.suggestions_label)
+        self.suggestions_list = QListWidget()
+        self.suggestions_list.setFlow(QListWidget.LeftToRight)
+        self.suggestions_list.setWrapping(True)
+        self.suggestions_list.setMaximumHeight(80)
+        self.suggestions_list.setStyleSheet("background-color: #2e2e2e; color: #ffcc00;")
+        self.suggestions_list.itemClicked.connect(self.on_suggestion_clicked)
+        layout.addWidget(self.suggestions_list)
 
         # Results List
         self.results_list = QListWidget()
@@ -701,8 +1586,10 @@ class PromptFinderWidget(QWidget):
         self.results_list.setStyleSheet("background-color: #2e2e2e; color: white;")
         layout.addWidget(self.results_list)
 
-        # Connect item single-click
+        # Connect item single-click, and right-click for "More like this"
         self.results_list.itemClicked.connect(self.on_item_clicked)
+        self.results_list.setContextMenuPolicy(Qt.CustomContextMenu)
+        self.results_list.customContextMenuRequested.connect(self.show_results_menu)
 
     def set_prompt(self, prompt):
         self.input_entry.setText(prompt)
@@ -711,38 +1598,93 @@ class PromptFinderWidget(QWidget):
     def get_prompt_text(self):
         return self.input_entry.text().strip()
 
+    def set_prompt_index(self, index):
+        self.prompt_index = index
+
+    def set_cooccurrence_stats(self, stats):
+        self.cooccurrence_stats = stats
+        self.update_suggestions()
+
+    @profiling.profiled("suggestions")
+    def update_suggestions(self):
+        self.suggestions_list.clear()
+        if self.cooccurrence_stats is None:
+            return
+        tags = split_prompt(self.input_entry.text())
+        for tag, score in self.cooccurrence_stats.suggest(tags):
+            item = QListWidgetItem(f"{tag} ({score:.1f})")
+            item.setData(Qt.UserRole, tag)
+            self.suggestions_list.addItem(item)
+
+    def on_suggestion_clicked(self, item):
+        tag = item.data(Qt.UserRole)
+        logging.debug(f"Suggested tag clicked: {tag}")
+        self.suggestion_selected.emit(tag)
+
+    @profiling.profiled("prompt-search")
     def search_prompts(self):
         keywords = self.input_entry.text().split(',')
         keywords = [keyword.strip().lower() for keyword in keywords if keyword.strip()]
         logging.debug(f"Searching prompts with keywords: {keywords}")
+        self.update_suggestions()
 
-        if not keywords and not self.input_entry.text().strip():
+        if not keywords:
             # No keywords entered, display all prompts
             matching_prompts = self.prompts
+        elif self.prompt_index is not None:
+            # Only the sampled prompts are decoded, by id
+            matching_prompts = self.prompt_index.search(keywords)
         else:
-            if not keywords:
-                # If no keywords, match all prompts
-                matching_prompts = self.prompts
-            else:
-                # Match prompts containing all keywords
-                matching_prompts = [prompt for prompt in self.prompts if
-                                    all(keyword in prompt.lower() for keyword in keywords)]
+            # Match prompts containing all keywords
+            matching_prompts = [prompt for prompt in self.prompts if
+                                all(keyword in prompt.lower() for keyword in keywords)]
 
         self.results_list.clear()
         if matching_prompts:
             max_results = 1000  # Limit to prevent excessive memory usage
             selected_prompts = random.sample(matching_prompts, min(max_results, len(matching_prompts)))
-            for prompt in selected_prompts:
-                # Create a custom widget for each prompt
-                item_widget = PromptDisplayItem(prompt)
-                list_item = QListWidgetItem(self.results_list)
-                list_item.setSizeHint(item_widget.sizeHint())
-                self.results_list.addItem(list_item)
-                self.results_list.setItemWidget(list_item, item_widget)
+            if keywords and self.prompt_index is not None:
+                selected_prompts = [self.prompts[prompt_id] for prompt_id in selected_prompts]
+            self.show_prompts(selected_prompts)
             logging.debug(f"Displayed {len(selected_prompts)} matching prompts out of {len(matching_prompts)} total.")
         else:
             self.results_list.addItem("No matching prompts found.")
 
+    @profiling.profiled("show-prompts")
+    def show_prompts(self, prompts):
+        for prompt in prompts:
+            # Create a custom widget for each prompt
+            item_widget = PromptDisplayItem(prompt)
+            list_item = QListWidgetItem(self.results_list)
+            list_item.setSizeHint(item_widget.sizeHint())
+            self.results_list.addItem(list_item)
+            self.results_list.setItemWidget(list_item, item_widget)
+
+    def display_similar(self, prompt, results):
+        """Show (prompt, similarity) results for a "More like this" lookup."""
+        self.results_list.clear()
+        if not results:
+            self.results_list.addItem("No similar prompts found.")
+            return
+        self.results_list.addItem(f"Prompts like: {prompt}")
+        self.show_prompts(similar for similar, _ in results)
+        for row, (_, score) in enumerate(results, 1):
+            self.results_list.item(row).setToolTip(f"Similarity {score:.2f}")
+
+    def on_more_like_clicked(self):
+        prompt = self.get_prompt_text()
+        if prompt:
+            self.more_like_this.emit(prompt)
+
+    def show_results_menu(self, pos):
+        prompt = self.get_prompt_from_item(self.results_list.itemAt(pos))
+        if not prompt:
+            return
+        menu = QMenu(self)
+        more_action = menu.addAction("More like this")
+        if menu.exec_(self.results_list.viewport().mapToGlobal(pos)) == more_action:
+            self.more_like_this.emit(prompt)
+
     def on_item_clicked(self, item):
         prompt = self.get_prompt_from_item(item)
         if prompt:
@@ -750,6 +1692,8 @@ class PromptFinderWidget(QWidget):
             self.generate_image_callback(prompt, "single")
 
     def get_prompt_from_item(self, item):
+        if item is None:
+            return None
         widget = self.results_list.itemWidget(item)
         if isinstance(widget, PromptDisplayItem):
             return widget.prompt_text
@@ -780,8 +1724,30 @@ class PromptDisplayItem(QWidget):
 
 
 class ImageDisplayWidget(QWidget):
-    def __init__(self):
+    """
+    Shows one image scaled to fit. Decoded originals are kept in a small LRU
+    cache (and neighbouring images can be prefetched into it), and resizes are
+    always scaled from the original: quickly at most every fast_ms while the
+    size is changing, then smoothly once it settles.
+    """
+
+    def __init__(self, cache_size=8, settle_ms=150, fast_ms=30):
         super().__init__()
+        self.cache = collections.OrderedDict()  # image_path -> QImage, least recently used first
+        self.cache_size = cache_size
+        self.requested = set()
+        self.current_path = None
+        self.original = None  # QPixmap of the current image at full size
+        self.loader = ImageLoader(parent=self)
+        self.loader.loaded.connect(self.on_image_loaded)
+        self.smooth_timer = QTimer(self)
+        self.smooth_timer.setSingleShot(True)
+        self.smooth_timer.setInterval(settle_ms)
+        self.smooth_timer.timeout.connect(lambda: self.rescale(Qt.SmoothTransformation))
+        self.fast_timer = QTimer(self)
+        self.fast_timer.setSingleShot(True)
+        self.fast_timer.setInterval(fast_ms)
+        self.fast_timer.timeout.connect(lambda: self.rescale(Qt.FastTransformation))
         self.init_ui()
 
     def init_ui(self):
@@ -791,59 +1757,154 @@ class ImageDisplayWidget(QWidget):
         self.image_label = QLabel("Generated Image will appear here.")
         self.image_label.setAlignment(Qt.AlignCenter)
         self.image_label.setStyleSheet("color: white; font-size: 16px;")
+        # Let the layout size the label, not the pixmap it currently shows
+        self.image_label.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
+        self.image_label.setMinimumSize(1, 1)
         layout.addWidget(self.image_label)
 
+    def cache_image(self, image_path, image):
+        self.cache[image_path] = image
+        self.cache.move_to_end(image_path)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def prefetch(self, image_paths):
+        for image_path in image_paths:
+            if image_path and image_path not in self.cache and image_path not in self.requested:
+                self.requested.add(image_path)
+                self.loader.request(image_path)
+
+    def on_image_loaded(self, image_path, image):
+        self.requested.discard(image_path)
+        if not image.isNull():
+            self.cache_image(image_path, image)
+
     def display_image(self, image_path):
         try:
             logging.debug(f"Displaying image from {image_path}")
-            pixmap = QPixmap(image_path)
-            if pixmap.isNull():
-                raise ValueError("Pixmap is null.")
+            image = self.cache.get(image_path)
+            if image is None:
+                image = QImage(image_path)
+                if image.isNull():
+                    raise ValueError("Pixmap is null.")
+            self.cache_image(image_path, image)
+            self.current_path = image_path
+            self.original = QPixmap.fromImage(image)
             # Scale the image to fit the label while maintaining aspect ratio
-            scaled_pixmap = pixmap.scaled(
-                self.image_label.size(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            )
-            self.image_label.setPixmap(scaled_pixmap)
+            self.fast_timer.stop()
+            self.smooth_timer.stop()
+            self.rescale(Qt.SmoothTransformation)
             self.image_label.setText("")  # Clear the placeholder text
             logging.debug(f"Image displayed from {image_path}")
         except Exception as e:
             logging.error(f"Failed to display image: {e}")
             QMessageBox.critical(self, "Error", f"Failed to display image: {e}")
 
+    def rescale(self, transformation):
+        if self.original is None:
+            return
+        self.image_label.setPixmap(self.original.scaled(
+            self.image_label.size(),
+            Qt.KeepAspectRatio,
+            transformation
+        ))
+
     def resizeEvent(self, event):
-        # Rescale the image when the widget is resized
-        if self.image_label.pixmap():
-            self.image_label.setPixmap(self.image_label.pixmap().scaled(
-                self.image_label.size(),
-                Qt.KeepAspectRatio,
-                Qt.SmoothTransformation
-            ))
+        # Rescale from the original when the widget is resized: the resize events arriving
+        # within fast_ms share one fast rescale, and a smooth one follows once resizing stops
+        super().resizeEvent(event)
+        if self.original is not None:
+            if not self.fast_timer.isActive():
+                self.fast_timer.start()
+            self.smooth_timer.start()
+
+
+class FacetModel(QAbstractListModel):
+    """
+    Read-only list of (name, count, value) options for FacetSelectionDialog,
+    with an "ALL" row (value None) first. Labels ("name [count]") are
+    formatted once, when the model is built; NameRole gives the bare name to
+    filter on.
+    """
+    ValueRole = Qt.UserRole
+    NameRole = Qt.UserRole + 1
+
+    def __init__(self, options, parent=None):
+        super().__init__(parent)
+        self.options = [("ALL", "ALL", None)] + [(f"{name} [{count}]", name, value) for name, count, value in options]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.options)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        label, name, value = self.options[index.row()]
+        if role == Qt.DisplayRole:
+            return label
+        if role == self.ValueRole:
+            return value
+        if role == self.NameRole:
+            return name
+        return None
+
 
+class FacetSelectionDialog(QDialog):
+    """
+    Searchable popup over a FacetModel. Typing filters the list by name; Enter
+    picks the highlighted (or first) match, and does nothing while nothing matches.
+    """
 
-class SelectionDialog(QDialog):
-    def __init__(self, title, options, parent=None):
+    def __init__(self, title, model, parent=None):
         super().__init__(parent)
         self.setWindowTitle(title)
-        self.selected_item = None
-        self.init_ui(options)
+        self.resize(400, 500)
+        self.proxy_model = QSortFilterProxyModel(self)
+        self.proxy_model.setSourceModel(model)
+        self.proxy_model.setFilterCaseSensitivity(Qt.CaseInsensitive)
+        self.proxy_model.setFilterRole(FacetModel.NameRole)
+        self.init_ui()
 
-    def init_ui(self, options):
+    def init_ui(self):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
-        self.combo = QComboBox()
-        self.combo.addItems(options)
-        layout.addWidget(self.combo)
+        self.filter_entry = QLineEdit()
+        self.filter_entry.setPlaceholderText("Type to filter...")
+        layout.addWidget(self.filter_entry)
+
+        self.list_view = QListView()
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setModel(self.proxy_model)
+        self.list_view.setCurrentIndex(self.proxy_model.index(0, 0))
+        layout.addWidget(self.list_view)
 
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(self.accept)
         buttons.rejected.connect(self.reject)
         layout.addWidget(buttons)
 
-    def get_selected_item(self):
-        return self.combo.currentText()
+        self.filter_entry.textChanged.connect(self.apply_filter)
+        self.filter_entry.returnPressed.connect(self.accept)
+        self.list_view.doubleClicked.connect(self.accept)
+        self.filter_entry.setFocus()
+
+    def apply_filter(self, text):
+        self.proxy_model.setFilterFixedString(text)
+        if not self.list_view.currentIndex().isValid():
+            self.list_view.setCurrentIndex(self.proxy_model.index(0, 0))
+
+    def selected_index(self):
+        index = self.list_view.currentIndex()
+        return index if index.isValid() else self.proxy_model.index(0, 0)
+
+    def accept(self):
+        # With no match there is nothing to pick; keep the dialog open rather than fall back to ALL
+        if self.selected_index().isValid():
+            super().accept()
+
+    def get_selected_value(self):
+        return self.selected_index().data(FacetModel.ValueRole)
 
 
 class APIPromptDialog(QDialog):
@@ -892,35 +1953,63 @@ class APIPromptDialog(QDialog):
 
 
 def main():
-    # Load data
-    tags_data = load_json_data('naidv3_tags_pretty.json')
-    tags = tags_data.get('tags', [])
-    artists = extract_artists(tags)
-    prompts_data = load_json_data('safebooru_clean.json')
-    prompts = prompts_data if isinstance(prompts_data, list) else []
-
-    app = QApplication(sys.argv)
-    app.setStyle("Fusion")
-
-    # Apply dark theme
-    palette = QPalette()
-    palette.setColor(QPalette.Window, QColor(28, 28, 28))
-    palette.setColor(QPalette.WindowText, Qt.white)
-    palette.setColor(QPalette.Base, QColor(46, 46, 46))
-    palette.setColor(QPalette.AlternateBase, QColor(28, 28, 28))
-    palette.setColor(QPalette.ToolTipBase, Qt.white)
-    palette.setColor(QPalette.ToolTipText, Qt.white)
-    palette.setColor(QPalette.Text, Qt.white)
-    palette.setColor(QPalette.Button, QColor(28, 28, 28))
-    palette.setColor(QPalette.ButtonText, Qt.white)
-    palette.setColor(QPalette.BrightText, Qt.red)
-    palette.setColor(QPalette.Link, QColor(42, 130, 218))
-    palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
-    palette.setColor(QPalette.HighlightedText, Qt.black)
-    app.setPalette(palette)
-
-    window = CombinedApp(tags, artists, prompts)
-    window.show()
+    parser = argparse.ArgumentParser(description="Search NovelAI prompts and generate images.")
+    parser.add_argument('--profile', nargs='?', const='profiles', metavar='FOLDER',
+                        help="Write a performance report for startup and every action to FOLDER (default profiles)")
+    args, qt_args = parser.parse_known_args()
+    if args.profile:
+        profiling.enable(args.profile)
+
+    with profiling.action("startup"):
+        # Load data
+        with profiling.action("load-tags"):
+            tags = load_tags_file('naidv3_tags_pretty.json')
+        with profiling.action("load-prompts"):
+            prompts = PromptStore.from_json_file('safebooru_clean.json')
+
+        # Add what has been ingested since the base files were made
+        with profiling.action("load-corpus"):
+            corpus_segments = corpus.CorpusSegments('corpus')
+            corpus_seq, records = corpus_segments.records_since(0)
+            for _, record in records:
+                if 'prompt' in record:
+                    prompts.append(record['prompt'])
+                else:
+                    corpus.apply_tag_record(tags, record)
+            logging.debug(f"Loaded {len(records)} ingested records up to batch {corpus_seq}")
+            del records
+
+        with profiling.action("build-tag-indexes"):
+            facets = FacetIndex(tags)
+            tag_index = TagIndex(tags)
+        with profiling.action("load-cooccurrence"):
+            cooccurrence_stats = cooccurrence.load_or_none('cooccurrence.zip')
+            if cooccurrence_stats is not None and cooccurrence_stats.corpus_seq < corpus_seq:
+                cooccurrence.catch_up(cooccurrence_stats, corpus_segments, until=corpus_seq)
+
+        app = QApplication(sys.argv[:1] + qt_args)
+        app.setStyle("Fusion")
+
+        # Apply dark theme
+        palette = QPalette()
+        palette.setColor(QPalette.Window, QColor(28, 28, 28))
+        palette.setColor(QPalette.WindowText, Qt.white)
+        palette.setColor(QPalette.Base, QColor(46, 46, 46))
+        palette.setColor(QPalette.AlternateBase, QColor(28, 28, 28))
+        palette.setColor(QPalette.ToolTipBase, Qt.white)
+        palette.setColor(QPalette.ToolTipText, Qt.white)
+        palette.setColor(QPalette.Text, Qt.white)
+        palette.setColor(QPalette.Button, QColor(28, 28, 28))
+        palette.setColor(QPalette.ButtonText, Qt.white)
+        palette.setColor(QPalette.BrightText, Qt.red)
+        palette.setColor(QPalette.Link, QColor(42, 130, 218))
+        palette.setColor(QPalette.Highlight, QColor(42, 130, 218))
+        palette.setColor(QPalette.HighlightedText, Qt.black)
+        app.setPalette(palette)
+
+        with profiling.action("build-window"):
+            window = CombinedApp(tags, facets, prompts, tag_index, cooccurrence_stats, corpus_segments, corpus_seq)
+            window.show()
     sys.exit(app.exec_())
 
 
@@ -0,0 +1,80 @@
+# nai_client.py
+import asyncio
+import logging
+
+import aiohttp
+
+GENERATE_URL = "https://image.novelai.net/ai/generate-image"
+
+
+class NovelAIError(Exception):
+    """A generation request that NovelAI answered with something other than 200."""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(f"Failed to generate image. Status code: {status}: {message}")
+        self.status = status
+        self.retry_after = retry_after  # seconds, from a Retry-After header
+
+
+class AsyncNovelAIClient:
+    """
+    asyncio client for /ai/generate-image.
+
+    All requests share one aiohttp session, so connections are kept alive and
+    reused instead of opening one per image. A semaphore bounds how many
+    requests are in flight; callers beyond that wait their turn without
+    holding a thread. Response bodies are read in chunks as they arrive.
+    Cancelling the task awaiting generate() aborts the request and releases its
+    slot. The session is created on first use, inside the running loop.
+    """
+
+    def __init__(self, url=GENERATE_URL, max_concurrent=8, timeout=300, chunk_size=64 * 1024):
+        self.url = url
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.session = None
+        self.semaphore = None
+
+    def _ensure_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrent, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        return self.session
+
+    async def generate(self, body, api_token):
+        """POST a request body built by PayloadTemplate.build and return the zip NovelAI sends back."""
+        session = self._ensure_session()
+        headers = {
+            "Authorization": f"Bearer {api_token}",
+            "Content-Type": "application/json",
+        }
+        async with self.semaphore:
+            async with session.post(self.url, data=body, headers=headers) as response:
+                if response.status != 200:
+                    text = await response.text(errors='replace')
+                    logging.error(f"Failed to generate image. Status code: {response.status}")
+                    logging.error(f"Response Body: {text}")
+                    try:
+                        retry_after = float(response.headers.get("Retry-After", ""))
+                    except ValueError:
+                        retry_after = None
+                    raise NovelAIError(response.status, text[:200], retry_after)
+                data = bytearray()
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    data += chunk
+        return bytes(data)
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        self._ensure_session()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
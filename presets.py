@@ -0,0 +1,247 @@
+# presets.py
+import json
+import math
+import random
+import logging
+
+MAX_SEED = 4294967295
+DEFAULT_MODEL = "nai-diffusion-3"
+
+DEFAULT_PARAMETERS = {
+    "params_version": 3,
+    "width": 832,
+    "height": 1216,
+    "scale": 7,
+    "sampler": "k_dpmpp_2s_ancestral",
+    "steps": 28,
+    "n_samples": 1,
+    "ucPreset": 3,
+    "qualityToggle": False,
+    "sm": False,
+    "sm_dyn": False,
+    "dynamic_thresholding": False,
+    "controlnet_strength": 1,
+    "legacy": False,
+    "add_original_image": True,
+    "cfg_rescale": 0,
+    "noise_schedule": "karras",
+    "legacy_v3_extend": False,
+    "skip_cfg_above_sigma": None,
+    "negative_prompt": "worst quality, low quality, bad image, displeasing, [abstract], bad anatomy, very displeasing, extra, unfocused, jpeg artifacts, unfinished, chromatic aberration,",
+    "reference_image_multiple": [],
+    "reference_information_extracted_multiple": [],
+    "reference_strength_multiple": []
+}
+
+SAMPLERS = {
+    "k_euler", "k_euler_ancestral", "k_dpmpp_2s_ancestral", "k_dpmpp_2m", "k_dpmpp_2m_sde",
+    "k_dpmpp_sde", "ddim_v3"
+}
+NOISE_SCHEDULES = {"native", "karras", "exponential", "polyexponential"}
+
+
+def _int_range(low, high, multiple=1):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, int):
+            return "must be an integer"
+        if not low <= value <= high:
+            return f"must be between {low} and {high}"
+        if value % multiple:
+            return f"must be a multiple of {multiple}"
+        return None
+    return check
+
+
+def _number_range(low, high):
+    def check(value):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return "must be a number"
+        if not low <= value <= high:
+            return f"must be between {low} and {high}"
+        return None
+    return check
+
+
+def _one_of(choices):
+    def check(value):
+        return None if value in choices else f"must be one of {', '.join(sorted(choices))}"
+    return check
+
+
+def _of_type(*types, nullable=False):
+    def check(value):
+        if value is None and nullable:
+            return None
+        if not isinstance(value, types) or (bool not in types and isinstance(value, bool)):
+            return f"must be of type {'/'.join(t.__name__ for t in types)}"
+        return None
+    return check
+
+
+PARAMETER_CHECKS = {
+    "params_version": _int_range(1, 3),
+    "width": _int_range(64, 2048, 64),
+    "height": _int_range(64, 2048, 64),
+    "scale": _number_range(0, 10),
+    "sampler": _one_of(SAMPLERS),
+    "steps": _int_range(1, 50),
+    "n_samples": _int_range(1, 8),
+    "ucPreset": _int_range(0, 3),
+    "qualityToggle": _of_type(bool),
+    "sm": _of_type(bool),
+    "sm_dyn": _of_type(bool),
+    "dynamic_thresholding": _of_type(bool),
+    "controlnet_strength": _number_range(0, 10),
+    "legacy": _of_type(bool),
+    "add_original_image": _of_type(bool),
+    "cfg_rescale": _number_range(0, 1),
+    "noise_schedule": _one_of(NOISE_SCHEDULES),
+    "legacy_v3_extend": _of_type(bool),
+    "skip_cfg_above_sigma": _of_type(int, float, nullable=True),
+    "seed": _int_range(0, MAX_SEED),
+    "negative_prompt": _of_type(str),
+    "reference_image_multiple": _of_type(list),
+    "reference_information_extracted_multiple": _of_type(list),
+    "reference_strength_multiple": _of_type(list),
+}
+
+
+def estimate_anlas(parameters, opus=False):
+    """
+    Estimate the Anlas cost of one request, using the pricing formula of the
+    NovelAI web client for V3 models. Opus subscribers generate single images
+    of up to 1024x1024 pixels at up to 28 steps for free.
+    """
+    pixels = parameters["width"] * parameters["height"]
+    steps = parameters["steps"]
+    n_samples = parameters.get("n_samples", 1)
+    if opus and pixels <= 1024 * 1024 and steps <= 28 and n_samples == 1:
+        return 0
+    per_sample = math.ceil(2.951823174884865e-6 * pixels + 5.753298233447344e-7 * pixels * steps)
+    if parameters.get("sm_dyn"):
+        per_sample = math.ceil(per_sample * 1.4)
+    elif parameters.get("sm"):
+        per_sample = math.ceil(per_sample * 1.2)
+    return max(per_sample, 2) * n_samples
+
+
+class PresetError(ValueError):
+    pass
+
+
+def validate_parameters(parameters, name="preset"):
+    for key, value in parameters.items():
+        check = PARAMETER_CHECKS.get(key)
+        if check is None:
+            logging.warning(f"{name}: unknown parameter '{key}' will be sent as-is")
+            continue
+        problem = check(value)
+        if problem:
+            raise PresetError(f"{name}: '{key}' {problem} (got {value!r})")
+    return parameters
+
+
+_INPUT_MARK = "\x00input\x00"
+_SEED_MARK = "\x00seed\x00"
+
+
+class PayloadTemplate:
+    """
+    A validated preset serialized once into the JSON request body, with only the
+    prompt and seed left to fill in per request.
+    """
+
+    def __init__(self, name, parameters, model=DEFAULT_MODEL):
+        self.name = name
+        self.model = model
+        self.parameters = validate_parameters(dict(parameters), name)
+        self.fixed_seed = self.parameters.get("seed")
+
+        payload = {
+            "input": _INPUT_MARK,
+            "model": model,
+            "action": "generate",
+            "parameters": {**self.parameters, "seed": _SEED_MARK},
+        }
+        text = json.dumps(payload)
+        head, rest = text.split(json.dumps(_INPUT_MARK), 1)
+        middle, tail = rest.split(json.dumps(_SEED_MARK), 1)
+        self._head = head.encode('utf-8')
+        self._middle = middle.encode('utf-8')
+        self._tail = tail.encode('utf-8')
+
+    def next_seed(self):
+        return self.fixed_seed if self.fixed_seed is not None else random.randint(0, MAX_SEED)
+
+    def build(self, prompt, seed=None):
+        """Return the request body for prompt as bytes, with a random seed unless one is given."""
+        if seed is None:
+            seed = self.next_seed()
+        return b"".join((
+            self._head, json.dumps(prompt).encode('utf-8'),
+            self._middle, str(int(seed)).encode('utf-8'),
+            self._tail,
+        ))
+
+    def build_payload(self, prompt, seed=None):
+        """Return the request body as a dict, for logging and inspection."""
+        return json.loads(self.build(prompt, seed))
+
+
+class PresetLibrary:
+    """
+    Named generation presets loaded from presets.json. Every preset inherits
+    from "default" and is validated when loaded; templates for presets with
+    per-job overrides are cached so repeated sweeps reuse them.
+    """
+
+    def __init__(self, presets=None, model=DEFAULT_MODEL):
+        self.model = model
+        self.presets = {}
+        self.templates = {}
+        presets = dict(presets or {})
+        # Add "default" first so the other presets inherit from it
+        self.add("default", presets.pop("default", {}))
+        if "default" not in self.presets:
+            self.add("default", {})
+        for name, parameters in presets.items():
+            self.add(name, parameters)
+
+    def add(self, name, parameters):
+        base = DEFAULT_PARAMETERS if name == "default" else self.presets["default"]
+        try:
+            template = PayloadTemplate(name, {**base, **parameters}, self.model)
+        except PresetError as e:
+            logging.error(f"Skipping invalid preset: {e}")
+            return
+        self.presets[name] = template.parameters
+        self.templates = {key: value for key, value in self.templates.items() if key[0] != name}
+        self.templates[(name, None)] = template
+
+    @classmethod
+    def load(cls, file_path="presets.json"):
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            logging.debug(f"Loaded presets from {file_path}")
+        except FileNotFoundError:
+            logging.debug(f"{file_path} not found, using built-in default preset.")
+            return cls()
+        except Exception as e:
+            logging.error(f"Failed to load presets from {file_path}: {e}")
+            return cls()
+        return cls(data.get("presets", {}), data.get("model", DEFAULT_MODEL))
+
+    def names(self):
+        return list(self.presets)
+
+    def get(self, name="default", overrides=None):
+        """Return the PayloadTemplate for a preset, with optional parameter overrides."""
+        if name not in self.presets:
+            raise PresetError(f"Unknown preset '{name}'")
+        key = (name, json.dumps(overrides, sort_keys=True) if overrides else None)
+        template = self.templates.get(key)
+        if template is None:
+            template = PayloadTemplate(name, {**self.presets[name], **overrides}, self.model)
+            self.templates[key] = template
+        return template
@@ -0,0 +1,317 @@
+# profiling.py
+import os
+import sys
+import json
+import time
+import pstats
+import inspect
+import logging
+import argparse
+import cProfile
+import functools
+import threading
+import contextlib
+import statistics
+import tracemalloc
+
+_profiler = None
+
+
+def _short_path(path):
+    """Paths inside the working directory relative to it, anything else as its last two parts."""
+    if path.startswith('<'):
+        return path
+    relative = os.path.relpath(path)
+    if not relative.startswith('..'):
+        return relative
+    return os.path.join(*os.path.normpath(path).split(os.sep)[-2:])
+
+
+class Profiler:
+    """
+    Writes one report per profiled action to a session folder.
+
+    The outermost action on a thread runs under cProfile, so the app runs at
+    close to normal speed in between. tracemalloc traces one frame per
+    allocation for the whole session (stopping it while Qt's pool threads
+    allocate can crash the interpreter) and its traces are cleared when an
+    action starts, so the report shows what the action allocated (on any
+    thread). Actions started inside another action are recorded as timed
+    phases of it. cProfile only sees the thread it was started on, and only
+    one action can be profiled at a time, so work on other threads (network
+    requests, background builds) is reported with record_timing instead.
+    """
+
+    def __init__(self, folder="profiles", top=30):
+        self.folder = os.path.join(folder, time.strftime('%Y%m%d-%H%M%S'))
+        os.makedirs(self.folder, exist_ok=True)
+        self.top = top
+        tracemalloc.start(1)
+        self.lock = threading.Lock()
+        self.count = 0
+        self.owner = None  # thread running the profiled action
+        self.phases = None
+
+    def _report_path(self, name, extension):
+        with self.lock:
+            self.count += 1
+            count = self.count
+        safe_name = "".join(c if c.isalnum() or c in '-_' else '_' for c in name)
+        return os.path.join(self.folder, f"{count:04d}-{safe_name}{extension}")
+
+    @contextlib.contextmanager
+    def action(self, name):
+        with self.lock:
+            owner = self.owner
+            if owner is None:
+                self.owner = threading.get_ident()
+        if owner is not None:
+            start = time.perf_counter()
+            try:
+                yield
+            finally:
+                wall = time.perf_counter() - start
+                if owner == threading.get_ident():
+                    self.phases.append({'name': name, 'wall': wall})
+                else:
+                    self.record_timing(name, wall)
+            return
+
+        self.phases = []
+        profile = cProfile.Profile()
+        tracemalloc.clear_traces()
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            wall = time.perf_counter() - wall_start
+            cpu = time.thread_time() - cpu_start
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            phases, self.phases = self.phases, None
+            try:
+                self.write_report(name, wall, cpu, current, peak, phases, profile, snapshot)
+            except Exception as e:
+                logging.error(f"Failed to write profile report for {name}: {e}")
+            with self.lock:
+                self.owner = None
+
+    def write_report(self, name, wall, cpu, current, peak, phases, profile, snapshot):
+        stats = pstats.Stats(profile)
+        functions = []
+        for (file_name, line, function), (_, calls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                'function': f"{_short_path(file_name)}:{line}({function})",
+                'calls': calls,
+                'tottime': tottime,
+                'cumtime': cumtime,
+            })
+        functions.sort(key=lambda entry: entry['cumtime'], reverse=True)
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        ))
+        allocations = [
+            {
+                'location': f"{_short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                'size': stat.size,
+                'count': stat.count,
+            }
+            for stat in snapshot.statistics('lineno')[:self.top]
+        ]
+
+        report = {
+            'action': name,
+            'started': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'wall': wall,
+            'cpu': cpu,
+            'memory_retained': current,
+            'peak_memory': peak,
+            'phases': phases,
+            'functions': functions[:self.top],
+            'allocations': allocations,
+        }
+        path = self._report_path(name, ".json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+        # The full profile, for pstats or snakeviz
+        profile.dump_stats(os.path.splitext(path)[0] + ".prof")
+        logging.debug(f"Profiled {name}: {wall * 1000:.1f} ms, peak {peak / 2 ** 20:.1f} MB -> {path}")
+
+    def record_timing(self, name, seconds, **details):
+        """Write a wall-time-only report, e.g. for work done on another thread."""
+        report = {'action': name, 'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'wall': seconds}
+        report.update(details)
+        path = self._report_path(name, ".json")
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=1)
+        except Exception as e:
+            logging.error(f"Failed to write timing report for {name}: {e}")
+
+
+def enable(folder="profiles", top=30):
+    """Turn profiling on for the rest of the process and return the Profiler."""
+    global _profiler
+    _profiler = Profiler(folder, top)
+    logging.debug(f"Profiling enabled, writing reports to {_profiler.folder}")
+    return _profiler
+
+
+def is_enabled():
+    return _profiler is not None
+
+
+def action(name):
+    """Context manager that profiles the enclosed code as one action when profiling is enabled."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.action(name)
+
+
+def profiled(name):
+    """Decorator that profiles every call of a function (typically a Qt slot) as the action name."""
+    def decorate(function):
+        parameters = inspect.signature(function).parameters.values()
+        if any(parameter.kind == parameter.VAR_POSITIONAL for parameter in parameters):
+            max_args = None
+        else:
+            max_args = sum(parameter.kind in (parameter.POSITIONAL_ONLY, parameter.POSITIONAL_OR_KEYWORD)
+                           for parameter in parameters)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            # Qt passes every signal argument to a Python callable, e.g. clicked(checked) to
+            # a slot that takes none; drop the ones the function doesn't accept like PyQt would
+            if max_args is not None:
+                args = args[:max_args]
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.action(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def record_timing(name, seconds, **details):
+    if _profiler is not None:
+        _profiler.record_timing(name, seconds, **details)
+
+
+def load_reports(path):
+    """Load a report file, or every report in a session folder, grouped by action."""
+    paths = [path] if os.path.isfile(path) else sorted(
+        os.path.join(path, name) for name in os.listdir(path) if name.endswith(".json")
+    )
+    reports = {}
+    for report_path in paths:
+        try:
+            with open(report_path, 'r', encoding='utf-8') as f:
+                report = json.load(f)
+        except Exception as e:
+            logging.error(f"Failed to load profile report {report_path}: {e}")
+            continue
+        reports.setdefault(report['action'], []).append(report)
+    return reports
+
+
+def aggregate(reports):
+    """
+    Combine the reports of one action: the median of wall time, CPU time and
+    peak memory, and the mean cumulative time of each function per call of
+    the action.
+    """
+    summary = {'runs': len(reports)}
+    for key in ('wall', 'cpu', 'peak_memory'):
+        values = [report[key] for report in reports if key in report]
+        summary[key] = statistics.median(values) if values else None
+    functions = {}
+    for report in reports:
+        for entry in report.get('functions', ()):
+            functions[entry['function']] = functions.get(entry['function'], 0) + entry['cumtime']
+    summary['functions'] = {function: total / len(reports) for function, total in functions.items()}
+    return summary
+
+
+def _change(old, new):
+    if old is None or new is None:
+        return ""
+    if not old:
+        return "   new" if new else ""
+    return f"{(new - old) / old * 100:+6.1f}%"
+
+
+def diff_reports(old_path, new_path, top=10, threshold=None):
+    """
+    Print how each action changed between two reports or session folders.
+    Returns the actions whose wall time or peak memory grew by more than
+    threshold percent.
+    """
+    old_reports = load_reports(old_path)
+    new_reports = load_reports(new_path)
+    regressions = []
+    for name in sorted(set(old_reports) | set(new_reports)):
+        if name not in old_reports or name not in new_reports:
+            print(f"{name}: only in {'new' if name in new_reports else 'old'}")
+            continue
+        old = aggregate(old_reports[name])
+        new = aggregate(new_reports[name])
+        print(f"{name} ({old['runs']} -> {new['runs']} runs)")
+        print(f"  wall  {old['wall'] * 1000:10.1f} ms -> {new['wall'] * 1000:10.1f} ms {_change(old['wall'], new['wall'])}")
+        if old['cpu'] is not None and new['cpu'] is not None:
+            print(f"  cpu   {old['cpu'] * 1000:10.1f} ms -> {new['cpu'] * 1000:10.1f} ms {_change(old['cpu'], new['cpu'])}")
+        if old['peak_memory'] is not None and new['peak_memory'] is not None:
+            print(f"  peak  {old['peak_memory'] / 2 ** 20:10.1f} MB -> {new['peak_memory'] / 2 ** 20:10.1f} MB "
+                  f"{_change(old['peak_memory'], new['peak_memory'])}")
+
+        deltas = [
+            (new['functions'].get(function, 0) - old['functions'].get(function, 0), function)
+            for function in set(old['functions']) | set(new['functions'])
+        ]
+        deltas.sort(key=lambda delta: abs(delta[0]), reverse=True)
+        for delta, function in deltas[:top]:
+            if delta:
+                print(f"    {delta * 1000:+10.1f} ms  {function}")
+
+        if threshold is not None:
+            for key in ('wall', 'peak_memory'):
+                if old[key] and new[key] is not None and (new[key] - old[key]) / old[key] * 100 > threshold:
+                    regressions.append((name, key))
+    return regressions
+
+
+def print_summary(path):
+    for name, reports in sorted(load_reports(path).items()):
+        summary = aggregate(reports)
+        line = f"{name:30} {summary['runs']:4d} runs  median {summary['wall'] * 1000:10.1f} ms"
+        if summary['peak_memory'] is not None:
+            line += f"  peak {summary['peak_memory'] / 2 ** 20:8.1f} MB"
+        print(line)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Summarize and compare reports written by main.py --profile.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    summary_parser = subparsers.add_parser('summary', help="Show the actions in a report or session folder")
+    summary_parser.add_argument('path')
+    diff_parser = subparsers.add_parser('diff', help="Compare two reports or session folders")
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+    diff_parser.add_argument('--top', type=int, default=10, help="Function changes to show per action")
+    diff_parser.add_argument('--threshold', type=float,
+                             help="Exit with status 1 if wall time or peak memory grew by more than this percent")
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        print_summary(args.path)
+    else:
+        regressions = diff_reports(args.old, args.new, args.top, args.threshold)
+        if regressions:
+            print("Regressions: " + ", ".join(f"{name} ({key})" for name, key in regressions))
+            sys.exit(1)
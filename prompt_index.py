@@ -0,0 +1,55 @@
+# prompt_index.py
+import logging
+from array import array
+
+from records import split_prompt
+
+
+class PromptIndex:
+    """
+    Inverted index from lowercased tag to the ids of the prompts that contain it.
+
+    A keyword matches a prompt when it is a substring of one of its tags, which
+    is the same as the old substring scan over whole prompts (keywords cannot
+    contain commas, so they never span two tags). Lookups scan the tag
+    vocabulary, which is far smaller than the corpus, and then intersect
+    posting lists. Prompts are indexed in id order and can be added at any time.
+    """
+
+    def __init__(self):
+        self.postings = {}  # tag -> array of prompt ids, ascending
+        self.indexed = 0
+
+    def add(self, prompt_id, prompt):
+        for tag in {tag.lower() for tag in split_prompt(prompt)}:
+            ids = self.postings.get(tag)
+            if ids is None:
+                ids = self.postings[tag] = array('I')
+            ids.append(prompt_id)
+        self.indexed = prompt_id + 1
+
+    def catch_up(self, prompts):
+        """Index the prompts added to the store since the last call."""
+        start = self.indexed
+        for prompt_id in range(start, len(prompts)):
+            self.add(prompt_id, prompts[prompt_id])
+        if len(prompts) > start:
+            logging.debug(f"Indexed prompts {start}..{len(prompts) - 1} ({len(self.postings)} tags)")
+
+    def search(self, keywords):
+        """Return the sorted ids of prompts matching every keyword."""
+        matches = None
+        # Most selective keyword first, so later intersections stay small
+        for ids in sorted((self._matching(keyword) for keyword in keywords), key=len):
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        return sorted(matches) if matches is not None else list(range(self.indexed))
+
+    def _matching(self, keyword):
+        keyword = keyword.lower()
+        ids = set()
+        for tag, tag_ids in self.postings.items():
+            if keyword in tag:
+                ids.update(tag_ids)
+        return ids
@@ -0,0 +1,310 @@
+# prompt_vectors.py
+import os
+import sys
+import json
+import math
+import zlib
+import shutil
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+
+from records import split_prompt, PromptStore
+
+
+class PromptVectorizer:
+    """
+    Turns prompts into dense unit vectors: TF-IDF over their tags, hashed into
+    a fixed number of buckets (so no vocabulary has to be kept), then reduced
+    to dim dimensions by a random projection generated from seed. Cosine
+    similarity between the vectors approximates that of the TF-IDF vectors.
+    """
+
+    def __init__(self, idf, dim=128, seed=0, documents=0):
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.documents = documents
+        self.buckets = len(self.idf)
+        self.dim = dim
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((self.buckets, dim), dtype=np.float32) / math.sqrt(dim)
+        self.tag_features = {}  # tag -> (bucket, sign), hashing each distinct tag once
+
+    def _feature(self, tag):
+        feature = self.tag_features.get(tag)
+        if feature is None:
+            # crc32 rather than hash(), which changes between runs
+            h = zlib.crc32(tag.lower().encode('utf-8'))
+            feature = self.tag_features[tag] = (h % self.buckets, 1.0 if h & 0x80000000 else -1.0)
+        return feature
+
+    @classmethod
+    def fit(cls, prompts, buckets=1 << 16, dim=128, seed=0):
+        """Count document frequencies per bucket over prompts and return a vectorizer using them."""
+        vectorizer = cls(np.zeros(buckets, dtype=np.float32), dim, seed)
+        df = np.zeros(buckets, dtype=np.int64)
+        documents = 0
+        for prompt in prompts:
+            documents += 1
+            for bucket in {vectorizer._feature(tag)[0] for tag in split_prompt(prompt)}:
+                df[bucket] += 1
+        vectorizer.idf = (np.log((1 + documents) / (1 + df)) + 1).astype(np.float32)
+        vectorizer.documents = documents
+        return vectorizer
+
+    def known(self, tag):
+        """Whether tag's bucket had a document frequency when fitting (its idf is below that of df 0)."""
+        return bool(self.idf[self._feature(tag)[0]] < math.log(1 + self.documents) + 1 - 1e-3)
+
+    def transform(self, prompts):
+        """Return an (n, dim) float32 array of unit vectors; prompts without tags get zeros."""
+        rows, buckets, signs = [], [], []
+        n = 0
+        for row, prompt in enumerate(prompts):
+            n += 1
+            for tag in split_prompt(prompt):
+                bucket, sign = self._feature(tag)
+                rows.append(row)
+                buckets.append(bucket)
+                signs.append(sign)
+        vectors = np.zeros((n, self.dim), dtype=np.float32)
+        if not rows:
+            return vectors
+        rows = np.asarray(rows)
+        buckets = np.asarray(buckets)
+        weights = (self.idf[buckets] * np.asarray(signs, dtype=np.float32))[:, None]
+        # Rows are in order, so each prompt's contributions are one contiguous run to sum
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        vectors[rows[starts]] = np.add.reduceat(weights * self.projection[buckets], starts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        np.divide(vectors, norms, out=vectors, where=norms > 0)
+        return vectors
+
+
+def _batches(n, batch_size):
+    for start in range(0, n, batch_size):
+        yield start, min(start + batch_size, n)
+
+
+def _spherical_kmeans(sample, n_lists, iterations, rng):
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        counts = np.bincount(labels, minlength=n_lists)
+        empty = counts == 0
+        # Restart empty lists from random points so every list gets used
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.where(norms > 0, norms, 1)
+    return centroids.astype(np.float32)
+
+
+def fingerprint(prompts, count, samples=1024):
+    """
+    Hash of the first count prompts, taken from up to samples evenly spaced
+    ones (always including the first and last), so an index can tell whether
+    it was built from the prompts it is loaded with without reading them all.
+    """
+    digest = hashlib.sha1(str(count).encode('utf-8'))
+    positions = sorted({i * (count - 1) // max(samples - 1, 1) for i in range(min(samples, count))})
+    for position in positions:
+        digest.update(prompts[position].encode('utf-8'))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class PromptVectorIndex:
+    """
+    Approximate nearest neighbour search over prompt vectors with an inverted
+    file (IVF) index.
+
+    The prompts are clustered around n_lists centroids, and vectors.npy holds
+    every prompt's vector (float16, memory-mapped) with the rows of each
+    cluster stored together. A query is compared with the centroids and only
+    the n_probe closest clusters are scanned, each as one contiguous slice of
+    the file. ids.npy maps rows back to prompt ids (positions in the
+    PromptStore). Prompts added to the store after the build are vectorized
+    on demand and scanned in full, since there are few of them.
+    """
+
+    def __init__(self, folder, meta, vectorizer, centroids, offsets, ids, vectors):
+        self.folder = folder
+        self.count = meta['count']
+        self.fingerprint = meta.get('fingerprint')
+        self.vectorizer = vectorizer
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.tail = np.zeros((0, vectorizer.dim), dtype=np.float32)
+
+    @classmethod
+    def build(cls, prompts, folder="prompt_vectors", n_lists=None, dim=128, buckets=1 << 16,
+              sample_size=65536, iterations=10, batch_size=8192, seed=0):
+        """Vectorize prompts (a PromptStore or list) and write the index to folder."""
+        n = len(prompts)
+        if n == 0:
+            raise ValueError("No prompts to index")
+        vectorizer = PromptVectorizer.fit(prompts, buckets, dim, seed)
+        logging.debug(f"Counted tag frequencies over {n} prompts")
+
+        tmp_folder = folder + ".tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        unordered_path = os.path.join(tmp_folder, "unordered.npy")
+        unordered = np.lib.format.open_memmap(unordered_path, mode='w+', dtype=np.float16, shape=(n, dim))
+        for start, end in _batches(n, batch_size):
+            unordered[start:end] = vectorizer.transform(prompts[start:end])
+        logging.debug(f"Vectorized {n} prompts")
+
+        rng = np.random.default_rng(seed)
+        n_lists = n_lists or max(1, min(4096, int(4 * math.sqrt(n))))
+        sample = unordered[np.sort(rng.choice(n, min(n, sample_size), replace=False))].astype(np.float32)
+        n_lists = min(n_lists, len(sample))
+        centroids = _spherical_kmeans(sample, n_lists, iterations, rng)
+
+        labels = np.empty(n, dtype=np.int32)
+        for start, end in _batches(n, batch_size):
+            labels[start:end] = np.argmax(unordered[start:end].astype(np.float32) @ centroids.T, axis=1)
+        ids = np.argsort(labels, kind='stable').astype(np.int64)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(labels, minlength=n_lists)))).astype(np.int64)
+
+        vectors = np.lib.format.open_memmap(os.path.join(tmp_folder, "vectors.npy"), mode='w+',
+                                            dtype=np.float16, shape=(n, dim))
+        for start, end in _batches(n, batch_size):
+            batch = ids[start:end]
+            order = np.argsort(batch)
+            # Read rows in file order, write them in list order
+            vectors[start + order] = unordered[batch[order]]
+        vectors.flush()
+        del vectors, unordered
+        os.remove(unordered_path)
+
+        np.save(os.path.join(tmp_folder, "idf.npy"), vectorizer.idf)
+        np.save(os.path.join(tmp_folder, "centroids.npy"), centroids)
+        np.save(os.path.join(tmp_folder, "offsets.npy"), offsets)
+        np.save(os.path.join(tmp_folder, "ids.npy"), ids)
+        meta = {'count': n, 'dim': dim, 'buckets': buckets, 'seed': seed, 'n_lists': n_lists,
+                'documents': vectorizer.documents, 'fingerprint': fingerprint(prompts, n)}
+        with open(os.path.join(tmp_folder, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        # Swap the finished index in; a reader never sees a half-written folder
+        old_folder = folder + ".old"
+        shutil.rmtree(old_folder, ignore_errors=True)
+        if os.path.exists(folder):
+            os.replace(folder, old_folder)
+        os.replace(tmp_folder, folder)
+        shutil.rmtree(old_folder, ignore_errors=True)
+        logging.debug(f"Saved prompt vector index ({n} prompts, {n_lists} lists) to {folder}")
+        return cls.load(folder)
+
+    @classmethod
+    def load(cls, folder="prompt_vectors"):
+        with open(os.path.join(folder, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        vectorizer = PromptVectorizer(np.load(os.path.join(folder, "idf.npy")), meta['dim'], meta['seed'],
+                                      meta.get('documents', 0))
+        index = cls(
+            folder, meta, vectorizer,
+            np.load(os.path.join(folder, "centroids.npy")),
+            np.load(os.path.join(folder, "offsets.npy")),
+            np.load(os.path.join(folder, "ids.npy"), mmap_mode='r'),
+            np.load(os.path.join(folder, "vectors.npy"), mmap_mode='r'),
+        )
+        logging.debug(f"Loaded prompt vector index for {index.count} prompts from {folder}")
+        return index
+
+    def catch_up(self, prompts):
+        """Vectorize prompts added to the store since the index was built."""
+        start = self.count + len(self.tail)
+        if len(prompts) > start:
+            self.tail = np.vstack([self.tail, self.vectorizer.transform(prompts[start:len(prompts)])])
+
+    def search(self, prompt, k=20, n_probe=32, min_score=0.3):
+        """
+        Return up to k (prompt id, cosine similarity) pairs most like prompt,
+        best first, leaving out those below min_score. Tags that never occurred
+        in the indexed prompts are ignored, since their projections are only
+        noise; a prompt with no other tags has no similar prompts.
+        """
+        tags = [tag for tag in split_prompt(prompt) if self.vectorizer.known(tag)]
+        if not tags:
+            return []
+        query = self.vectorizer.transform([", ".join(tags)])[0]
+        if not query.any():
+            return []
+        n_probe = min(n_probe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+
+        candidate_ids = []
+        candidate_scores = []
+        for list_id in lists:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            if start < end:
+                candidate_ids.append(self.ids[start:end])
+                candidate_scores.append(self.vectors[start:end].astype(np.float32) @ query)
+        if len(self.tail):
+            candidate_ids.append(np.arange(self.count, self.count + len(self.tail)))
+            candidate_scores.append(self.tail @ query)
+        if not candidate_ids:
+            return []
+        ids = np.concatenate(candidate_ids)
+        scores = np.concatenate(candidate_scores)
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(ids[i]), float(scores[i])) for i in best if scores[i] >= min_score]
+
+
+def load_or_none(folder, prompts=None):
+    """Load the index in folder, or None if it is missing, unreadable or built from a different prompt list."""
+    if not os.path.exists(os.path.join(folder, "meta.json")):
+        return None
+    try:
+        index = PromptVectorIndex.load(folder)
+    except Exception as e:
+        logging.error(f"Failed to load prompt vector index from {folder}: {e}")
+        return None
+    if prompts is not None and index.count > len(prompts):
+        logging.debug(f"Prompt vector index covers {index.count} prompts but there are {len(prompts)}; rebuilding")
+        return None
+    if not index.vectorizer.documents:
+        logging.debug(f"Prompt vector index in {folder} predates tag frequency checks; rebuilding")
+        return None
+    if prompts is not None and index.fingerprint != fingerprint(prompts, index.count):
+        # Same or fewer prompts than the store, but not the same ones (e.g. a replaced safebooru_clean.json)
+        logging.debug(f"Prompt vector index in {folder} was built from different prompts; rebuilding")
+        return None
+    return index
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build or query the prompt similarity index.")
+    parser.add_argument('--folder', default='prompt_vectors')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build', help="Build the index from a JSON list of prompts")
+    build_parser.add_argument('prompts', nargs='?', default='safebooru_clean.json')
+    build_parser.add_argument('--lists', type=int, help="Number of IVF lists (default 4 * sqrt(prompts))")
+    similar_parser = subparsers.add_parser('similar', help="Show the prompts most like a prompt")
+    similar_parser.add_argument('prompt')
+    similar_parser.add_argument('--prompts', default='safebooru_clean.json')
+    similar_parser.add_argument('-k', type=int, default=10)
+    similar_parser.add_argument('--probe', type=int, default=32)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        PromptVectorIndex.build(PromptStore.from_json_file(args.prompts), args.folder, n_lists=args.lists)
+    else:
+        index = load_or_none(args.folder)
+        if index is None:
+            print(f"No index found at {args.folder}. Run the build command first.")
+            sys.exit(1)
+        prompts = PromptStore.from_json_file(args.prompts)
+        for prompt_id, score in index.search(args.prompt, args.k, args.probe):
+            print(f"{score:6.3f}  {prompts[prompt_id] if prompt_id < len(prompts) else prompt_id}")
@@ -0,0 +1,162 @@
+# records.py
+import sys
+import json
+import logging
+from array import array
+from collections.abc import Sequence
+
+
+def split_prompt(prompt):
+    """Split a comma separated prompt into its distinct tags, in order."""
+    seen = set()
+    tags = []
+    for tag in prompt.split(','):
+        tag = tag.strip()
+        if tag and tag not in seen:
+            seen.add(tag)
+            tags.append(tag)
+    return tags
+
+
+class Tag:
+    """
+    Compact record for one entry of naidv3_tags_pretty.json.
+
+    Only the fields the app uses are kept, category and d_group strings are
+    interned so the thousands of tags sharing them point at one object, and
+    power is computed once at load time.
+    """
+    __slots__ = ('tag_name', 'd_category', 'd_group', 'd_count', 'n_count', 'power')
+
+    def __init__(self, tag_name, d_category, d_group, d_count, n_count):
+        self.tag_name = tag_name
+        self.d_category = sys.intern(d_category)
+        self.d_group = tuple(sys.intern(group) for group in d_group)
+        self.d_count = d_count
+        self.n_count = n_count
+        self.power = max(d_count, n_count)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data['tag_name'],
+            data.get('d_category', 'none'),
+            data.get('d_group', ()),
+            data.get('d_count', 0),
+            data.get('n_count', 0),
+        )
+
+    def __repr__(self):
+        return f"Tag({self.tag_name!r}, {self.d_category!r}, power={self.power})"
+
+
+def _tag_object_hook(data):
+    return Tag.from_dict(data) if 'tag_name' in data else data
+
+
+def load_tags_file(file_path):
+    """
+    Load the tag list from naidv3_tags_pretty.json, building Tag records while
+    parsing so the per-tag dicts are never all alive at once.
+    """
+    try:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            data = json.load(file, object_hook=_tag_object_hook)
+        tags = data.get('tags', []) if isinstance(data, dict) else []
+        logging.debug(f"Loaded {len(tags)} tags from {file_path}")
+        return tags
+    except Exception as e:
+        logging.error(f"Failed to load tags from {file_path}: {e}")
+        return []
+
+
+class PromptStore(Sequence):
+    """
+    Append-only list of prompts stored as one UTF-8 buffer plus an offset table.
+
+    Behaves like a list of str (indexing, len, iteration, random.sample), but
+    each prompt costs its encoded bytes plus 8 bytes of offset instead of a
+    full str object and a list slot.
+    """
+
+    def __init__(self, prompts=()):
+        self.buffer = bytearray()
+        self.offsets = array('Q', [0])
+        self.extend(prompts)
+
+    def append(self, prompt):
+        self.buffer += prompt.encode('utf-8')
+        self.offsets.append(len(self.buffer))
+
+    def extend(self, prompts):
+        for prompt in prompts:
+            self.append(prompt)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("prompt index out of range")
+        return self.buffer[self.offsets[index]:self.offsets[index + 1]].decode('utf-8')
+
+    def snapshot(self):
+        """
+        Return a read-only view of the prompts stored so far, safe to iterate in
+        another thread while this store keeps growing. Only the offset table is
+        copied; appends never move bytes that are already in the buffer.
+        """
+        view = PromptStore()
+        view.buffer = self.buffer
+        view.offsets = array('Q', self.offsets)
+        return view
+
+    def __iter__(self):
+        buffer = self.buffer
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield buffer[offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    @classmethod
+    def from_json_file(cls, file_path, chunk_size=1 << 20):
+        """
+        Stream a JSON list of strings into a store without materialising the
+        whole list. Returns an empty store if the file is missing or malformed.
+        """
+        store = cls()
+        decoder = json.JSONDecoder()
+        try:
+            with open(file_path, 'r', encoding='utf-8') as file:
+                text = file.read(chunk_size)
+                eof = False
+                # Skip to the opening bracket
+                pos = text.index('[') + 1
+                while True:
+                    # Skip whitespace and separators between elements
+                    while pos < len(text) and text[pos] in ' \t\r\n,':
+                        pos += 1
+                    if pos < len(text) and text[pos] == ']':
+                        break
+                    try:
+                        if pos >= len(text):
+                            raise ValueError("chunk exhausted")
+                        prompt, end = decoder.raw_decode(text, pos)
+                    except ValueError:
+                        if eof:
+                            raise
+                        more = file.read(chunk_size)
+                        eof = not more
+                        text = text[pos:] + more
+                        pos = 0
+                        continue
+                    if isinstance(prompt, str):
+                        store.append(prompt)
+                    pos = end
+            logging.debug(f"Loaded {len(store)} prompts from {file_path} ({len(store.buffer)} bytes)")
+        except Exception as e:
+            logging.error(f"Failed to load prompts from {file_path}: {e}")
+        return store
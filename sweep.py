@@ -0,0 +1,161 @@
+# sweep.py
+import os
+import json
+import time
+import uuid
+import random
+import logging
+import itertools
+
+from presets import MAX_SEED, estimate_anlas
+from generation_store import make_job
+
+# Parameters that can be swept, and how to parse their values
+SWEEP_AXES = {
+    "sampler": str,
+    "scale": float,
+    "steps": int,
+    "cfg_rescale": float,
+}
+
+
+def parse_values(text, cast=str):
+    """Parse a comma separated list of values, e.g. "5, 6.5, 7" -> [5.0, 6.5, 7.0]."""
+    values = []
+    for part in text.split(','):
+        part = part.strip()
+        if part:
+            value = cast(part)
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            if value not in values:
+                values.append(value)
+    return values
+
+
+def parse_seeds(text):
+    """
+    Parse seeds as a comma separated list, or "random:N" for N random seeds.
+    Only explicit seeds can be recognised as already generated. Raises
+    ValueError for seeds outside 0..MAX_SEED, which the API rejects.
+    """
+    text = text.strip()
+    if text.lower().startswith("random:"):
+        return [random.randint(0, MAX_SEED) for _ in range(int(text.split(':', 1)[1]))]
+    seeds = parse_values(text, int)
+    for seed in seeds:
+        if not 0 <= seed <= MAX_SEED:
+            raise ValueError(f"seed must be between 0 and {MAX_SEED} (got {seed})")
+    return seeds
+
+
+class SweepPlan:
+    """
+    A prompt x parameter grid expanded into jobs.
+
+    Rows are the combinations of the swept parameters and columns are seeds.
+    Cells that match an existing generation (same prompt, effective parameters
+    and seed) reuse it instead of becoming jobs.
+    """
+
+    def __init__(self, prompt, preset, seeds, axes, presets, store, opus=False):
+        self.id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:6]
+        self.prompt = prompt
+        self.preset = preset
+        self.seeds = seeds
+        self.axes = {name: values for name, values in axes.items() if values}
+        self.rows = [dict(zip(self.axes, combo)) for combo in itertools.product(*self.axes.values())]
+        self.cells = []
+        self.jobs = []
+        self.anlas = 0
+
+        for row, overrides in enumerate(self.rows):
+            parameters = presets.get(preset, overrides).parameters
+            for col, seed in enumerate(seeds):
+                job = make_job(presets, prompt, preset, overrides, seed, sweep_id=self.id, row=row, col=col)
+                cell = {'row': row, 'col': col, 'seed': seed, 'overrides': overrides, 'path': None}
+                existing = store.find(job['key'])
+                if existing:
+                    cell['path'] = existing['path']
+                else:
+                    cell['job_id'] = job['id']
+                    self.jobs.append(job)
+                    self.anlas += estimate_anlas(parameters, opus)
+                self.cells.append(cell)
+
+    @property
+    def reused(self):
+        return len(self.cells) - len(self.jobs)
+
+    def row_label(self, row):
+        # Only the parameters that actually vary are worth labelling
+        overrides = self.rows[row]
+        varied = [name for name in overrides if len(self.axes[name]) > 1]
+        return ", ".join(f"{name}={overrides[name]}" for name in varied) or self.preset
+
+    def set_result(self, job, image_path):
+        for cell in self.cells:
+            if cell.get('job_id') == job['id']:
+                cell['path'] = image_path
+
+    def is_complete(self, failed_ids):
+        return all(cell['path'] or cell.get('job_id') in failed_ids for cell in self.cells)
+
+    def contact_sheet_cells(self):
+        return [
+            (cell['row'], cell['col'], cell['path'], f"seed {cell['seed']}")
+            for cell in self.cells if cell['path']
+        ]
+
+    def save_record(self, folder="sweeps", contact_sheet=None):
+        os.makedirs(folder, exist_ok=True)
+        record = {
+            'id': self.id,
+            'prompt': self.prompt,
+            'preset': self.preset,
+            'axes': self.axes,
+            'seeds': self.seeds,
+            'rows': self.rows,
+            'contact_sheet': contact_sheet,
+            'cells': [{key: value for key, value in cell.items() if key != 'job_id'} for cell in self.cells],
+        }
+        path = os.path.join(folder, f"{self.id}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=4)
+        logging.debug(f"Saved sweep record to {path}")
+        return path
+
+
+def build_contact_sheet(cells, row_labels, n_cols, output_path, thumb_size=256):
+    """
+    Assemble a grid of thumbnails with row labels. cells is a list of
+    (row, col, image_path, caption). Runs in a worker process, so it only uses
+    picklable arguments and returns the output path.
+    """
+    from PIL import Image, ImageDraw
+
+    label_width = 220
+    caption_height = 18
+    cell_height = thumb_size + caption_height
+    n_rows = len(row_labels)
+    sheet = Image.new("RGB", (label_width + n_cols * thumb_size, max(n_rows, 1) * cell_height), (28, 28, 28))
+    draw = ImageDraw.Draw(sheet)
+
+    for row, label in enumerate(row_labels):
+        draw.text((8, row * cell_height + cell_height // 2), label, fill=(255, 255, 255))
+
+    for row, col, image_path, caption in cells:
+        x = label_width + col * thumb_size
+        y = row * cell_height
+        try:
+            with Image.open(image_path) as image:
+                image.thumbnail((thumb_size, thumb_size))
+                offset = ((thumb_size - image.width) // 2, (thumb_size - image.height) // 2)
+                sheet.paste(image.convert("RGB"), (x + offset[0], y + offset[1]))
+        except Exception as e:
+            draw.text((x + 8, y + thumb_size // 2), f"missing: {e}"[:40], fill=(255, 80, 80))
+        draw.text((x + 4, y + thumb_size + 2), caption, fill=(200, 200, 200))
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    sheet.save(output_path)
+    return output_path
@@ -0,0 +1,213 @@
+# tag_index.py
+import bisect
+import heapq
+import logging
+
+
+def bounded_levenshtein(a, b, max_distance):
+    """
+    Edit distance between a and b, or max_distance + 1 as soon as the distance
+    is known to exceed max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+    previous = list(range(len(a) + 1))
+    for i, cb in enumerate(b, 1):
+        current = [i]
+        row_min = i
+        for j, ca in enumerate(a, 1):
+            cost = previous[j - 1] + (ca != cb)
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current.append(cost)
+            if cost < row_min:
+                row_min = cost
+        if row_min > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+def _deletes(word, max_distance):
+    results = {word}
+    frontier = {word}
+    for _ in range(max_distance):
+        next_frontier = set()
+        for item in frontier:
+            if len(item) <= 1:
+                continue
+            for i in range(len(item)):
+                next_frontier.add(item[:i] + item[i + 1:])
+        results |= next_frontier
+        frontier = next_frontier
+    return results
+
+
+class TagIndex:
+    """
+    Prefix autocomplete and "did you mean" lookup over tag names.
+
+    Prefix lookups use a sorted array of lowercased names (bisect gives the
+    range of names sharing a prefix) with the top results for short prefixes
+    precomputed, since those ranges are the largest. Fuzzy lookups use a
+    SymSpell-style deletion index over the first prefix_length characters of
+    each name, verified with a bounded Levenshtein distance.
+    """
+
+    def __init__(self, tags, max_distance=2, prefix_length=7, top_k=10, precomputed_prefix=2):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.top_k = top_k
+        self.precomputed_prefix = precomputed_prefix
+
+        # One entry per distinct lowercased name, keeping the most powerful tag
+        self.best = {}
+        for tag in tags:
+            key = tag.tag_name.lower()
+            if key not in self.best or tag.power > self.best[key][1]:
+                self.best[key] = (tag.tag_name, tag.power)
+
+        self.keys = sorted(self.best)
+
+        self.prefix_top = {}
+        for length in range(1, precomputed_prefix + 1):
+            groups = {}
+            for key in self.keys:
+                if len(key) >= length:
+                    groups.setdefault(key[:length], []).append(key)
+            for prefix, keys in groups.items():
+                self.prefix_top[prefix] = heapq.nlargest(top_k, keys, key=self._power)
+
+        # The deletion index is the expensive part, so it is built in the background
+        # (build_deletes, then set_deletes) and suggest() returns nothing until then
+        self.deletes = None
+
+        logging.debug(f"Built tag index over {len(self.keys)} tag names")
+
+    def _power(self, key):
+        return self.best[key][1]
+
+    def build_deletes(self, keys):
+        """
+        Build the deletion index over keys (a snapshot of self.keys) and return
+        it. Only reads settings, so it can run on another thread.
+        """
+        deletes = {}
+        for key in keys:
+            for variant in _deletes(key[:self.prefix_length], self.max_distance):
+                deletes.setdefault(variant, []).append(key)
+        logging.debug(f"Built deletion index with {len(deletes)} variants")
+        return deletes
+
+    def set_deletes(self, deletes, keys):
+        """Install a deletion index built over keys, adding the names added since the snapshot."""
+        built = set(keys)
+        for key in self.keys:
+            if key not in built:
+                for variant in _deletes(key[:self.prefix_length], self.max_distance):
+                    deletes.setdefault(variant, []).append(key)
+        self.deletes = deletes
+
+    def add(self, tag):
+        """Add a tag (or a more powerful duplicate of a known name) without rebuilding the index."""
+        key = tag.tag_name.lower()
+        known = key in self.best
+        if known and tag.power <= self.best[key][1]:
+            return
+        self.best[key] = (tag.tag_name, tag.power)
+        if not known:
+            bisect.insort(self.keys, key)
+            if self.deletes is not None:
+                for variant in _deletes(key[:self.prefix_length], self.max_distance):
+                    self.deletes.setdefault(variant, []).append(key)
+        for length in range(1, min(self.precomputed_prefix, len(key)) + 1):
+            top = [other for other in self.prefix_top.get(key[:length], ()) if other != key]
+            self.prefix_top[key[:length]] = heapq.nlargest(self.top_k, top + [key], key=self._power)
+
+    def _prefix_range(self, prefix):
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + '\uffff', lo)
+        return lo, hi
+
+    def complete(self, prefix, limit=None):
+        """Return up to limit tag names starting with prefix, highest power first."""
+        limit = limit or self.top_k
+        prefix = prefix.lower().strip()
+        if not prefix:
+            return []
+        if limit <= self.top_k and prefix in self.prefix_top:
+            keys = self.prefix_top[prefix][:limit]
+        else:
+            lo, hi = self._prefix_range(prefix)
+            keys = heapq.nlargest(limit, self.keys[lo:hi], key=self._power)
+        return [self.best[key][0] for key in keys]
+
+    def suggest(self, word, limit=5, max_distance=None, min_length=4):
+        """
+        Return up to limit tag names within max_distance edits of word, closest
+        first and then by power. Words shorter than min_length are too ambiguous
+        to correct and return nothing.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance
+        max_distance = min(max_distance, self.max_distance)
+        word = word.lower().strip()
+        if len(word) < min_length or self.deletes is None:
+            return []
+
+        candidates = set()
+        for variant in _deletes(word[:self.prefix_length], max_distance):
+            candidates.update(self.deletes.get(variant, ()))
+
+        matches = []
+        for key in candidates:
+            distance = bounded_levenshtein(word, key, max_distance)
+            if distance <= max_distance:
+                name, power = self.best[key]
+                matches.append((distance, -power, name))
+        matches.sort()
+        return [name for _, _, name in matches[:limit]]
+
+
+class FacetIndex:
+    """
+    The d_group and artist facets of the tag list, computed once at startup
+    and extended as tags are ingested.
+
+    d_groups maps each d_group to the ids (positions in the tag list) of its
+    tags. artists holds the ids of artist tags, highest power first.
+    """
+
+    def __init__(self, tags):
+        self.tags = tags
+        self.d_groups = {}
+        for tag_id, tag in enumerate(tags):
+            for group in tag.d_group:
+                self.d_groups.setdefault(group, []).append(tag_id)
+        artists = [tag_id for tag_id, tag in enumerate(tags) if tag.d_category == 'artist']
+        self.artists = sorted(artists, key=self._artist_key)
+        # (-power, name) of each artist, so ingested artists can be inserted in order
+        self.artist_keys = [self._artist_key(tag_id) for tag_id in self.artists]
+        logging.debug(f"Built facets: {len(self.d_groups)} d_groups, {len(self.artists)} artists")
+
+    def _artist_key(self, tag_id):
+        return -self.tags[tag_id].power, self.tags[tag_id].tag_name
+
+    def add(self, tag_id):
+        """Index a tag that was appended to the tag list."""
+        tag = self.tags[tag_id]
+        for group in tag.d_group:
+            self.d_groups.setdefault(group, []).append(tag_id)
+        if tag.d_category == 'artist':
+            key = self._artist_key(tag_id)
+            position = bisect.bisect_right(self.artist_keys, key)
+            self.artist_keys.insert(position, key)
+            self.artists.insert(position, tag_id)
+
+    def d_group_options(self):
+        """[(d_group, number of tags)] sorted by name."""
+        return [(group, len(self.d_groups[group])) for group in sorted(self.d_groups)]
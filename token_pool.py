@@ -0,0 +1,258 @@
+# token_pool.py
+import json
+import math
+import time
+import asyncio
+import logging
+import collections
+
+from nai_client import NovelAIError
+
+# 401: token revoked or mistyped, 402: no subscription or Anlas left. Neither fixes itself
+# while the app runs, so the token is set aside until it is entered again.
+DISABLE_STATUSES = {401, 402}
+# 429: the account is already generating or is being rate limited; back off and try it again later
+BACKOFF_STATUS = 429
+
+
+class NoTokenAvailable(Exception):
+    """Every token in the pool has been quarantined for good."""
+
+
+class PooledToken:
+    """One account's API token with its budget, quarantine state and usage counters."""
+
+    def __init__(self, token, name=None, max_concurrent=1, requests_per_minute=None):
+        self.token = token
+        self.name = name or f"...{token[-4:]}"
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.requests_per_minute = requests_per_minute
+        self.in_flight = 0
+        self.recent = collections.deque()  # monotonic start times within the last minute
+        self.quarantined_until = 0.0  # monotonic time, or math.inf until entered again
+        self.quarantine_reason = None
+        self.strikes = 0  # 429s in a row, for the backoff
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.statuses = collections.Counter()
+        self.bytes = 0
+        self.busy_seconds = 0.0
+
+    def rate_wait(self, now):
+        """Seconds until the requests-per-minute budget allows another request."""
+        while self.recent and now - self.recent[0] >= 60:
+            self.recent.popleft()
+        if not self.requests_per_minute or len(self.recent) < self.requests_per_minute:
+            return 0.0
+        return 60 - (now - self.recent[0])
+
+    def load(self):
+        return self.in_flight / self.max_concurrent
+
+    def metrics(self):
+        now = time.monotonic()
+        if self.quarantined_until == math.inf:
+            quarantine = self.quarantine_reason
+        elif self.quarantined_until > now:
+            quarantine = f"{self.quarantine_reason}, {self.quarantined_until - now:.0f} s left"
+        else:
+            quarantine = None
+        return {
+            'name': self.name,
+            'in_flight': self.in_flight,
+            'max_concurrent': self.max_concurrent,
+            'requests_per_minute': self.requests_per_minute,
+            'requests': self.requests,
+            'succeeded': self.succeeded,
+            'failed': self.failed,
+            'statuses': dict(self.statuses),
+            'bytes': self.bytes,
+            'average_seconds': self.busy_seconds / self.succeeded if self.succeeded else None,
+            'quarantine': quarantine,
+        }
+
+
+class TokenPool:
+    """
+    Spreads generation requests over several NovelAI accounts.
+
+    Each token has a budget of concurrent requests and, optionally, requests
+    per minute. generate() leases the least loaded token that has budget
+    left, waiting if none has. A token answered with 401 or 402 is
+    quarantined until it is added again, and one answered with 429 is
+    quarantined for an exponentially growing time (or the Retry-After the
+    server sent); either way the request moves on to another token. Leasing
+    happens on the asyncio loop running the requests, so the pool needs no
+    locks; the GUI only reads the counters.
+    """
+
+    def __init__(self, tokens=(), backoff=30, max_backoff=600, retries=2):
+        self.tokens = list(tokens)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = retries
+        self.changed = None  # asyncio.Condition, created on the loop on first use
+
+    @classmethod
+    def load(cls, path="apitoken.json"):
+        """
+        Read tokens from path: the single {"token": "..."} the app has always
+        saved, and/or a list under "tokens" of {"token": "...", "name": ...,
+        "max_concurrent": 1, "requests_per_minute": ...}.
+        """
+        pool = cls()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            logging.debug(f"{path} not found.")
+            return pool
+        except Exception as e:
+            logging.error(f"Failed to load API tokens: {e}")
+            return pool
+        if not isinstance(data, dict):
+            logging.error(f"Failed to load API tokens: {path} does not hold a JSON object")
+            return pool
+        for entry in data.get("tokens") or []:
+            if isinstance(entry, dict) and str(entry.get("token", "")).strip():
+                pool.add(entry["token"].strip(), entry.get("name"), entry.get("max_concurrent", 1),
+                         entry.get("requests_per_minute"))
+        if str(data.get("token", "")).strip():
+            pool.add(data["token"].strip())
+        logging.debug(f"Loaded {len(pool.tokens)} API tokens.")
+        return pool
+
+    def add(self, token, name=None, max_concurrent=1, requests_per_minute=None):
+        """Add a token, or lift the quarantine of one already in the pool."""
+        for pooled in self.tokens:
+            if pooled.token == token:
+                pooled.quarantined_until = 0.0
+                pooled.quarantine_reason = None
+                pooled.strikes = 0
+                return pooled
+        pooled = PooledToken(token, name, max_concurrent, requests_per_minute)
+        self.tokens.append(pooled)
+        return pooled
+
+    def usable(self):
+        """Tokens that are not quarantined for good."""
+        return [pooled for pooled in self.tokens if pooled.quarantined_until != math.inf]
+
+    def capacity(self):
+        """How many requests the usable tokens can have in flight together."""
+        return sum(pooled.max_concurrent for pooled in self.usable())
+
+    def _pick(self, now):
+        # Returns (token, None), or (None, seconds to wait before looking again)
+        usable = self.usable()
+        if not usable:
+            reasons = ", ".join(f"{pooled.name}: {pooled.quarantine_reason}" for pooled in self.tokens)
+            raise NoTokenAvailable(f"No usable API token ({reasons or 'none configured'})")
+        candidates = []
+        wait = math.inf
+        for pooled in usable:
+            if pooled.quarantined_until > now:
+                wait = min(wait, pooled.quarantined_until - now)
+            elif pooled.in_flight < pooled.max_concurrent:
+                rate_wait = pooled.rate_wait(now)
+                if rate_wait > 0:
+                    wait = min(wait, rate_wait)
+                else:
+                    candidates.append(pooled)
+        if not candidates:
+            return None, wait
+        return min(candidates, key=lambda pooled: (pooled.load(), len(pooled.recent), pooled.requests)), None
+
+    async def acquire(self):
+        if self.changed is None:
+            self.changed = asyncio.Condition()
+        async with self.changed:
+            while True:
+                now = time.monotonic()
+                pooled, wait = self._pick(now)
+                if pooled is not None:
+                    pooled.in_flight += 1
+                    pooled.requests += 1
+                    pooled.recent.append(now)
+                    return pooled
+                # Releases wake us up; tokens added from the GUI thread are noticed within a second
+                try:
+                    await asyncio.wait_for(self.changed.wait(), min(wait, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, pooled, started, status=None, size=0):
+        pooled.in_flight -= 1
+        if status is not None:
+            pooled.statuses[status] += 1
+        if status == 200:
+            pooled.succeeded += 1
+            pooled.bytes += size
+            pooled.busy_seconds += time.monotonic() - started
+            pooled.strikes = 0
+        else:
+            pooled.failed += 1
+        async with self.changed:
+            self.changed.notify_all()
+
+    def quarantine(self, pooled, error):
+        if error.status in DISABLE_STATUSES:
+            pooled.quarantined_until = math.inf
+        else:
+            pooled.strikes += 1
+            delay = error.retry_after or min(self.backoff * 2 ** (pooled.strikes - 1), self.max_backoff)
+            pooled.quarantined_until = time.monotonic() + delay
+        pooled.quarantine_reason = f"status {error.status}"
+        logging.warning(f"Quarantined API token {pooled.name} after status {error.status}")
+
+    async def generate(self, client, body):
+        """
+        Send body with the least loaded token and return the response, moving
+        on to another token when one is refused. Raises the last NovelAIError
+        if every attempt is refused, or NoTokenAvailable if no token is left.
+        """
+        last_error = None
+        for attempt in range(len(self.tokens) + self.retries):
+            try:
+                pooled = await self.acquire()
+            except NoTokenAvailable:
+                if last_error is not None:
+                    raise last_error
+                raise
+            started = time.monotonic()
+            try:
+                data = await client.generate(body, pooled.token)
+            except NovelAIError as e:
+                refused = e.status in DISABLE_STATUSES or e.status == BACKOFF_STATUS
+                # Quarantine before releasing, so no waiting request picks the token up in between
+                if refused:
+                    self.quarantine(pooled, e)
+                await self.release(pooled, started, e.status)
+                if not refused:
+                    raise
+                last_error = e
+                continue
+            except BaseException:
+                await self.release(pooled, started)
+                raise
+            await self.release(pooled, started, 200, len(data))
+            return data
+        raise last_error
+
+    def metrics(self):
+        return [pooled.metrics() for pooled in self.tokens]
+
+    def describe(self):
+        """One line of usage per token, for tooltips and the log."""
+        lines = []
+        for entry in self.metrics():
+            line = f"{entry['name']}: {entry['succeeded']} ok, {entry['failed']} failed"
+            if entry['average_seconds'] is not None:
+                line += f", {entry['average_seconds']:.1f} s avg"
+            if entry['in_flight']:
+                line += f", {entry['in_flight']}/{entry['max_concurrent']} running"
+            if entry['quarantine']:
+                line += f", quarantined ({entry['quarantine']})"
+            lines.append(line)
+        return "\n".join(lines)